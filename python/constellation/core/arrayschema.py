@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+SPDX-FileCopyrightText: 2024 DESY and the Constellation authors
+SPDX-License-Identifier: CC-BY-4.0
+
+Module providing the schema of typed array streams, declared once in the BOR
+so that data messages only need to carry raw bytes.
+"""
+
+from typing import Any, Sequence
+
+import numpy as np
+from numpy.lib.format import descr_to_dtype, dtype_to_descr
+
+
+class ArraySchema:
+    """Data type and shape of the arrays carried by each payload frame of a stream.
+
+    The data type may be any NumPy dtype including structured records. The
+    shape follows NumPy conventions, one dimension may be -1 to be inferred
+    from the frame size; the default shape (-1,) describes a flat array of
+    any length.
+
+    """
+
+    def __init__(self, dtype: Any, shape: Sequence[int] = (-1,)):
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(int(dim) for dim in shape)
+        if sum(dim < 0 for dim in self.shape) > 1:
+            raise ValueError(f"Can only infer one dimension of shape {self.shape}")
+
+    @property
+    def fixed(self) -> bool:
+        """Whether every frame holds an array of the same size."""
+        return all(dim >= 0 for dim in self.shape)
+
+    def to_meta(self) -> dict[str, Any]:
+        """Return the schema as serializable dictionary for the BOR meta."""
+        return {"dtype": dtype_to_descr(self.dtype), "shape": list(self.shape)}
+
+    @classmethod
+    def from_meta(cls, meta: dict[str, Any]) -> "ArraySchema":
+        """Create the schema from the dictionary sent with the BOR meta."""
+        return cls(descr_to_dtype(meta["dtype"]), meta.get("shape", (-1,)))
+
+    def view(self, payload: Any) -> Any:
+        """Return read-only arrays viewing the frames of a payload without copying.
+
+        Returns an array for single-frame payloads and a list of arrays for
+        multi-frame payloads.
+
+        """
+        if isinstance(payload, list):
+            return [self._view(frame) for frame in payload]
+        return self._view(payload)
+
+    def _view(self, frame: Any) -> np.ndarray:
+        if frame is None:
+            frame = b""
+        return np.frombuffer(frame, dtype=self.dtype).reshape(self.shape)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, ArraySchema) and self.dtype == other.dtype and self.shape == other.shape
+
+    def __repr__(self) -> str:
+        return f"ArraySchema({self.dtype!r}, {self.shape})"
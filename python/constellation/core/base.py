@@ -18,6 +18,7 @@ import coloredlogs  # type: ignore[import-untyped]
 
 from . import __version__, __version_code_name__
 from .network import validate_interface, get_interfaces
+from .zmqcontext import acquire_context, release_context
 
 
 @atexit.register
@@ -70,6 +71,13 @@ class ConstellationArgumentParser(ArgumentParser):
             "Use '*' to bind to alla available interfaces "
             "(default: %(default)s).",
         )
+        self.network.add_argument(
+            "--io-threads",
+            type=int,
+            default=1,
+            help="The number of I/O threads of the ZMQ context shared by all "
+            "components of the process (default: %(default)s).",
+        )
 
 
 EPILOG = "This command is part of the Constellation Python core package."
@@ -131,7 +139,7 @@ class BaseSatelliteFrame:
 
     """
 
-    def __init__(self, name: str, interface: str, **_kwds: Any):
+    def __init__(self, name: str, interface: str, io_threads: int = 1, **_kwds: Any):
         # type name == python class name
         self.type = type(self).__name__
         # Check if provided name is valid:
@@ -141,7 +149,10 @@ class BaseSatelliteFrame:
         self.name = f"{self.type}.{name}"
         logging.setLoggerClass(ConstellationLogger)
         self.log = cast(ConstellationLogger, logging.getLogger(name))
-        self.context = zmq.Context()
+        # all components of the process share a single ZMQ context
+        self.context: zmq.Context = acquire_context(io_threads)  # type: ignore[type-arg]
+        # reentry may be called more than once, the context is released once
+        self._context_released = False
 
         self.interface = interface
 
@@ -200,8 +211,10 @@ class BaseSatelliteFrame:
         """Orderly destroy the satellite."""
         self.log.debug("Stopping all communication threads.")
         self._stop_com_threads()
-        self.log.debug("Terminating ZMQ context.")
-        self.context.term()
+        if not self._context_released:
+            self.log.debug("Releasing ZMQ context.")
+            release_context()
+            self._context_released = True
 
 
 SATELLITE_LIST: list[BaseSatelliteFrame] = []
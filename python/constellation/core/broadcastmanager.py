@@ -171,6 +171,16 @@ class CHIRPBroadcaster(BaseSatelliteFrame):
             self.log.warning("Replacing service registration for port %d", port)
         self._registered_services[port] = serviceid
 
+    def unregister_offer(self, port: int) -> None:
+        """Remove offered service and broadcast its departure."""
+        try:
+            serviceid = self._registered_services.pop(port)
+        except KeyError:
+            self.log.warning("No service registered for port %d", port)
+            return
+        self.log.debug("Broadcasting service DEPART on %d for %s", port, serviceid)
+        self._beacon.broadcast(serviceid, CHIRPMessageType.DEPART, port)
+
     def request(self, serviceid: CHIRPServiceIdentifier) -> None:
         """Request specific service.
 
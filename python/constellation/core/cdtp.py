@@ -6,13 +6,46 @@ SPDX-License-Identifier: CC-BY-4.0
 Module implementing the Constellation Data Transmission Protocol.
 """
 
+from collections import deque
 from enum import Enum
 from typing import Any
 
 import msgpack  # type: ignore[import-untyped]
 import zmq
 
-from .protocol import MessageHeader, Protocol
+from .compression import decompress
+from .protocol import EMPTY_META, MessageHeader, Protocol
+from .shmring import ShmRingBuffer
+
+# header meta key describing the payloads coalesced into a batched DAT message
+BATCH_META_KEY = "_batch"
+# header meta key naming the codec payload frames are compressed with
+CODEC_META_KEY = "_codec"
+# BOR/EOR meta keys identifying the data lane of a sender and the number of lanes
+LANE_META_KEY = "_lane"
+LANES_META_KEY = "_lanes"
+# header meta key naming the shared memory ring buffer holding the payload
+# frames and their descriptors
+SHM_META_KEY = "_shm"
+# BOR meta key holding the port a sender accepts credit for data messages on
+CREDIT_META_KEY = "_credit"
+# BOR meta key holding the options applied to the socket of a sender
+SOCKET_META_KEY = "_socket"
+# BOR meta key declaring the data type and shape of the arrays in all payload
+# frames of a typed stream
+SCHEMA_META_KEY = "_schema"
+
+
+def encode_credit(messages: int, nbytes: int) -> bytes:
+    """Encode a grant of credit for a number of data messages and payload bytes."""
+    res: bytes = msgpack.packb([messages, nbytes])
+    return res
+
+
+def decode_credit(binmsg: bytes) -> tuple[int, int]:
+    """Decode a grant of credit into the number of data messages and payload bytes."""
+    messages, nbytes = msgpack.unpackb(binmsg)
+    return messages, nbytes
 
 
 class CDTPMessageIdentifier(Enum):
@@ -34,6 +67,8 @@ class CDTPMessage:
     name: str = ""
     msgtype: CDTPMessageIdentifier | None = None
     sequence_number: int = -1
+    # data lane of the sender the message was received on
+    lane: int = 0
     meta: dict[str, Any] = {}
     payload: Any = None
 
@@ -69,20 +104,40 @@ class CDTPMessage:
 class DataTransmitter:
     """Base class for sending Constellation data packets via ZMQ."""
 
-    def __init__(self, name: str, socket: zmq.Socket | None):  # type: ignore[type-arg]
+    def __init__(
+        self,
+        name: str,
+        socket: zmq.Socket | None,  # type: ignore[type-arg]
+        ring: ShmRingBuffer | None = None,
+    ):
         """Initialize transmitter.
 
         socket: the ZMQ socket to use if no other is specified on send()/recv()
         calls.
 
         name: the name to use in the message header.
+
+        ring: shared memory ring buffer to pass data payloads through to a
+        receiver on the same host. Only descriptors are sent via the socket.
+        Payloads are sent via the socket if they do not fit into the buffer.
         """
         self.name: str = name
         self.msgheader: MessageHeader = MessageHeader(name, Protocol.CDTP)
+        # pre-packed header beginning per message type; only sequence number
+        # and meta need to be packed for each message
+        self._header_prefixes: dict[CDTPMessageIdentifier, bytes] = {
+            msgtype: self.msgheader.encode_prefix(msgtype.value) for msgtype in CDTPMessageIdentifier
+        }
+        self._packer = msgpack.Packer()
         # if no socket: might just use the transmitter for decoding
         # TODO : refactorize into own class
         self._socket: zmq.Socket | None = socket  # type: ignore[type-arg]
         self.sequence_number: int = 0
+        # messages decoded from a batch but not yet returned by recv()
+        self._pending: deque[CDTPMessage] = deque()
+        self.ring = ring
+        # ring buffers of senders attached to while decoding
+        self._rings: dict[str, ShmRingBuffer] = {}
 
     def send_start(self, payload: Any, meta: dict[str, Any] | None = None, flags: int = 0) -> None:
         """
@@ -104,28 +159,81 @@ class DataTransmitter:
             flags=flags,
         )
 
-    def send_data(self, payload: Any, meta: dict[str, Any] | None = None, flags: int = 0) -> None:
+    def send_data(
+        self,
+        payload: Any,
+        meta: dict[str, Any] | None = None,
+        flags: int = 0,
+        track: bool = False,
+    ) -> zmq.MessageTracker | None:
         """
         Send data message of data run over a ZMQ socket.
 
         Follows the Constellation Data Transmission Protocol.
 
-        payload: meta information about the beginning of run.
+        payload: data to send. Any object supporting the buffer protocol (e.g.
+        bytes or a contiguous NumPy array) is handed to ZMQ without copying it;
+        a list of such objects is sent as a multi-frame message.
 
         meta: optional dictionary that is sent as a map of string/value
         pairs with the header.
 
         flags: additional ZMQ socket flags to use during transmission.
 
+        track: whether to return a zmq.MessageTracker which is done once ZMQ
+        has released all payload buffers and they can safely be reused.
+
         """
         self.sequence_number += 1
-        self._dispatch(
+        return self._dispatch(
             msgtype=CDTPMessageIdentifier.DAT,
             payload=payload,
             meta=meta,
             flags=flags,
+            track=track,
         )
 
+    def send_data_batch(
+        self,
+        batch: list[tuple[Any, dict[str, Any] | None]],
+        flags: int = 0,
+        track: bool = False,
+    ) -> zmq.MessageTracker | None:
+        """
+        Send several data payloads coalesced into a single multi-frame message.
+
+        Each payload is assigned its own consecutive sequence number. The
+        number of frames and the meta of every payload are transmitted in the
+        header meta, allowing the receiver to split the message again.
+
+        batch: list of (payload, meta) tuples, see send_data().
+
+        flags: additional ZMQ socket flags to use during transmission.
+
+        track: whether to return a zmq.MessageTracker for all payload buffers.
+
+        """
+        frames: list[Any] = []
+        index: list[tuple[int, dict[str, Any]]] = []
+        for payload, meta in batch:
+            payload_frames = _payload_frames(payload)
+            frames.extend(payload_frames)
+            index.append((len(payload_frames), meta or {}))
+        # header carries the sequence number of the first payload
+        self.sequence_number += 1
+        try:
+            tracker = self._dispatch(
+                msgtype=CDTPMessageIdentifier.DAT,
+                payload=frames,
+                meta={BATCH_META_KEY: index},
+                flags=flags,
+                track=track,
+            )
+        finally:
+            # sequence numbers are used up even if sending failed
+            self.sequence_number += len(batch) - 1
+        return tracker
+
     def send_end(self, payload: Any, meta: dict[str, Any] | None = None, flags: int = 0) -> None:
         """
         Send ending message of data run over a ZMQ socket.
@@ -145,16 +253,31 @@ class DataTransmitter:
             flags=flags,
         )
 
+    def encode(self, msgtype: CDTPMessageIdentifier, payload: Any = None, meta: dict[str, Any] | None = None) -> list[Any]:
+        """Return the frames of a message with the current sequence number without sending it.
+
+        BOR and EOR payloads are serialized, data payloads are split into
+        frames without copying them. This allows sending the message via other
+        means, e.g. an asyncio socket.
+
+        """
+        if msgtype != CDTPMessageIdentifier.DAT:
+            payload = msgpack.packb(payload)
+        return [self._encode_header(msgtype, meta)] + _payload_frames(payload)
+
     def recv(self, flags: int = 0) -> CDTPMessage | None:
         """Receive a multi-part data transmission.
 
-        Follows the Constellation Data Transmission Protocol.
+        Follows the Constellation Data Transmission Protocol. Batched data
+        messages are split and returned one at a time by subsequent calls.
 
         flags: additional ZMQ socket flags to use during transmission.
 
         Returns: CTDPMessage
 
         """
+        if self._pending:
+            return self._pending.popleft()
         # check that we have a valid socket
         if not self._socket:
             return None
@@ -162,12 +285,80 @@ class DataTransmitter:
             binmsg = self._socket.recv_multipart(flags=flags)
         except zmq.ZMQError:
             return None
-        return self.decode(binmsg)
+        self._pending.extend(self.decode_messages(binmsg))
+        return self._pending.popleft()
 
     def decode(self, binmsg: list[bytes]) -> CDTPMessage:
-        """Decode a binary message into a CTDPMessage."""
+        """Decode a binary message into a CTDPMessage.
+
+        Batched data messages need to be decoded via decode_messages().
+
+        """
+        header = self._decode_header(binmsg)
+        binmsg = self._shared_frames(binmsg, header[3])
+        if BATCH_META_KEY in header[3]:
+            raise RuntimeError("Cannot decode batched data message into single CDTPMessage")
+        return self._decode_single(header, binmsg)
+
+    def decode_messages(self, binmsg: list[bytes]) -> list[CDTPMessage]:
+        """Decode a binary message into a list of CTDPMessages.
+
+        Returns a single message unless a batched data message is decoded, in
+        which case every payload is returned as individual message.
+
+        """
+        header = self._decode_header(binmsg)
+        name, msgtype, seqno, meta = header
+        binmsg = self._shared_frames(binmsg, meta)
+        if msgtype != CDTPMessageIdentifier.DAT.value or BATCH_META_KEY not in meta:
+            return [self._decode_single(header, binmsg)]
+        msgs = []
+        offset = 1
+        for idx, (nframes, payload_meta) in enumerate(meta[BATCH_META_KEY]):
+            msg = CDTPMessage()
+            msg.set_header(name, msgtype, seqno + idx, payload_meta)
+            msg.payload = _frames_payload(_decompress_frames(binmsg[offset : offset + nframes], payload_meta))
+            offset += nframes
+            msgs.append(msg)
+        return msgs
+
+    def close(self) -> None:
+        """Detach from all shared memory ring buffers attached to while decoding."""
+        for ring in self._rings.values():
+            ring.close()
+        self._rings = {}
+
+    def _shared_frames(self, binmsg: list[bytes], meta: dict[str, Any]) -> list[Any]:
+        """Replace payload frames by those held in shared memory as indicated in the meta."""
+        shm = meta.pop(SHM_META_KEY, None)
+        if not shm:
+            return binmsg
+        name, descriptors = shm
+        try:
+            ring = self._rings[name]
+        except KeyError:
+            ring = ShmRingBuffer(name)
+            self._rings[name] = ring
+        return binmsg[:1] + ring.read(descriptors)
+
+    def _encode_header(self, msgtype: CDTPMessageIdentifier, meta: dict[str, Any] | None) -> bytes:
+        """Encode message header with the current sequence number."""
+        header: bytes = self._header_prefixes[msgtype] + self._packer.pack(self.sequence_number)
+        header += self._packer.pack(meta) if meta else EMPTY_META
+        return header
+
+    def _decode_header(self, binmsg: list[bytes]) -> tuple[str, int, int, dict[str, Any]]:
+        """Decode the header frame of a binary message."""
+        header = self.msgheader.decode(binmsg[0])
+        # assert to help mypy determine len of tuple returned
+        assert len(header) == 4, "Header decoding resulted in too few values for CDTP."
+        name, msgtype, seqno, meta = header
+        return name, msgtype, seqno, meta or {}
+
+    def _decode_single(self, header: tuple[str, int, int, dict[str, Any]], binmsg: list[bytes]) -> CDTPMessage:
+        """Create a CTDPMessage from a decoded header and the binary message."""
         msg = CDTPMessage()
-        msg.set_header(*self.msgheader.decode(binmsg[0]))
+        msg.set_header(*header)
 
         # Retrieve payload
         if msg.msgtype in [CDTPMessageIdentifier.EOR, CDTPMessageIdentifier.BOR]:
@@ -175,13 +366,7 @@ class DataTransmitter:
             msg.payload = msgpack.unpackb(binmsg[1])
         else:
             # one-or-many binary frames
-            msg.payload = binmsg[1:]
-            if len(msg.payload) <= 1:
-                # unpack list
-                try:
-                    msg.payload = binmsg[1]
-                except IndexError:
-                    msg.payload = None
+            msg.payload = _frames_payload(_decompress_frames(binmsg[1:], msg.meta))
         return msg
 
     def _dispatch(
@@ -190,7 +375,8 @@ class DataTransmitter:
         payload: Any = None,
         meta: dict[str, Any] | None = None,
         flags: int = 0,
-    ) -> None:
+        track: bool = False,
+    ) -> zmq.MessageTracker | None:
         """Dispatch CDTP message.
 
         msgtype: flag identifying whether transmitting beginning-of-run, data or end-of-run
@@ -201,34 +387,81 @@ class DataTransmitter:
 
         flags: additional ZMQ socket flags to use during transmission.
 
-        Returns: None
+        track: whether to track the payload frames until ZMQ released them.
+
+        Returns: zmq.MessageTracker if tracking was requested, otherwise None.
 
         """
         # check that we have a valid socket
         if not self._socket:
-            return
+            return None
 
-        if payload:
+        frames = _payload_frames(payload)
+        if self.ring and frames and msgtype == CDTPMessageIdentifier.DAT:
+            descriptors = self.ring.write(frames)
+            if descriptors is not None:
+                meta = {**(meta or {}), SHM_META_KEY: [self.ring.name, descriptors]}
+                frames = []
+        if frames:
             flags = zmq.SNDMORE | flags
         # message header
-        self.msgheader.send(
-            self._socket,
-            meta=meta,
-            flags=flags,
-            msgtype=msgtype.value,
-            seqno=self.sequence_number,
-        )
+        self._socket.send(self._encode_header(msgtype, meta), flags=flags)
 
         # payload
-        if payload:
-            # send multiple frames?
-            if isinstance(payload, list):
-                for idx, frame in enumerate(payload):
-                    # final package?
-                    if idx == len(payload) - 1:
-                        flags = flags & (~zmq.SNDMORE)  # flip SNDMORE bit
-                    self._socket.send(frame, flags=flags)
-            else:
-                # single frame
+        trackers = []
+        for idx, frame in enumerate(frames):
+            # final package?
+            if idx == len(frames) - 1:
                 flags = flags & (~zmq.SNDMORE)  # flip SNDMORE bit
-                self._socket.send(payload, flags=flags)
+            # hand the buffer over to ZMQ without copying it
+            tracker = self._socket.send(frame, flags=flags, copy=False, track=track)
+            if tracker is not None:
+                trackers.append(tracker)
+        if track:
+            return zmq.MessageTracker(*trackers)
+        return None
+
+
+def _payload_frames(payload: Any) -> list[Any]:
+    """Split a payload into the list of frames to send."""
+    if payload is None:
+        return []
+    if isinstance(payload, list):
+        # send multiple frames
+        return payload
+    if isinstance(payload, (bytes, str)) and not payload:
+        return []
+    # single frame
+    return [payload]
+
+
+def _frames_payload(frames: list[Any]) -> Any:
+    """Turn list of received frames into a payload."""
+    if not frames:
+        return None
+    if len(frames) == 1:
+        # unpack list
+        return frames[0]
+    return frames
+
+
+def _decompress_frames(frames: list[Any], meta: dict[str, Any]) -> list[Any]:
+    """Undo compression of received frames as indicated in the meta."""
+    codec = meta.pop(CODEC_META_KEY, None)
+    if not codec:
+        return frames
+    return [decompress(codec, frame) for frame in frames]
+
+
+def payload_nbytes(payload: Any) -> int:
+    """Return the number of bytes held by a (multi-frame) payload."""
+    if payload is None:
+        return 0
+    if isinstance(payload, list):
+        return sum(payload_nbytes(frame) for frame in payload)
+    if isinstance(payload, str):
+        return len(payload)
+    try:
+        return memoryview(payload).nbytes
+    except TypeError:
+        return 0
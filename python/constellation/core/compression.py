@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+SPDX-FileCopyrightText: 2024 DESY and the Constellation authors
+SPDX-License-Identifier: CC-BY-4.0
+
+Module providing compression codecs for data payloads.
+"""
+
+import time
+import zlib
+from threading import Lock
+from typing import Any, Callable
+
+# available codecs: name -> (compress(data, level), decompress(data))
+CODECS: dict[str, tuple[Callable[[Any, int | None], bytes], Callable[[Any], bytes]]] = {
+    "zlib": (
+        lambda data, level: zlib.compress(data, -1 if level is None else level),
+        zlib.decompress,
+    ),
+}
+
+try:
+    import lz4.frame  # type: ignore[import-untyped, import-not-found, unused-ignore]
+
+    CODECS["lz4"] = (
+        lambda data, level: lz4.frame.compress(data, compression_level=0 if level is None else level),
+        lz4.frame.decompress,
+    )
+except ImportError:
+    pass
+
+try:
+    import zstandard  # type: ignore[import-not-found, unused-ignore]
+
+    CODECS["zstd"] = (
+        lambda data, level: zstandard.compress(data, 3 if level is None else level),
+        zstandard.decompress,
+    )
+except ImportError:
+    pass
+
+# preferred codecs when selecting automatically, fastest first
+_PREFERENCE = ["zstd", "lz4", "zlib"]
+
+
+def best_codec() -> str:
+    """Return the name of the fastest installed codec."""
+    return next(codec for codec in _PREFERENCE if codec in CODECS)
+
+
+def decompress(codec: str, data: Any) -> bytes:
+    """Decompress a single frame compressed with the given codec."""
+    try:
+        _, decompressor = CODECS[codec]
+    except KeyError as e:
+        raise RuntimeError(f"Codec '{codec}' is not available for decompression") from e
+    return decompressor(data)
+
+
+class Compressor:
+    """Compress payloads with a codec and keep statistics.
+
+    The compress() method is thread-safe and can be used from a worker pool;
+    all codecs release the GIL while compressing.
+
+    """
+
+    def __init__(self, codec: str, level: int | None = None):
+        """Initialize compressor.
+
+        codec: name of the codec, or 'auto' for the fastest installed one.
+
+        level: compression level, or None for the default of the codec.
+
+        """
+        if codec == "auto":
+            codec = best_codec()
+        try:
+            self._compress, _ = CODECS[codec]
+        except KeyError as e:
+            raise ValueError(f"Unknown or unavailable compression codec '{codec}'") from e
+        self.codec = codec
+        self.level = level
+        self._lock = Lock()
+        # totals of uncompressed and compressed bytes and CPU time [s] spent
+        self.nbytes_in = 0
+        self.nbytes_out = 0
+        self.cpu_time = 0.0
+
+    def compress(self, payload: Any) -> Any:
+        """Compress a single- or multi-frame payload frame by frame."""
+        t0 = time.thread_time()
+        if isinstance(payload, list):
+            frames = payload
+        elif payload is None:
+            frames = []
+        else:
+            frames = [payload]
+        nbytes_in = 0
+        compressed = []
+        for frame in frames:
+            nbytes_in += memoryview(frame).nbytes
+            compressed.append(self._compress(frame, self.level))
+        with self._lock:
+            self.nbytes_in += nbytes_in
+            self.nbytes_out += sum(len(frame) for frame in compressed)
+            self.cpu_time += time.thread_time() - t0
+        if isinstance(payload, list):
+            return compressed
+        return compressed[0] if compressed else None
+
+    def get_ratio(self) -> float | None:
+        """Return the achieved compression ratio (uncompressed/compressed)."""
+        with self._lock:
+            if not self.nbytes_out:
+                return None
+            return self.nbytes_in / self.nbytes_out
+
+    def get_cpu_time(self) -> float:
+        """Return the total CPU time [s] spent on compression."""
+        with self._lock:
+            return self.cpu_time
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+SPDX-FileCopyrightText: 2024 DESY and the Constellation authors
+SPDX-License-Identifier: CC-BY-4.0
+
+Module providing a bounded queue for data payloads awaiting transmission.
+"""
+
+import struct
+import tempfile
+from enum import StrEnum
+from collections import deque
+from queue import Full, Queue
+from time import monotonic
+from typing import Any, BinaryIO
+
+import msgpack  # type: ignore[import-untyped]
+
+from .cdtp import CDTPMessageIdentifier, payload_nbytes
+
+
+class QueuePolicy(StrEnum):
+    """Defines what happens to payloads queued when the DataQueue is full."""
+
+    BLOCK = "block"
+    DROP_NEWEST = "drop_newest"
+    DROP_OLDEST = "drop_oldest"
+    SPILL = "spill"
+
+
+# prefix of records in the spill file: record length and payload bytes counted
+# towards the limits
+_RECORD_HEADER = struct.Struct("<IQ")
+
+
+class DataQueue(Queue):  # type: ignore[type-arg]
+    """Queue of (payload, meta) tuples with limits on items and bytes held.
+
+    BOR/EOR items (meta being a CDTPMessageIdentifier) are never dropped and
+    do not count towards the limits. When the limits are reached, the policy
+    decides whether to block the producer, drop the newest or oldest data
+    payload, or to spill payloads into a local file from which they are read
+    back in order once the queue drains.
+
+    """
+
+    def __init__(
+        self,
+        max_items: int = 0,
+        max_bytes: int = 0,
+        policy: QueuePolicy = QueuePolicy.BLOCK,
+        spill_path: str | None = None,
+    ):
+        """Initialize queue.
+
+        max_items: maximum number of payloads in memory (0 for no limit).
+
+        max_bytes: maximum number of payload bytes in memory (0 for no limit).
+
+        policy: what to do with payloads queued while the queue is full.
+
+        spill_path: directory for the spill file (default: system temp dir).
+
+        """
+        super().__init__()
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.policy = QueuePolicy(policy)
+        self.spill_path = spill_path
+        # payloads and payload bytes currently held in memory
+        self.nitems = 0
+        self.nbytes = 0
+        # total number of payloads dropped
+        self.dropped = 0
+        # total number of bytes and payloads written to the spill file
+        self.spilled_bytes = 0
+        self.spilled_items = 0
+        self._spill_file: BinaryIO | None = None
+        self._spill_read_pos = 0
+        self._spill_count = 0
+        # enqueue times of all items (in memory and spilled) in order
+        self._stamps: deque[float] = deque()
+        # enqueue time of the item returned last by get()
+        self.enqueued_at = 0.0
+
+    def put(self, item: Any, block: bool = True, timeout: float | None = None) -> None:
+        """Put a (payload, meta) tuple into the queue, applying the policy."""
+        payload, meta = item
+        size = payload_nbytes(payload) if not isinstance(meta, CDTPMessageIdentifier) else 0
+        with self.not_full:
+            if self._spill_count:
+                # keep order: everything goes behind the spilled payloads
+                self._spill(item, size)
+            elif isinstance(meta, CDTPMessageIdentifier) or not self._full(size):
+                self._put(item)
+            elif self.policy == QueuePolicy.BLOCK:
+                self._wait_not_full(size, block, timeout)
+                self._put(item)
+            elif self.policy == QueuePolicy.DROP_NEWEST:
+                self.dropped += 1
+                return
+            elif self.policy == QueuePolicy.DROP_OLDEST:
+                while self._full(size) and self._drop_oldest():
+                    pass
+                self._put(item)
+            else:
+                self._spill(item, size)
+            self._stamps.append(monotonic())
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def spill_depth(self) -> int:
+        """Return the number of payloads currently held in the spill file."""
+        with self.mutex:
+            return self._spill_count
+
+    def close(self) -> None:
+        """Close and remove the spill file."""
+        with self.mutex:
+            if self._spill_file:
+                self._spill_file.close()
+                self._spill_file = None
+            self._spill_read_pos = 0
+            self._spill_count = 0
+
+    def _full(self, size: int) -> bool:
+        """Whether adding a payload of given size would exceed the limits."""
+        if not self.nitems:
+            # always accept at least one payload to guarantee progress
+            return False
+        if self.max_items > 0 and self.nitems >= self.max_items:
+            return True
+        return self.max_bytes > 0 and self.nbytes + size > self.max_bytes
+
+    def _wait_not_full(self, size: int, block: bool, timeout: float | None) -> None:
+        """Wait for space to free up, see Queue.put()."""
+        if not block:
+            if self._full(size):
+                raise Full
+        elif timeout is None:
+            while self._full(size):
+                self.not_full.wait()
+        elif timeout < 0:
+            raise ValueError("'timeout' must be a non-negative number")
+        else:
+            endtime = monotonic() + timeout
+            while self._full(size):
+                remaining = endtime - monotonic()
+                if remaining <= 0.0:
+                    raise Full
+                self.not_full.wait(remaining)
+
+    def _drop_oldest(self) -> bool:
+        """Drop the oldest data payload from memory; return False if none left."""
+        for idx, (payload, meta) in enumerate(self.queue):
+            if not isinstance(meta, CDTPMessageIdentifier):
+                del self.queue[idx]
+                del self._stamps[idx]
+                self.nitems -= 1
+                self.nbytes -= payload_nbytes(payload)
+                self.dropped += 1
+                # dropped payloads are never processed
+                self.unfinished_tasks -= 1
+                if not self.unfinished_tasks:
+                    self.all_tasks_done.notify_all()
+                return True
+        return False
+
+    def _spill(self, item: Any, size: int) -> None:
+        """Append an item to the spill file."""
+        payload, meta = item
+        if isinstance(meta, CDTPMessageIdentifier):
+            record = [meta.value, payload, None]
+        elif isinstance(payload, list):
+            record = [None, [memoryview(frame).tobytes() for frame in payload], meta]
+        elif payload is None or isinstance(payload, str):
+            record = [None, payload, meta]
+        else:
+            record = [None, memoryview(payload).tobytes(), meta]
+        if not self._spill_file:
+            self._spill_file = tempfile.TemporaryFile(prefix="constellation_spill_", dir=self.spill_path)
+        data = msgpack.packb(record)
+        self._spill_file.seek(0, 2)
+        self._spill_file.write(_RECORD_HEADER.pack(len(data), size))
+        self._spill_file.write(data)
+        self._spill_count += 1
+        self.spilled_items += 1
+        self.spilled_bytes += size
+
+    def _next_spilled_size(self) -> int:
+        """Return the size counted for the oldest item in the spill file."""
+        assert self._spill_file
+        self._spill_file.seek(self._spill_read_pos)
+        _, size = _RECORD_HEADER.unpack(self._spill_file.read(_RECORD_HEADER.size))
+        return int(size)
+
+    def _unspill(self) -> Any:
+        """Read the oldest item back from the spill file."""
+        assert self._spill_file
+        self._spill_file.seek(self._spill_read_pos)
+        length, _ = _RECORD_HEADER.unpack(self._spill_file.read(_RECORD_HEADER.size))
+        msgtype, payload, meta = msgpack.unpackb(self._spill_file.read(length))
+        self._spill_read_pos += _RECORD_HEADER.size + length
+        self._spill_count -= 1
+        if not self._spill_count:
+            # drained, start over with an empty file
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+            self._spill_read_pos = 0
+        if msgtype is not None:
+            return payload, CDTPMessageIdentifier(msgtype)
+        return payload, meta
+
+    def _qsize(self) -> int:
+        return len(self.queue) + self._spill_count
+
+    def _put(self, item: Any) -> None:
+        payload, meta = item
+        if not isinstance(meta, CDTPMessageIdentifier):
+            self.nitems += 1
+            self.nbytes += payload_nbytes(payload)
+        self.queue.append(item)
+
+    def _get(self) -> Any:
+        if not self.queue:
+            # accounted like any other item held in memory
+            self._put(self._unspill())
+        item = self.queue.popleft()
+        self.enqueued_at = self._stamps.popleft()
+        payload, meta = item
+        if not isinstance(meta, CDTPMessageIdentifier):
+            self.nitems -= 1
+            self.nbytes -= payload_nbytes(payload)
+        # refill memory from the spill file within the limits
+        while self._spill_count and not self._full(self._next_spilled_size()):
+            self._put(self._unspill())
+        return item
@@ -8,40 +8,255 @@ Base module for Constellation Satellites that receive data.
 
 import datetime
 import pathlib
-import sys
 import threading
+import time
 
 import zmq
 from uuid import UUID
 from functools import partial
-from typing import Any, Tuple
+from multiprocessing.connection import Connection, wait
+from queue import Full
+from typing import Any, Tuple, cast
 
+from .arrayschema import ArraySchema
 from .broadcastmanager import chirp_callback, DiscoveredService
-from .cdtp import CDTPMessage, CDTPMessageIdentifier, DataTransmitter
+from .cdtp import (
+    CODEC_META_KEY,
+    CREDIT_META_KEY,
+    LANE_META_KEY,
+    SCHEMA_META_KEY,
+    CDTPMessage,
+    CDTPMessageIdentifier,
+    DataTransmitter,
+    encode_credit,
+    payload_nbytes,
+)
+from .compression import CODECS
+from .configuration import Configuration
+from .dataqueue import DataQueue
 from .cmdp import MetricsType
 from .chirp import CHIRPServiceIdentifier
 from .commandmanager import cscp_requestable
 from .cscp import CSCPMessage
 from .fsm import SatelliteState
+from .network import is_local_address
+from .receivershard import ReceiverShard
 from .satellite import Satellite
+from .shmring import ipc_endpoint
+from .zmqcontext import set_affinity
+
+# buffer entry telling a writer thread to finish
+_END_OF_BUFFER = (None, None)
+# frame size [B] from which frames are received without copying
+_COPY_THRESHOLD = 4096
+# buffer entry meta telling a writer thread to continue in the file of a new segment
+_NEXT_SEGMENT = "next_segment"
+
+
+class SequenceTracker:
+    """Track the sequence numbers of the data messages of a sender's data lane.
+
+    Messages arriving in order only cost a single comparison. Sequence numbers
+    skipped are remembered as ranges of missing messages, so that messages
+    arriving late can be told apart from duplicates.
+
+    """
+
+    # number of missing ranges remembered; older ones are considered lost
+    MAX_MISSING_RANGES = 1024
+
+    def __init__(self) -> None:
+        # sequence number of the first data message of a run
+        self.expected = 1
+        self.received = 0
+        self.gaps = 0
+        self.duplicates = 0
+        self.reordered = 0
+        # [start, end) ranges of sequence numbers not received yet
+        self._missing: list[list[int]] = []
+        self._forgotten = 0
+
+    def check(self, seqno: int) -> bool:
+        """Account for a received sequence number; return whether it was in order."""
+        self.received += 1
+        if seqno == self.expected:
+            self.expected += 1
+            return True
+        if seqno > self.expected:
+            # skipped messages might still arrive later
+            self.gaps += 1
+            self._missing.append([self.expected, seqno])
+            if len(self._missing) > self.MAX_MISSING_RANGES:
+                start, end = self._missing.pop(0)
+                self._forgotten += end - start
+            self.expected = seqno + 1
+            return False
+        for idx, (start, end) in enumerate(self._missing):
+            if start <= seqno < end:
+                self.reordered += 1
+                # remove the late message from the range
+                if start == seqno and seqno + 1 == end:
+                    del self._missing[idx]
+                elif start == seqno:
+                    self._missing[idx][0] = seqno + 1
+                else:
+                    self._missing[idx][1] = seqno
+                    if seqno + 1 < end:
+                        self._missing.insert(idx + 1, [seqno + 1, end])
+                return False
+        self.received -= 1
+        self.duplicates += 1
+        return False
+
+    def finish(self, last_seqno: int) -> None:
+        """Account for messages missing at the end of the run given the sequence number of the EOR."""
+        if last_seqno >= self.expected:
+            self.gaps += 1
+            self._missing.append([self.expected, last_seqno + 1])
+            self.expected = last_seqno + 1
+
+    @property
+    def lost(self) -> int:
+        """Number of messages skipped and not received since."""
+        return self._forgotten + sum(end - start for start, end in self._missing)
+
+
+class CreditGrant:
+    """Credit granted to a sender for data messages and payload bytes.
+
+    The full window is granted at the beginning of the run. Credit for
+    messages written is returned to the sender once half of the window has
+    been consumed, so that the sender never holds more than a window of
+    unwritten data in flight.
+
+    """
+
+    def __init__(self, socket: zmq.Socket, messages: int, nbytes: int):  # type: ignore[type-arg]
+        self.socket = socket
+        self.window_messages = messages
+        self.window_bytes = nbytes
+        self.consumed_messages = 0
+        self.consumed_bytes = 0
+        self.socket.send(encode_credit(messages, nbytes))
+
+    def consume(self, nbytes: int) -> None:
+        """Account for a data message written and return credit if due."""
+        self.consumed_messages += 1
+        self.consumed_bytes += nbytes
+        if 2 * self.consumed_messages >= self.window_messages or 2 * self.consumed_bytes >= self.window_bytes:
+            self.socket.send(encode_credit(self.consumed_messages, self.consumed_bytes))
+            self.consumed_messages = 0
+            self.consumed_bytes = 0
+
+    def close(self) -> None:
+        """Close the socket to the sender."""
+        self.socket.close(linger=0)
+
+
+class SegmentSwitch:
+    """Switch of the writer threads from the file of a segment of a run to the next.
+
+    Every writer thread leaves the old file once it has written all messages
+    received before the switch. The last one to leave closes the old file in
+    the background, so that writing continues in the new file meanwhile.
+
+    """
+
+    def __init__(self, old: Any, new: Any, writers: int, close: Any):
+        self.old = old
+        self.new = new
+        self._remaining = writers
+        self._close = close
+        self._lock = threading.Lock()
+        self.closer: threading.Thread | None = None
+
+    def leave(self) -> None:
+        """Account for a writer thread having moved on to the new file."""
+        with self._lock:
+            self._remaining -= 1
+            if self._remaining:
+                return
+        self.closer = threading.Thread(target=self._close, args=(self.old,), name="segment_closer", daemon=True)
+        self.closer.start()
 
 
 class DataReceiver(Satellite):
     """Constellation Satellite which receives data via ZMQ."""
 
     def __init__(self, *args: Any, **kwargs: Any):
-        # define our attributes
-        self._pull_interfaces: dict[UUID, Tuple[str, int]] = {}
-        self._pull_sockets: dict[UUID, zmq.Socket] = {}  # type: ignore[type-arg]
+        self._init_receiver()
+        # initialize Satellite attributes
+        super().__init__(*args, **kwargs)
+        self.request(CHIRPServiceIdentifier.DATA)
+
+    def _init_receiver(self) -> None:
+        """Define the attributes used for receiving and writing data.
+
+        Receivers in worker processes are created without calling __init__, see
+        _create_shard. Subclasses therefore define their own attributes by
+        extending this method rather than __init__.
+
+        """
+        # senders may offer several data lanes, so interfaces and sockets are
+        # keyed by host UUID and port
+        self._pull_interfaces: dict[Tuple[UUID, int], Tuple[str, int]] = {}
+        self._pull_sockets: dict[Tuple[UUID, int], zmq.Socket] = {}  # type: ignore[type-arg]
+        # data lane of each socket as announced in the BOR
+        self._socket_lanes: dict[zmq.Socket, int] = {}  # type: ignore[type-arg]
+        # sockets receiving small frames, which are copied
+        self._copying_sockets: set[zmq.Socket] = set()  # type: ignore[type-arg]
+        # address of the sender each socket is connected to
+        self._socket_addresses: dict[zmq.Socket, str] = {}  # type: ignore[type-arg]
+        # credit granted to senders using flow control, by socket
+        self._credit_grants: dict[zmq.Socket, CreditGrant] = {}  # type: ignore[type-arg]
+        # ZMQ options of the data sockets (ZMQ defaults)
+        self.receive_hwm = 1000
+        self.receive_buffer = -1
+        self.receive_batch = 100
+        # rotation of the output file after a number of bytes, seconds or
+        # messages received (0 for never)
+        self.rotate_bytes = 0
+        self.rotate_seconds = 0.0
+        self.rotate_messages = 0
+        # index of the output file of the current run and switches to later files
+        self.segment = 0
+        self._segment_switches: list[SegmentSwitch] = []
+        # received bytes and messages when the current segment started
+        self._segment_start: Tuple[float, int, int] = (0.0, 0, 0)
+        # BOR of each satellite in the current run, written to every segment
+        self._run_bors: dict[str, CDTPMessage] = {}
         self.poller: zmq.Poller | None = None
         self.run_identifier = ""
-        # Tracker for which satellites have joined the current data run.
+        # Tracker for which satellites have joined the current data run; holds
+        # one entry per data lane of a satellite.
         self.active_satellites: list[str] = []
+        # schema of the typed stream declared in the BOR, per satellite name
+        self.stream_schemas: dict[str, ArraySchema] = {}
+        # sequence number checks per satellite name and data lane
+        self._sequence_trackers: dict[Tuple[str, int], SequenceTracker] = {}
+        # buffers between the reception and the writer threads
+        self.writer_threads = 1
+        self.buffer_max_items = 0
+        self.buffer_max_bytes = 0
+        self._write_buffers: list[DataQueue] = []
+        self._writer_threads: list[threading.Thread] = []
+        self._writer_error: Exception | None = None
         # metrics
         self.receiver_stats: dict[str, int] = {}
-        # initialize Satellite attributes
-        super().__init__(*args, **kwargs)
-        self.request(CHIRPServiceIdentifier.DATA)
+        self.sequence_stats: dict[str, int] = {}
+        self.pipeline_stats: dict[str, Any] = {}
+        # pipeline statistics are updated by the reception and all writer threads
+        self._pipeline_lock = threading.Lock()
+        # messages and bytes received per satellite name since initializing
+        self.sender_stats: dict[str, dict[str, Any]] = {}
+        self._monitoring_interval = 2.0
+        # index of the shard of senders handled when running in a worker process
+        self.shard: int | None = None
+        # worker processes receiving the data of a shard of the senders each
+        self.worker_processes = 0
+        self._shards: list[ReceiverShard] = []
+        # latest statistics reported by each worker process
+        self._shard_snapshots: dict[int, dict[str, Any]] = {}
 
     def do_initializing(self, config: dict[str, Any]) -> str:
         """Initialize and configure the satellite."""
@@ -49,23 +264,54 @@ class DataReceiver(Satellite):
         self.file_name_pattern = self.config.setdefault("_file_name_pattern", "run_{run_identifier}_{date}.h5")
         # what directory to store files in?
         self.output_path = self.config.setdefault("_output_path", "data")
+        # window of data messages and payload bytes granted to senders using flow control
+        self.credit_messages = self.config.setdefault("_credit_messages", 1000)
+        self.credit_bytes = self.config.setdefault("_credit_bytes", 64 * 1024 * 1024)
+        # number of messages buffered by ZMQ and kernel receive buffer size [B] per connection
+        self.receive_hwm = self.config.setdefault("_receive_hwm", 1000)
+        self.receive_buffer = self.config.setdefault("_receive_buffer", -1)
+        # maximum number of messages read from a socket before serving the others
+        self.receive_batch = self.config.setdefault("_receive_batch", 100)
+        # start a new output file after this many bytes, seconds or messages (0 for never)
+        self.rotate_bytes = self.config.setdefault("_rotate_bytes", 0)
+        self.rotate_seconds = self.config.setdefault("_rotate_seconds", 0)
+        self.rotate_messages = self.config.setdefault("_rotate_messages", 0)
+        # threads writing received messages and the data messages and payload
+        # bytes buffered for them
+        self.writer_threads = self.config.setdefault("_writer_threads", 1)
+        if self.writer_threads < 1:
+            raise ValueError("At least one writer thread is required")
+        self.buffer_max_items = self.config.setdefault("_buffer_max_items", 10000)
+        self.buffer_max_bytes = self.config.setdefault("_buffer_max_bytes", 256 * 1024 * 1024)
+        # worker processes each receiving and writing the data of a shard of the senders
+        self.worker_processes = self.config.setdefault("_worker_processes", 0)
         self._configure_monitoring(2.0)
+        if self.shard is None:
+            self._configure_shards()
         return "Configured DataReceiver"
 
     def do_launching(self) -> str:
         """Set up pull sockets to listen to incoming data."""
+        if self._shards:
+            for shard in self._shards:
+                shard.request("launch")
+            return f"Established connections to data senders in {len(self._shards)} worker processes."
         # Set up the data poller which will monitor all ZMQ sockets
         self.poller = zmq.Poller()
         # TODO implement a filter based on configuration values
-        for uuid, host in self._pull_interfaces.items():
+        for key, host in self._pull_interfaces.items():
             address, port = host
-            self._add_socket(uuid, address, port)
+            self._add_socket(key, address, port)
         return "Established connections to data senders."
 
     def do_landing(self) -> str:
         """Close all open sockets."""
-        for uuid in self._pull_interfaces.keys():
-            self._remove_socket(uuid)
+        if self._shards:
+            for shard in self._shards:
+                shard.request("land")
+            return f"Closed connections to data senders in {len(self._shards)} worker processes."
+        for key in self._pull_interfaces.keys():
+            self._remove_socket(key)
         self.poller = None
         return "Closed connections to data senders."
 
@@ -87,89 +333,372 @@ class DataReceiver(Satellite):
         Satellite class. It therefore needs to monitor the self.stop_running
         Event and close itself down if the Event is set.
 
+        This thread only drains the sockets into bounded buffers. Writer
+        threads call the `_write_*` methods, so that slow writes do not stop
+        the reception. All messages of a satellite are handled by the same
+        writer thread in the order they were received.
+
         """
         self.run_identifier = run_identifier
-        filename = pathlib.Path(
-            self.file_name_pattern.format(
-                run_identifier=self.run_identifier,
-                date=datetime.datetime.now().strftime("%Y-%m-%d-%H%M%S"),
-            )
-        )
+        if self._shards:
+            return self._run_shards(run_identifier)
+        self.segment = 0
+        self._segment_switches = []
+        self._run_bors = {}
+        filename = self._output_file_name()
         outfile = self._open_file(filename)
-        last_msg = datetime.datetime.now()
-        # keep the data collection alive for a few seconds after stopping
-        keep_alive = datetime.datetime.now()
         transmitter = DataTransmitter("", None)
         self._reset_receiver_stats()
+        self._reset_sequence_stats()
+        self._reset_pipeline_stats()
+        self.stream_schemas = {}
+        self._start_writers(outfile)
+        # bookkeeping uses a monotonic clock, read once per poll
+        now = time.monotonic()
+        last_msg = now
+        self._segment_start = (now, 0, 0)
+        # keep the data collection alive for a few seconds after stopping
+        keep_alive = now
+        item = None
         try:
             # processing loop
             # assert for mypy static type analysis
             assert isinstance(self._state_thread_evt, threading.Event), "State thread Event not set up correctly"
 
-            while not self._state_thread_evt.is_set() or ((datetime.datetime.now() - keep_alive).total_seconds() < 60):
+            while not self._state_thread_evt.is_set() or now - keep_alive < 60:
                 # refresh keep_alive timestamp
                 if not self._state_thread_evt.is_set():
-                    keep_alive = datetime.datetime.now()
+                    keep_alive = now
                 else:
                     if not self.active_satellites:
                         # no Satellites connected
                         self.log.info("All EOR received, stopping.")
                         break
+                self._check_writers()
                 # request available data from zmq poller; timeout prevents
                 # deadlock when stopping.
                 assert isinstance(self.poller, zmq.Poller)
                 sockets_ready = dict(self.poller.poll(timeout=250))
 
                 for socket in sockets_ready.keys():
-                    binmsg = socket.recv_multipart()
-                    # NOTE below we determine the size of the list of (binary)
-                    # strings, which is not exactly what went over the network
-                    self.receiver_stats["nbytes"] += sys.getsizeof(binmsg)
-                    self.receiver_stats["npackets"] += 1
-                    try:
-                        item = transmitter.decode(binmsg)
-                    except Exception as e:
-                        self.log.critical(
-                            "Could not decode message '%s' due to exception: %s",
-                            binmsg,
-                            repr(e),
-                        )
-                        raise RuntimeError("Could not decode message") from e
-                    try:
-                        if item.msgtype == CDTPMessageIdentifier.BOR:
-                            self.active_satellites.append(item.name)
-                            self._write_BOR(outfile, item)
-                        elif item.msgtype == CDTPMessageIdentifier.EOR:
-                            self.active_satellites.remove(item.name)
-                            self._write_EOR(outfile, item)
-                        else:
-                            self._write_data(outfile, item)
-                    except Exception as e:
-                        self.log.critical("Could not write message '%s' to file: %s", item, repr(e))
-                        raise RuntimeError(f"Could not write message '{item}' to file") from e
-                    if (datetime.datetime.now() - last_msg).total_seconds() > 2.0:
-                        if self._state_thread_evt.is_set():
-                            msg = "Finishing with"
-                        else:
-                            msg = "Processing"
-                        self.log.status(
-                            "%s data packet %s from %s",
-                            msg,
-                            item.sequence_number,
-                            item.name,
-                        )
-                        last_msg = datetime.datetime.now()
+                    # drain the socket, but give other sockets a chance after a batch
+                    for _ in range(self.receive_batch):
+                        binmsg = self._receive(socket)
+                        if binmsg is None:
+                            break
+                        item = self._handle_message(socket, binmsg, transmitter)
+                now = time.monotonic()
+                if self._segment_due(now):
+                    outfile = self._next_segment(outfile, now)
+                if item and now - last_msg > 2.0:
+                    if self._state_thread_evt.is_set():
+                        msg = "Finishing with"
+                    else:
+                        msg = "Processing"
+                    self.log.status(
+                        "%s data packet %s from %s",
+                        msg,
+                        item.sequence_number,
+                        item.name,
+                    )
+                    last_msg = now
+            # wait for the writers to finish writing everything received
+            self._stop_writers()
+            self._check_writers()
 
         finally:
+            self._stop_writers()
             self._close_file(outfile)
+            for switch in self._segment_switches:
+                if switch.closer:
+                    switch.closer.join()
+                else:
+                    # a writer thread failed before leaving the file
+                    self._close_file(switch.old)
+            transmitter.close()
+            for grant in self._credit_grants.values():
+                grant.close()
+            self._credit_grants.clear()
             if self.active_satellites:
                 self.log.warning(
                     "Never received EOR from following Satellites: %s",
-                    ", ".join(self.active_satellites),
+                    ", ".join(sorted(set(self.active_satellites))),
                 )
             self.active_satellites = []
+        if self.segment:
+            return f"Finished acquisition to {self.segment + 1} files ending with {self._output_file_name()}"
         return f"Finished acquisition to {filename}"
 
+    def _output_file_name(self) -> pathlib.Path:
+        """Return the name of the file to write the current segment of the run to."""
+        filename = pathlib.Path(
+            self.file_name_pattern.format(
+                run_identifier=self.run_identifier,
+                date=datetime.datetime.now().strftime("%Y-%m-%d-%H%M%S"),
+                segment=self.segment,
+            )
+        )
+        if self._rotating and "{segment" not in self.file_name_pattern:
+            # segments need distinct file names
+            filename = filename.with_stem(f"{filename.stem}_{self.segment:04d}")
+        if self.shard is not None:
+            # every worker process writes its own file
+            filename = filename.with_stem(f"{filename.stem}_shard{self.shard}")
+        return filename
+
+    @property
+    def _rotating(self) -> bool:
+        """Whether runs are split into several output files."""
+        return bool(self.rotate_bytes or self.rotate_seconds or self.rotate_messages)
+
+    def _segment_due(self, now: float) -> bool:
+        """Return whether the current output file is complete according to the rotation policy."""
+        if not self._rotating:
+            return False
+        start, nbytes, npackets = self._segment_start
+        npackets = self.receiver_stats["npackets"] - npackets
+        if not npackets:
+            # no empty segments
+            return False
+        return (
+            (self.rotate_bytes > 0 and self.receiver_stats["nbytes"] - nbytes >= self.rotate_bytes)
+            or (self.rotate_messages > 0 and npackets >= self.rotate_messages)
+            or (self.rotate_seconds > 0 and now - start >= self.rotate_seconds)
+        )
+
+    def _next_segment(self, outfile: Any, now: float) -> Any:
+        """Continue writing the run into a new file; return the new file.
+
+        The writer threads switch files once they have written all messages
+        received before. The BOR of all satellites still taking data are
+        written to the new file before any of their data.
+
+        """
+        self.segment += 1
+        filename = self._output_file_name()
+        self.log.info("Continuing run %s in segment %s: %s", self.run_identifier, self.segment, filename)
+        new_outfile = self._open_file(filename)
+        switch = SegmentSwitch(outfile, new_outfile, len(self._write_buffers), self._close_file)
+        self._segment_switches.append(switch)
+        for buffer in self._write_buffers:
+            while True:
+                self._check_writers()
+                try:
+                    buffer.put((switch, _NEXT_SEGMENT), timeout=0.25)
+                    break
+                except Full:
+                    continue
+        for name in dict.fromkeys(self.active_satellites):
+            if name in self._run_bors:
+                self._enqueue(name, (self._run_bors[name], CDTPMessageIdentifier.BOR))
+        self._segment_start = (now, self.receiver_stats["nbytes"], self.receiver_stats["npackets"])
+        return new_outfile
+
+    def _receive(self, socket: zmq.Socket) -> list[Any] | None:  # type: ignore[type-arg]
+        """Receive a message if available without blocking.
+
+        Large frames are received without copying and returned as memoryviews,
+        which keep the ZMQ frames alive until written. Referencing a ZMQ frame
+        costs more than copying a small one, so sockets whose last message had
+        small frames receive copies.
+
+        """
+        binmsg: list[Any]
+        try:
+            if socket in self._copying_sockets:
+                binmsg = socket.recv_multipart(zmq.NOBLOCK)
+            else:
+                frames = socket.recv_multipart(zmq.NOBLOCK, copy=False)
+                binmsg = [frame.buffer if len(frame) >= _COPY_THRESHOLD else frame.bytes for frame in frames]
+        except zmq.Again:
+            return None
+        if sum(len(frame) for frame in binmsg) < _COPY_THRESHOLD * len(binmsg):
+            self._copying_sockets.add(socket)
+        else:
+            self._copying_sockets.discard(socket)
+        return binmsg
+
+    def _handle_message(
+        self, socket: zmq.Socket, binmsg: list[Any], transmitter: DataTransmitter  # type: ignore[type-arg]
+    ) -> CDTPMessage | None:
+        """Decode a received message and pass it on to the writer threads; return the last item."""
+        # bytes of all frames as received, excluding the ZMQ framing
+        nbytes = sum(len(frame) for frame in binmsg)
+        self.receiver_stats["nbytes"] += nbytes
+        self.receiver_stats["npackets"] += 1
+        try:
+            # batched data messages are split into individual items
+            items = transmitter.decode_messages(binmsg)
+        except Exception as e:
+            self.log.critical(
+                "Could not decode message '%s' due to exception: %s",
+                binmsg,
+                repr(e),
+            )
+            raise RuntimeError("Could not decode message") from e
+        if not items:
+            return None
+        self._account_sender(items[0].name, nbytes)
+        trackers = self._sequence_trackers
+        for item in items:
+            try:
+                if item.msgtype == CDTPMessageIdentifier.BOR:
+                    codec = item.meta.get(CODEC_META_KEY)
+                    if codec and codec not in CODECS:
+                        raise RuntimeError(f"{item.name} compresses data with unavailable codec '{codec}'")
+                    item.lane = item.meta.get(LANE_META_KEY, 0)
+                    self._socket_lanes[socket] = item.lane
+                    trackers[(item.name, item.lane)] = SequenceTracker()
+                    if CREDIT_META_KEY in item.meta:
+                        self._grant_credit(socket, item.meta[CREDIT_META_KEY])
+                    if SCHEMA_META_KEY in item.meta:
+                        self.stream_schemas[item.name] = ArraySchema.from_meta(item.meta[SCHEMA_META_KEY])
+                    else:
+                        self.stream_schemas.pop(item.name, None)
+                    # only the first lane of a satellite writes the BOR
+                    first = item.name not in self.active_satellites
+                    self.active_satellites.append(item.name)
+                    if first:
+                        self._run_bors[item.name] = item
+                        self._enqueue(item.name, (item, CDTPMessageIdentifier.BOR))
+                elif item.msgtype == CDTPMessageIdentifier.EOR:
+                    item.lane = item.meta.get(LANE_META_KEY, 0)
+                    # the EOR carries the sequence number of the last data message
+                    trackers.setdefault((item.name, item.lane), SequenceTracker()).finish(item.sequence_number)
+                    self._update_sequence_stats()
+                    self.active_satellites.remove(item.name)
+                    # only the last lane of a satellite writes the EOR
+                    if item.name not in self.active_satellites:
+                        self._add_loss_summary(item)
+                        self._enqueue(item.name, (item, CDTPMessageIdentifier.EOR))
+                else:
+                    item.lane = self._socket_lanes.get(socket, 0)
+                    try:
+                        tracker = trackers[(item.name, item.lane)]
+                    except KeyError:
+                        # late joiners are active until their EOR, as if they had sent a BOR
+                        self.log.warning("%s sent data without BOR.", item.name)
+                        self.active_satellites.append(item.name)
+                        tracker = trackers[(item.name, item.lane)] = SequenceTracker()
+                    else:
+                        if item.name not in self.active_satellites:
+                            self.log.warning("%s sent data but is no longer assumed active (EOR received)", item.name)
+                    if not tracker.check(item.sequence_number):
+                        self._update_sequence_stats()
+                    # credit is returned once the payload is written
+                    self._enqueue(item.name, (item.payload, (item, self._credit_grants.get(socket))))
+            except Exception as e:
+                self.log.critical("Could not handle message '%s': %s", item, repr(e))
+                raise RuntimeError(f"Could not handle message '{item}'") from e
+        return items[-1]
+
+    def _start_writers(self, outfile: Any) -> None:
+        """Start the writer threads, each with its own buffer of received messages."""
+        self._write_buffers = []
+        self._writer_threads = []
+        self._writer_error = None
+        for idx in range(self.writer_threads):
+            buffer = DataQueue(self.buffer_max_items, self.buffer_max_bytes)
+            thread = threading.Thread(target=self._write_loop, args=(buffer, outfile), name=f"writer_{idx}", daemon=True)
+            self._write_buffers.append(buffer)
+            self._writer_threads.append(thread)
+            thread.start()
+
+    def _stop_writers(self) -> None:
+        """Let the writer threads finish their buffers and wait for them."""
+        for buffer, thread in zip(self._write_buffers, self._writer_threads):
+            while thread.is_alive():
+                try:
+                    buffer.put(_END_OF_BUFFER, timeout=0.25)
+                    break
+                except Full:
+                    continue
+        for thread in self._writer_threads:
+            thread.join()
+        self._write_buffers = []
+        self._writer_threads = []
+
+    def _check_writers(self) -> None:
+        """Raise the exception a writer thread failed with."""
+        if self._writer_error:
+            raise RuntimeError("Could not write message to file") from self._writer_error
+
+    def _enqueue(self, name: str, entry: tuple[Any, Any]) -> None:
+        """Pass a message to the buffer of the writer responsible for the satellite.
+
+        Blocks while the buffer is full; the time spent waiting is accounted
+        as stall of the reception.
+
+        """
+        buffer = self._write_buffers[hash(name) % len(self._write_buffers)]
+        try:
+            buffer.put(entry, block=False)
+            return
+        except Full:
+            pass
+        start = time.monotonic()
+        while True:
+            self._check_writers()
+            try:
+                buffer.put(entry, timeout=0.25)
+                break
+            except Full:
+                continue
+        with self._pipeline_lock:
+            self.pipeline_stats["receive_stalls"] += 1
+            self.pipeline_stats["receive_stall_time"] += time.monotonic() - start
+
+    def _write_loop(self, buffer: DataQueue, outfile: Any) -> None:
+        """Call the write methods for all messages passed to a writer thread.
+
+        BOR/EOR entries are (message, CDTPMessageIdentifier) tuples, data
+        entries are (payload, (message, credit grant)) tuples so that the
+        buffer accounts for the payload size. Switches to the file of the next
+        segment of the run are (SegmentSwitch, _NEXT_SEGMENT) tuples.
+
+        """
+        meta = None
+        try:
+            while True:
+                payload, meta = buffer.get()
+                if meta is None:
+                    break
+                if meta == _NEXT_SEGMENT:
+                    outfile = payload.new
+                    payload.leave()
+                    continue
+                start = time.monotonic()
+                if meta == CDTPMessageIdentifier.BOR:
+                    self._write_BOR(outfile, payload)
+                elif meta == CDTPMessageIdentifier.EOR:
+                    self._write_EOR(outfile, payload)
+                else:
+                    item, grant = meta
+                    self._write_data(outfile, item)
+                    if grant:
+                        grant.consume(payload_nbytes(payload))
+                duration = time.monotonic() - start
+                with self._pipeline_lock:
+                    self.pipeline_stats["write_time"] += duration
+                    self.pipeline_stats["max_write_time"] = max(self.pipeline_stats["max_write_time"], duration)
+        except Exception as e:
+            self.log.critical("Could not write message '%s' to file: %s", meta, repr(e))
+            self._writer_error = e
+
+    def payload_array(self, item: CDTPMessage) -> Any:
+        """Return NumPy views of the payload of a data message without copying.
+
+        Views are created from the schema the sender declared in its BOR. For
+        multi-frame payloads a list of arrays is returned. Returns None if the
+        sender did not declare a typed stream.
+
+        """
+        try:
+            schema = self.stream_schemas[item.name]
+        except KeyError:
+            return None
+        return schema.view(item.payload)
+
     def _write_data(self, outfile: Any, item: CDTPMessage) -> None:
         """Write data to file"""
         raise NotImplementedError()
@@ -192,9 +721,14 @@ class DataReceiver(Satellite):
 
     def fail_gracefully(self) -> str:
         """Method called when reaching 'ERROR' state."""
-        for uuid in self._pull_interfaces.keys():
+        for shard in self._shards:
             try:
-                self._remove_socket(uuid)
+                shard.request("land")
+            except RuntimeError as e:
+                self.log.error("Unable to land worker process: %s", e)
+        for key in self._pull_interfaces.keys():
+            try:
+                self._remove_socket(key)
             except KeyError:
                 pass
         self.poller = None
@@ -209,9 +743,9 @@ class DataReceiver(Satellite):
         """
         res = []
         num = len(self._pull_interfaces)
-        for uuid, host in self._pull_interfaces.items():
+        for key, host in self._pull_interfaces.items():
             address, port = host
-            res.append(f"{address}:{port} ({uuid})")
+            res.append(f"{address}:{port} ({key[0]})")
         return f"{num} connected data sources", res, None
 
     @chirp_callback(CHIRPServiceIdentifier.DATA)
@@ -226,38 +760,347 @@ class DataReceiver(Satellite):
         """
         Adds an interface (host, port) to receive data from.
         """
-        self._pull_interfaces[service.host_uuid] = (service.address, service.port)
+        key = (service.host_uuid, service.port)
+        if key in self._pull_interfaces:
+            # e.g. added manually before being discovered
+            self.log.debug("Already connected to %s:%s", service.address, service.port)
+            return
+        self._pull_interfaces[key] = (service.address, service.port)
         self.log.info("Adding interface tcp://%s:%s to listen to.", service.address, service.port)
+        if self._shards:
+            try:
+                self._shard_for(key).request("add", key, service.address, service.port)
+            except RuntimeError as e:
+                self.log.error("Unable to add interface to worker process: %s", e)
+            return
         # handle late-coming satellite offers
         if self.fsm.current_state_value in [
             SatelliteState.ORBIT,
             SatelliteState.RUN,
         ]:
-            self._add_socket(service.host_uuid, service.address, service.port)
+            self._add_socket(key, service.address, service.port)
 
     def _remove_sender(self, service: DiscoveredService) -> None:
         """Removes sender from pool"""
         try:
-            self._pull_interfaces.pop(service.host_uuid)
-            self._remove_socket(service.host_uuid)
+            key = (service.host_uuid, service.port)
+            self._pull_interfaces.pop(key)
+            if self._shards:
+                try:
+                    self._shard_for(key).request("remove", key)
+                except RuntimeError as e:
+                    self.log.error("Unable to remove interface from worker process: %s", e)
+                return
+            self._remove_socket(key)
         except KeyError:
             pass
 
-    def _add_socket(self, uuid: UUID, address: str, port: int) -> None:
+    def _add_socket(self, key: Tuple[UUID, int], address: str, port: int) -> None:
         interface = f"tcp://{address}:{port}"
         self.log.info("Connecting to %s", interface)
         socket = self.context.socket(zmq.PULL)
+        set_affinity(socket)
+        socket.setsockopt(zmq.RCVHWM, self.receive_hwm)
+        socket.setsockopt(zmq.RCVBUF, self.receive_buffer)
         socket.connect(interface)
-        self._pull_sockets[uuid] = socket
+        self._socket_addresses[socket] = address
+        if is_local_address(address) and zmq.has("ipc"):
+            # senders on the same host pass data via shared memory if they
+            # find us connected to their ipc socket
+            self.log.info("Connecting to %s", ipc_endpoint(port))
+            socket.connect(ipc_endpoint(port))
+        self._pull_sockets[key] = socket
         assert isinstance(self.poller, zmq.Poller)  # for typing
         self.poller.register(socket, zmq.POLLIN)
 
-    def _remove_socket(self, uuid: UUID) -> None:
-        socket = self._pull_sockets.pop(uuid)
+    def _remove_socket(self, key: Tuple[UUID, int]) -> None:
+        socket = self._pull_sockets.pop(key)
+        self._socket_lanes.pop(socket, None)
+        self._socket_addresses.pop(socket, None)
+        self._copying_sockets.discard(socket)
+        grant = self._credit_grants.pop(socket, None)
+        if grant:
+            grant.close()
         if self.poller:
             self.poller.unregister(socket)
         socket.close()
 
+    def reentry(self) -> None:
+        """Destroy the satellite and stop the worker processes."""
+        super().reentry()
+        self._stop_shards()
+
+    def _configure_shards(self) -> None:
+        """Start or stop worker processes as configured and pass on the configuration."""
+        if len(self._shards) != self.worker_processes:
+            self._stop_shards()
+            if self.worker_processes > 0:
+                if "<locals>" in type(self).__qualname__:
+                    raise ValueError("Receivers using worker processes need to be defined at module level")
+                self.log.info("Starting %s worker processes", self.worker_processes)
+                self._shards = [ReceiverShard(type(self), self.name, idx, self.log) for idx in range(self.worker_processes)]
+                for key, (address, port) in self._pull_interfaces.items():
+                    self._shard_for(key).request("add", key, address, port)
+        for shard in self._shards:
+            shard.request("initialize", self.config.get_dict())
+
+    def _stop_shards(self) -> None:
+        """Stop all worker processes."""
+        for shard in self._shards:
+            shard.close()
+        self._shards = []
+        self._shard_snapshots = {}
+
+    def _shard_for(self, key: Tuple[UUID, int]) -> ReceiverShard:
+        """Return the worker process handling a sender; all data lanes of a sender go to the same one."""
+        return self._shards[key[0].int % len(self._shards)]
+
+    def _run_shards(self, run_identifier: str) -> str:
+        """Perform a run in the worker processes, aggregating their statistics."""
+        assert isinstance(self._state_thread_evt, threading.Event)  # for typing
+        self._reset_receiver_stats()
+        self._reset_sequence_stats()
+        self._reset_pipeline_stats()
+        self._shard_snapshots = {}
+        running: dict[Connection, ReceiverShard] = {shard.events: shard for shard in self._shards}
+        for shard in self._shards:
+            shard.request("start", run_identifier)
+        stopping = False
+        finished = 0
+        failures = []
+        while running:
+            if not stopping and self._state_thread_evt.is_set():
+                # the workers keep receiving until all EOR arrived
+                for shard in running.values():
+                    shard.request("stop")
+                stopping = True
+            for ready in wait(list(running), timeout=0.25):
+                conn = cast(Connection, ready)
+                shard = running[conn]
+                try:
+                    status, *msg = conn.recv()
+                except EOFError:
+                    running.pop(conn)
+                    failures.append(f"shard {shard.index} exited")
+                    continue
+                self._update_shard_stats(shard.index, msg[-1])
+                if status == "stats":
+                    continue
+                running.pop(conn)
+                if status == "finished":
+                    finished += 1
+                else:
+                    failures.append(f"shard {shard.index}: {msg[0]}")
+        if failures:
+            raise RuntimeError(f"Receiver shards failed: {'; '.join(failures)}")
+        return f"Finished acquisition to {finished} file shards"
+
+    def _shard_stats(self) -> dict[str, Any]:
+        """Return the statistics of a worker process for the receiver in the main process."""
+        with self._pipeline_lock:
+            pipeline = dict(self.pipeline_stats)
+            if pipeline:
+                self.pipeline_stats["max_write_time"] = 0.0
+        return {
+            "receiver": dict(self.receiver_stats),
+            "sequence": dict(self.sequence_stats),
+            "pipeline": pipeline,
+            "buffer_depth": self._get_buffer_depth(),
+            "buffer_nbytes": self._get_buffer_nbytes(),
+            "senders": {name: dict(stats) for name, stats in self.sender_stats.items()},
+            "active": list(self.active_satellites),
+        }
+
+    def _update_shard_stats(self, index: int, snapshot: dict[str, Any]) -> None:
+        """Aggregate the statistics reported by the worker processes."""
+        self._shard_snapshots[index] = snapshot
+        snapshots = self._shard_snapshots.values()
+        for stats, group in [(self.receiver_stats, "receiver"), (self.sequence_stats, "sequence")]:
+            for stat in stats:
+                stats[stat] = sum(snap[group].get(stat, 0) for snap in snapshots)
+        with self._pipeline_lock:
+            for stat in self.pipeline_stats:
+                if stat == "max_write_time":
+                    # longest write since the metric was read last
+                    self.pipeline_stats[stat] = max(self.pipeline_stats[stat], snapshot["pipeline"].get(stat, 0.0))
+                else:
+                    self.pipeline_stats[stat] = sum(snap["pipeline"].get(stat, 0) for snap in snapshots)
+        for name, stats in snapshot["senders"].items():
+            if name not in self.sender_stats:
+                self._schedule_sender_metrics(name)
+            self.sender_stats[name] = stats
+        self.active_satellites = [name for snap in snapshots for name in snap["active"]]
+
+    @classmethod
+    def _create_shard(cls, name: str, index: int, log: Any) -> "DataReceiver":
+        """Create an instance receiving the data of a shard of the senders in a worker process.
+
+        The instance lacks the Satellite infrastructure. It is controlled by
+        the receiver in the main process, which also publishes its metrics.
+        Its attributes are defined by _init_receiver, which subclasses extend.
+
+        """
+        receiver = cls.__new__(cls)
+        receiver._init_receiver()
+        receiver.shard = index
+        receiver.name = name
+        receiver.log = log
+        receiver.context = zmq.Context()
+        receiver.config = Configuration({})
+        receiver._metrics_callbacks = {}
+        receiver._state_thread_evt = None
+        return receiver
+
+    def _initialize_shard(self, config: dict[str, Any]) -> None:
+        """Apply the configuration of the receiver in the main process to a worker process."""
+        self.config = Configuration(config)
+        self.do_initializing(config)
+
+    def _add_shard_sender(self, key: Tuple[UUID, int], address: str, port: int) -> None:
+        """Add a sender to the shard of a worker process, connecting to it if launched."""
+        self._pull_interfaces[key] = (address, port)
+        if self.poller and key not in self._pull_sockets:
+            self._add_socket(key, address, port)
+
+    def _remove_shard_sender(self, key: Tuple[UUID, int]) -> None:
+        """Remove a sender from the shard of a worker process."""
+        self._pull_interfaces.pop(key, None)
+        if key in self._pull_sockets:
+            self._remove_socket(key)
+
+    def _close_shard(self) -> None:
+        """Release the resources of a worker process."""
+        for key in list(self._pull_sockets):
+            self._remove_socket(key)
+        self.context.destroy(linger=0)
+
+    def _grant_credit(self, socket: zmq.Socket, port: int) -> None:  # type: ignore[type-arg]
+        """Grant a window of credit to the sender connected via socket, which accepts it on port."""
+        grant = self._credit_grants.pop(socket, None)
+        if grant:
+            grant.close()
+        credit_socket = self.context.socket(zmq.PUSH)
+        credit_socket.connect(f"tcp://{self._socket_addresses[socket]}:{port}")
+        self._credit_grants[socket] = CreditGrant(credit_socket, self.credit_messages, self.credit_bytes)
+
+    def _add_loss_summary(self, item: CDTPMessage) -> None:
+        """Add the sequence number checks of all data lanes of a satellite to its EOR payload."""
+        summary = {"rx_messages": 0, "rx_lost": 0, "rx_gaps": 0, "rx_duplicates": 0, "rx_reordered": 0}
+        for (name, _lane), tracker in self._sequence_trackers.items():
+            if name == item.name:
+                summary["rx_messages"] += tracker.received
+                summary["rx_lost"] += tracker.lost
+                summary["rx_gaps"] += tracker.gaps
+                summary["rx_duplicates"] += tracker.duplicates
+                summary["rx_reordered"] += tracker.reordered
+        if summary["rx_lost"] or summary["rx_duplicates"]:
+            self.log.warning(
+                "%s lost %s data messages in %s gaps and sent %s duplicates",
+                item.name,
+                summary["rx_lost"],
+                summary["rx_gaps"],
+                summary["rx_duplicates"],
+            )
+        if isinstance(item.payload, dict):
+            item.payload.update(summary)
+        else:
+            self.log.warning("Cannot add loss summary to EOR payload of %s", item.name)
+
+    def _reset_sequence_stats(self) -> None:
+        """Reset sequence number checks and the derived telemetry"""
+        self._sequence_trackers = {}
+        self.sequence_stats = {
+            "lost_messages": 0,
+            "sequence_gaps": 0,
+            "duplicate_messages": 0,
+            "reordered_messages": 0,
+        }
+
+    def _update_sequence_stats(self) -> None:
+        """Sum up the sequence number checks of all senders for monitoring."""
+        trackers = self._sequence_trackers.values()
+        self.sequence_stats = {
+            "lost_messages": sum(tracker.lost for tracker in trackers),
+            "sequence_gaps": sum(tracker.gaps for tracker in trackers),
+            "duplicate_messages": sum(tracker.duplicates for tracker in trackers),
+            "reordered_messages": sum(tracker.reordered for tracker in trackers),
+        }
+
+    def _get_sequence_stat(self, stat: str) -> Any:
+        """Get a specific sequence number metric"""
+        return self.sequence_stats[stat]
+
+    def _reset_pipeline_stats(self) -> None:
+        """Reset the telemetry of the reception and writer threads."""
+        with self._pipeline_lock:
+            self.pipeline_stats = {
+                "receive_stalls": 0,
+                "receive_stall_time": 0.0,
+                "write_time": 0.0,
+                "max_write_time": 0.0,
+            }
+
+    def _get_pipeline_stat(self, stat: str) -> Any:
+        """Get a specific metric of the reception and writer threads."""
+        return self.pipeline_stats[stat]
+
+    def _get_max_write_time(self) -> float:
+        """Get the longest time a single write took since the last call."""
+        with self._pipeline_lock:
+            res: float = self.pipeline_stats["max_write_time"]
+            self.pipeline_stats["max_write_time"] = 0.0
+        return res
+
+    def _get_buffer_depth(self) -> int:
+        """Get the number of messages waiting for the writer threads."""
+        shards: int = sum(snap["buffer_depth"] for snap in self._shard_snapshots.values())
+        return shards + sum(buffer.qsize() for buffer in self._write_buffers)
+
+    def _get_buffer_nbytes(self) -> int:
+        """Get the number of payload bytes waiting for the writer threads."""
+        shards: int = sum(snap["buffer_nbytes"] for snap in self._shard_snapshots.values())
+        return shards + sum(buffer.nbytes for buffer in self._write_buffers)
+
+    def _account_sender(self, name: str, nbytes: int) -> None:
+        """Count a message received from a satellite, scheduling its metrics on first sight."""
+        try:
+            stats = self.sender_stats[name]
+        except KeyError:
+            stats = self.sender_stats[name] = {"messages": 0, "bytes": 0, "last_seen": 0.0}
+            self._schedule_sender_metrics(name)
+        stats["messages"] += 1
+        stats["bytes"] += nbytes
+        stats["last_seen"] = time.monotonic()
+
+    def _schedule_sender_metrics(self, name: str) -> None:
+        """Schedule monitoring of the messages received from a satellite."""
+        self.log.info("Configuring monitoring for data sent by %s", name)
+        # totals are published as rates
+        for stat, unit in [("messages", ""), ("bytes", "B")]:
+            self.schedule_metric(
+                f"rx_{stat}_{name}",
+                unit,
+                MetricsType.RATE,
+                self._monitoring_interval,
+                partial(self._get_sender_stat, name=name, stat=stat),
+            )
+        self.schedule_metric(
+            f"rx_idle_{name}",
+            "s",
+            MetricsType.LAST_VALUE,
+            self._monitoring_interval,
+            partial(self._get_sender_idle, name=name),
+        )
+
+    def _get_sender_stat(self, name: str, stat: str) -> Any:
+        """Get a specific metric of the messages received from a satellite."""
+        return self.sender_stats[name][stat]
+
+    def _get_sender_idle(self, name: str) -> float:
+        """Get the time since the last message was received from a satellite."""
+        res: float = time.monotonic() - self.sender_stats[name]["last_seen"]
+        return res
+
     def _reset_receiver_stats(self) -> None:
         """Reset internal telemetry used for monitoring"""
         self.receiver_stats = {
@@ -271,7 +1114,12 @@ class DataReceiver(Satellite):
 
     def _configure_monitoring(self, interval: float) -> None:
         """Schedule monitoring for internal parameters."""
-        self.reset_scheduled_metrics()
+        if self.shard is None:
+            # worker processes do not publish metrics themselves
+            self.reset_scheduled_metrics()
+        self._monitoring_interval = interval
+        # metrics of the senders are scheduled again once they are seen
+        self.sender_stats = {}
         self._reset_receiver_stats()
         for stat in self.receiver_stats:
             self.log.info("Configuring monitoring for '%s' metric", stat)
@@ -283,3 +1131,27 @@ class DataReceiver(Satellite):
                 interval,
                 partial(self._get_stat, stat=stat),
             )
+        self._reset_sequence_stats()
+        for stat in self.sequence_stats:
+            self.log.info("Configuring monitoring for '%s' metric", stat)
+            self.schedule_metric(
+                stat,
+                "",
+                MetricsType.LAST_VALUE,
+                interval,
+                partial(self._get_sequence_stat, stat=stat),
+            )
+        # messages waiting for the writer threads, time the reception waited
+        # for space in the buffers and time spent writing
+        self.schedule_metric("buffer_depth", "", MetricsType.LAST_VALUE, interval, self._get_buffer_depth)
+        self.schedule_metric("buffer_nbytes", "B", MetricsType.LAST_VALUE, interval, self._get_buffer_nbytes)
+        self._reset_pipeline_stats()
+        for stat, unit in [("receive_stalls", ""), ("receive_stall_time", "s"), ("write_time", "s")]:
+            self.schedule_metric(
+                stat,
+                unit,
+                MetricsType.RATE,
+                interval,
+                partial(self._get_pipeline_stat, stat=stat),
+            )
+        self.schedule_metric("max_write_time", "s", MetricsType.LAST_VALUE, interval, self._get_max_write_time)
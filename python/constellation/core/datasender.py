@@ -6,22 +6,178 @@ SPDX-License-Identifier: CC-BY-4.0
 A base module for a Constellation Satellite that sends data.
 """
 
+import asyncio
+import os
 import time
 import threading
 import logging
-from typing import Any
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Sequence
 from queue import Queue, Empty
 
-import random
 import numpy as np
 import zmq
+import zmq.asyncio
+from zmq.utils.monitor import recv_monitor_message
 
-from .cdtp import DataTransmitter, CDTPMessageIdentifier
+from .cdtp import (
+    CODEC_META_KEY,
+    CREDIT_META_KEY,
+    LANE_META_KEY,
+    LANES_META_KEY,
+    SCHEMA_META_KEY,
+    SOCKET_META_KEY,
+    DataTransmitter,
+    CDTPMessageIdentifier,
+    decode_credit,
+    payload_nbytes,
+)
+from .arrayschema import ArraySchema
+from .cmdp import MetricsType
+from .compression import Compressor
+from .dataqueue import DataQueue, QueuePolicy
+from .histogram import LATENCY_BUCKETS, SIZE_BUCKETS, Histogram
+from .shmring import ShmRingBuffer, ipc_endpoint
+from .zmqcontext import set_affinity
 from .satellite import Satellite, SatelliteArgumentParser
 from .base import EPILOG, setup_cli_logging
 from .broadcastmanager import CHIRPServiceIdentifier
 
 
+def socket_options(socket: zmq.Socket) -> dict[str, int]:  # type: ignore[type-arg]
+    """Return the options applied to a data socket, as announced in the BOR."""
+    return {
+        "sndhwm": int(socket.getsockopt(zmq.SNDHWM)),
+        "sndbuf": int(socket.getsockopt(zmq.SNDBUF)),
+        "sndtimeo": int(socket.getsockopt(zmq.SNDTIMEO)),
+    }
+
+
+class PeerMonitor:
+    """Counts the peers connected to a socket bound by this process.
+
+    Needs to be created before binding the socket to see all connections. The
+    count is updated from the socket monitor events whenever it is requested.
+
+    """
+
+    def __init__(self, socket: zmq.Socket):  # type: ignore[type-arg]
+        self._socket = socket
+        self._monitor = socket.get_monitor_socket(zmq.EVENT_ACCEPTED | zmq.EVENT_DISCONNECTED)
+        self._peers = 0
+
+    def count(self) -> int:
+        """Return the number of peers currently connected."""
+        while self._monitor.poll(0):
+            event = recv_monitor_message(self._monitor)["event"]
+            if event == zmq.EVENT_ACCEPTED:
+                self._peers += 1
+            elif event == zmq.EVENT_DISCONNECTED:
+                self._peers -= 1
+        return self._peers
+
+    def close(self) -> None:
+        """Stop monitoring; needs to be called before closing the socket."""
+        self._socket.disable_monitor()
+        self._monitor.close()
+
+
+def send_run_event(
+    send: Any, payload: Any, meta: dict[str, Any], stopevt: threading.Event | None, log: logging.Logger
+) -> None:
+    """Send a BOR/EOR, which is never dropped, retrying on send timeouts.
+
+    Gives up once stopevt is set or missing, as the satellite is shutting down.
+
+    """
+    while True:
+        try:
+            send(payload=payload, meta=meta)
+            return
+        except zmq.Again:
+            if stopevt is None or stopevt.is_set():
+                log.warning("Unable to send run event while shutting down")
+                return
+            log.warning("Timeout sending run event, retrying")
+
+
+class TransmissionStats:
+    """Statistics on the data payloads sent by a PushThread.
+
+    Totals are kept over the lifetime of the thread, histograms and rates
+    per run.
+
+    """
+
+    def __init__(self) -> None:
+        # totals over all runs
+        self.total_messages = 0
+        self.total_bytes = 0
+        self.total_latency = 0.0
+        self.total_latency_count = 0
+        # number of times and time [s] spent waiting for credit from receivers
+        self.total_stalls = 0
+        self.total_stall_time = 0.0
+        # number of data payloads not sent within the send timeout
+        self.total_dropped = 0
+        # time spent by payloads between being queued and sent [s]
+        self.latency = Histogram(LATENCY_BUCKETS)
+        # payload sizes [B]
+        self.size = Histogram(SIZE_BUCKETS)
+        self.reset()
+
+    def reset(self) -> None:
+        """Start statistics of a new run."""
+        self.latency.reset()
+        self.size.reset()
+        self.stalls = 0
+        self.stall_time = 0.0
+        self.dropped = 0
+        self.run_start = time.monotonic()
+
+    def record(self, nbytes: int, enqueued_at: float | None, now: float) -> None:
+        """Record a data payload sent at time now."""
+        self.total_messages += 1
+        self.total_bytes += nbytes
+        self.size.fill(nbytes)
+        if enqueued_at is not None:
+            latency = now - enqueued_at
+            self.latency.fill(latency)
+            self.total_latency += latency
+            self.total_latency_count += 1
+
+    def record_drop(self, count: int) -> None:
+        """Record data payloads dropped."""
+        self.dropped += count
+        self.total_dropped += count
+
+    def record_stall(self, duration: float) -> None:
+        """Record time spent waiting for credit."""
+        self.stalls += 1
+        self.stall_time += duration
+        self.total_stalls += 1
+        self.total_stall_time += duration
+
+    def summary(self) -> dict[str, Any]:
+        """Return the statistics of the current run as flat dictionary."""
+        duration = time.monotonic() - self.run_start
+        res: dict[str, Any] = {
+            "tx_messages": self.size.count,
+            "tx_bytes": int(self.size.sum),
+            "tx_duration": duration,
+            "tx_message_rate": self.size.count / duration if duration > 0 else 0.0,
+            "tx_byte_rate": self.size.sum / duration if duration > 0 else 0.0,
+            "tx_dropped": self.dropped,
+            "tx_credit_stalls": self.stalls,
+            "tx_credit_stall_time": self.stall_time,
+        }
+        # latencies in ms
+        res.update(self.latency.summary("tx_latency", scale=1e3))
+        return res
+
+
 class PushThread(threading.Thread):
     """Thread that pushes CDTPMessages from a Queue to a ZMQ socket."""
 
@@ -32,16 +188,35 @@ class PushThread(threading.Thread):
         socket: zmq.Socket,  # type: ignore[type-arg]
         queue: Queue,  # type: ignore[type-arg]
         *args: Any,
+        batch_size: int = 1,
+        batch_timeout: float = 0.0,
+        compressor: Compressor | None = None,
+        compression_workers: int = 1,
+        shm_socket: zmq.Socket | None = None,  # type: ignore[type-arg]
+        ring: ShmRingBuffer | None = None,
+        peers: PeerMonitor | None = None,
+        shm_peers: PeerMonitor | None = None,
+        credit_socket: zmq.Socket | None = None,  # type: ignore[type-arg]
+        credit_port: int = 0,
         **kwargs: Any,
     ):
         """Initialize values.
 
         Arguments:
-        - name       :: Name of the satellite.
-        - stopevt    :: Event that if set lets the thread shut down.
-        - port       :: The port to bind to.
-        - queue      :: The Queue to process payload and meta of data runs from.
-        - context    :: ZMQ context to use (optional).
+        - name                :: Name of the satellite.
+        - stopevt             :: Event that if set lets the thread shut down.
+        - socket              :: The ZMQ socket to send data on.
+        - queue               :: The Queue to process payload and meta of data runs from.
+        - batch_size          :: Maximum number of payloads to coalesce into one message.
+        - batch_timeout       :: Maximum time [s] to wait for a batch to fill up.
+        - compressor          :: Compressor to apply to data payloads (optional).
+        - compression_workers :: Number of threads compressing payloads.
+        - shm_socket          :: ipc socket for receivers on the same host (optional).
+        - ring                :: Shared memory ring buffer to pass payloads via shm_socket.
+        - peers               :: Monitor of the receivers connected to socket; required with ring.
+        - shm_peers           :: Monitor of the receivers connected to shm_socket; required with ring.
+        - credit_socket       :: Socket receivers grant credit on; enables flow control (optional).
+        - credit_port         :: Port of the credit_socket announced to receivers in the BOR.
         """
         super().__init__(*args, **kwargs)
         self.name = name
@@ -49,26 +224,240 @@ class PushThread(threading.Thread):
         self.stopevt = stopevt
         self.queue = queue
         self._socket = socket
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.compressor = compressor
+        self.compression_workers = compression_workers
+        self._tcp_transmitter = DataTransmitter(self.name, self._socket)
+        self._shm_socket = shm_socket
+        self._ring = ring
+        self._peers = peers
+        self._shm_peers = shm_peers
+        self._shm_transmitter = DataTransmitter(self.name, shm_socket, ring) if shm_socket and ring else None
+        self._transmitter = self._tcp_transmitter
+        self.stats = TransmissionStats()
+        # data messages and payload bytes receivers allow us to send
+        self._credit_socket = credit_socket
+        self._credit_port = credit_port
+        self.credit_messages = 0
+        self.credit_bytes = 0
+        # payloads waiting to be sent as a batch, their enqueue times and the
+        # time the batch is due
+        self._batch: list[tuple[Any, Any]] = []
+        self._batch_stamps: list[float | None] = []
+        self._deadline = 0.0
+        # payloads being compressed by the worker pool, in order of arrival
+        self._inflight: deque[tuple[Future[Any], Any, float | None]] = deque()
+        self._pool: ThreadPoolExecutor | None = None
 
     def run(self) -> None:
         """Start sending data."""
-        transmitter = DataTransmitter(self.name, self._socket)
+        if self.compressor:
+            self._pool = ThreadPoolExecutor(self.compression_workers, thread_name_prefix=f"{self.name}_compress")
         while not self.stopevt.is_set():
             try:
                 # blocking call but with timeout to prevent deadlocks
-                payload, meta = self.queue.get(block=True, timeout=0.5)
-                # if we have data, send it
+                payload, meta = self.queue.get(block=True, timeout=self._get_timeout())
+                stamp = self.queue.enqueued_at if isinstance(self.queue, DataQueue) else None
+            except Empty:
+                # nothing to process, send what we have collected so far
+                if self._inflight:
+                    self._collect(wait=True)
+                else:
+                    self._send_batch()
+                continue
+            # if we have data, send it
+            if meta == CDTPMessageIdentifier.BOR or meta == CDTPMessageIdentifier.EOR:
+                # data queued before needs to be sent first
+                self._flush()
                 if meta == CDTPMessageIdentifier.BOR:
-                    transmitter.send_start(payload=payload["payload"], meta=payload["meta"])
-                elif meta == CDTPMessageIdentifier.EOR:
-                    transmitter.send_end(payload=payload["payload"], meta=payload["meta"])
+                    self._select_transmitter()
+                    self.stats.reset()
+                    bor_meta = {**payload["meta"], SOCKET_META_KEY: self._socket_options()}
+                    if self._credit_socket:
+                        self._reset_credit()
+                        bor_meta[CREDIT_META_KEY] = self._credit_port
+                    self._send_event(self._transmitter.send_start, payload["payload"], bor_meta)
                 else:
-                    transmitter.send_data(payload=payload, meta=meta)
-                self._logger.debug(f"Sending packet number {transmitter.sequence_number}")
+                    eor = payload["payload"]
+                    if isinstance(eor, dict):
+                        # summarize the transmission of the run
+                        eor = {**eor, **self.stats.summary()}
+                    self._send_event(self._transmitter.send_end, eor, payload["meta"])
                 self.queue.task_done()
-            except Empty:
-                # nothing to process
-                pass
+                del payload, meta
+                continue
+            if self._credit_socket:
+                # charge uncompressed payload bytes, as counted by receivers
+                self._acquire_credit(payload_nbytes(payload))
+            if self._pool:
+                assert self.compressor  # for typing
+                meta = {**(meta or {}), CODEC_META_KEY: self.compressor.codec}
+                self._inflight.append((self._pool.submit(self.compressor.compress, payload), meta, stamp))
+                # only block once all workers are busy
+                self._collect(wait=len(self._inflight) >= 2 * self.compression_workers)
+            else:
+                self._send_data(payload, meta, stamp)
+            # release our references so ZMQ can signal that the buffers are free
+            del payload, meta
+        # do not leave collected payloads behind
+        self._flush()
+        if self._pool:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _select_transmitter(self) -> None:
+        """Choose the transport for the next run.
+
+        Data is passed via shared memory only if the sole receiver is on the
+        same host and connected to the ipc socket, otherwise it is sent via
+        TCP to all receivers.
+
+        """
+        if self._shm_transmitter and self._sole_local_receiver():
+            assert self._shm_socket  # for typing
+            if self._shm_socket.poll(0, zmq.POLLOUT):
+                self._logger.info("Sending data via shared memory")
+                self._shm_transmitter.ring = self._ring
+                self._transmitter = self._shm_transmitter
+                return
+        self._transmitter = self._tcp_transmitter
+
+    def _sole_local_receiver(self) -> bool:
+        """Whether a single receiver is connected, which is connected to the ipc socket."""
+        if not self._peers or not self._shm_peers:
+            return False
+        # receivers on the same host connect to both the TCP and the ipc socket
+        return self._shm_peers.count() == 1 and self._peers.count() <= 1
+
+    def _check_shared_memory(self) -> None:
+        """Stop passing payloads via shared memory if further receivers connected during the run.
+
+        The ring buffer only supports a single reader. The data messages are
+        still sent via the ipc socket, with the payloads inline.
+
+        """
+        if self._transmitter.ring and not self._sole_local_receiver():
+            self._logger.warning("Further receivers connected, no longer passing data via shared memory in this run")
+            self._transmitter.ring = None
+
+    def _socket_options(self) -> dict[str, int]:
+        """Return the options applied to the socket used in this run."""
+        socket = self._shm_socket if self._transmitter is self._shm_transmitter else self._socket
+        assert socket  # for typing
+        return socket_options(socket)
+
+    def _send_event(self, send: Any, payload: Any, meta: dict[str, Any]) -> None:
+        """Send a BOR/EOR, which is never dropped, retrying on send timeouts."""
+        send_run_event(send, payload, meta, self.stopevt, self._logger)
+
+    def _reset_credit(self) -> None:
+        """Discard credit granted during previous runs."""
+        assert self._credit_socket  # for typing
+        while self._credit_socket.poll(0):
+            self._credit_socket.recv()
+        self.credit_messages = 0
+        self.credit_bytes = 0
+
+    def _acquire_credit(self, nbytes: int) -> None:
+        """Wait until receivers granted credit and charge a data message of nbytes to it.
+
+        Credit is available while both message and byte credit are positive,
+        so messages larger than the window granted can still be sent.
+
+        """
+        assert self._credit_socket  # for typing
+        while self._credit_socket.poll(0):
+            self._add_credit(self._credit_socket.recv())
+        if self.credit_messages <= 0 or self.credit_bytes <= 0:
+            # receivers need the payloads held back to grant more credit
+            self._flush()
+            start = time.monotonic()
+            warned = False
+            while self.credit_messages <= 0 or self.credit_bytes <= 0:
+                if self._credit_socket.poll(250):
+                    self._add_credit(self._credit_socket.recv())
+                elif self.stopevt.is_set():
+                    self._logger.warning("Sending data without credit while shutting down")
+                    break
+                elif not warned and time.monotonic() - start > 10:
+                    self._logger.warning("Waiting for receivers to grant credit for more than 10s")
+                    warned = True
+            self.stats.record_stall(time.monotonic() - start)
+        self.credit_messages -= 1
+        self.credit_bytes -= nbytes
+
+    def _add_credit(self, binmsg: bytes) -> None:
+        """Add credit granted by a receiver."""
+        messages, nbytes = decode_credit(binmsg)
+        self.credit_messages += messages
+        self.credit_bytes += nbytes
+
+    def _get_timeout(self) -> float:
+        """Return how long to wait for new payloads from the queue."""
+        if self._inflight:
+            return 0.0
+        if self._batch:
+            return max(self._deadline - time.monotonic(), 0.0)
+        return 0.5
+
+    def _send_data(self, payload: Any, meta: Any, stamp: float | None) -> None:
+        """Send a data payload or add it to the current batch."""
+        if self.batch_size > 1:
+            if not self._batch:
+                self._deadline = time.monotonic() + self.batch_timeout
+            self._batch.append((payload, meta))
+            self._batch_stamps.append(stamp)
+            if len(self._batch) >= self.batch_size or time.monotonic() >= self._deadline:
+                self._send_batch()
+            # task_done is called once the batch is sent
+            return
+        self._check_shared_memory()
+        try:
+            self._transmitter.send_data(payload=payload, meta=meta)
+            self.stats.record(payload_nbytes(payload), stamp, time.monotonic())
+            self._logger.debug(f"Sending packet number {self._transmitter.sequence_number}")
+        except zmq.Again:
+            # send timeout expired; the sequence number of the payload is skipped
+            self.stats.record_drop(1)
+            self._logger.debug(f"Dropped packet number {self._transmitter.sequence_number}")
+        self.queue.task_done()
+
+    def _send_batch(self) -> None:
+        """Send and clear the collected batch of payloads."""
+        if not self._batch:
+            return
+        self._check_shared_memory()
+        try:
+            self._transmitter.send_data_batch(self._batch)
+            now = time.monotonic()
+            for (payload, _meta), stamp in zip(self._batch, self._batch_stamps):
+                self.stats.record(payload_nbytes(payload), stamp, now)
+            self._logger.debug(
+                f"Sending batch of {len(self._batch)} packets up to number {self._transmitter.sequence_number}"
+            )
+        except zmq.Again:
+            self.stats.record_drop(len(self._batch))
+            self._logger.debug(
+                f"Dropped batch of {len(self._batch)} packets up to number {self._transmitter.sequence_number}"
+            )
+        for _ in range(len(self._batch)):
+            self.queue.task_done()
+        self._batch.clear()
+        self._batch_stamps.clear()
+
+    def _collect(self, wait: bool) -> None:
+        """Send compressed payloads in order of arrival, waiting for the oldest if requested."""
+        while self._inflight and (wait or self._inflight[0][0].done()):
+            future, meta, stamp = self._inflight.popleft()
+            self._send_data(future.result(), meta, stamp)
+            wait = False
+
+    def _flush(self) -> None:
+        """Send all payloads being compressed or collected into a batch."""
+        while self._inflight:
+            self._collect(wait=True)
+        self._send_batch()
 
     def join(self, *args: Any, **kwargs: Any) -> Any:
         return super().join(*args, **kwargs)
@@ -84,14 +473,51 @@ class DataSender(Satellite):
         self._end_of_run: dict[str, dict[str, Any]] = {"payload": {}, "meta": {}}
         # set up the data pusher which will transmit data placed into the queue
         # via ZMQ socket
-        self.data_queue: Queue = Queue()  # type: ignore[type-arg]
+        self.data_queue: DataQueue = DataQueue()
         self.data_port = data_port
+        # additional data lanes, each with its own queue, socket and port; the
+        # first lane uses data_queue, socket and data_port
+        self.data_lanes: int = 1
+        self._lane_queues: list[DataQueue] = [self.data_queue]
+        self._lane_sockets: list[zmq.Socket] = []  # type: ignore[type-arg]
+        self._lane_ports: list[int] = []
+        self._next_lane = 0
+        # coalescing of payloads into batched data messages (disabled by default)
+        self.batch_size: int = 1
+        self.batch_timeout: float = 0.0
+        # compression of data payloads (disabled by default)
+        self.compressor: Compressor | None = None
+        self.compression_workers: int = 1
+        # threads sending the data of each lane
+        self._push_threads: list[PushThread] = []
+        self._latency_seen = (0, 0.0)
+        # ipc sockets and shared memory ring buffers passing data to receivers
+        # on the same host, one per lane
+        self.shm_size: int = 0
+        self._shm_sockets: list[zmq.Socket] = []  # type: ignore[type-arg]
+        self._rings: list[ShmRingBuffer] = []
+        # receivers connected to the data sockets of each lane and to the ipc
+        # sockets, to only use shared memory with a single local receiver
+        self._peer_monitors: list[PeerMonitor] = []
+        self._shm_peer_monitors: list[PeerMonitor] = []
+        # credit-based flow control (disabled by default): sockets receivers
+        # grant credit on, one per lane
+        self.flow_control: bool = False
+        self._credit_sockets: list[zmq.Socket] = []  # type: ignore[type-arg]
+        self._credit_ports: list[int] = []
+        # ZMQ options of the data sockets (ZMQ defaults)
+        self.send_hwm: int = 1000
+        self.send_buffer: int = -1
+        self.send_timeout: int = -1
 
         # initialize satellite
         super().__init__(*args, **kwargs)
 
         ctx = self.context or zmq.Context()
         self.socket = ctx.socket(zmq.PUSH)
+        set_affinity(self.socket)
+        # receivers may connect before shared memory is configured
+        self._peer_monitors = [PeerMonitor(self.socket)]
 
         if not self.data_port:
             self.data_port = self.socket.bind_to_random_port(f"tcp://{self.interface}")
@@ -102,12 +528,105 @@ class DataSender(Satellite):
         self.register_offer(CHIRPServiceIdentifier.DATA, self.data_port)
         self.broadcast_offers()
 
+    def do_initializing(self, config: dict[str, Any]) -> str:
+        """Initialize and configure the satellite.
+
+        Inheriting classes should call this method to configure the
+        transmission of data.
+
+        """
+        # how many payloads to coalesce into a single data message?
+        self.batch_size = self.config.setdefault("_batch_size", 1)
+        # how long [ms] to wait at most for a batch to fill up?
+        self.batch_timeout = self.config.setdefault("_batch_timeout", 10) / 1000
+        # number of sockets to distribute data over
+        self.data_lanes = self.config.setdefault("_data_lanes", 1)
+        if self.data_lanes < 1:
+            raise ValueError("At least one data lane is required")
+        # limits and backpressure policy of the data queue of each lane
+        max_items = self.config.setdefault("_queue_max_items", 0)
+        max_bytes = self.config.setdefault("_queue_max_bytes", 0)
+        policy = QueuePolicy(self.config.setdefault("_queue_policy", QueuePolicy.BLOCK.value))
+        # NOTE the configuration is sent with the BOR and may not hold None values
+        spill_path = self.config.setdefault("_queue_spill_path", "") or None
+        for queue in self._lane_queues:
+            queue.close()
+        self._lane_queues = [DataQueue(max_items, max_bytes, policy, spill_path) for _ in range(self.data_lanes)]
+        self.data_queue = self._lane_queues[0]
+        # codec to compress data payloads with ('none', 'auto' or codec name)
+        codec = self.config.setdefault("_compression", "none")
+        level = self.config["_compression_level"] if "_compression_level" in self.config.get_keys() else None
+        self.compressor = Compressor(codec, level) if codec != "none" else None
+        self.compression_workers = self.config.setdefault("_compression_workers", min(4, os.cpu_count() or 1))
+        # size [bytes] of the shared memory buffer for receivers on the same host
+        self.shm_size = self.config.setdefault("_shared_memory_size", 0) if zmq.has("ipc") else 0
+        # only send data messages receivers granted credit for?
+        self.flow_control = self.config.setdefault("_flow_control", False)
+        # number of messages buffered by ZMQ and kernel send buffer size [B] per connection
+        self.send_hwm = self.config.setdefault("_send_hwm", 1000)
+        self.send_buffer = self.config.setdefault("_send_buffer", -1)
+        # time [ms] to wait for sending a data message before dropping it, -1 to block
+        self.send_timeout = self.config.setdefault("_send_timeout", -1)
+        self._configure_socket(self.socket)
+        self._configure_monitoring(2.0)
+        return "Configured DataSender"
+
     def reentry(self) -> None:
+        for monitor in self._peer_monitors + self._shm_peer_monitors:
+            monitor.close()
+        self._peer_monitors = []
+        self._shm_peer_monitors = []
         # close the socket
         self.socket.close()
+        for socket in self._lane_sockets + self._shm_sockets + self._credit_sockets:
+            socket.close()
+        for ring in self._rings:
+            ring.close()
+        self._rings = []
+        for queue in self._lane_queues:
+            queue.close()
         self.log.debug("Closed data socket")
         super().reentry()
 
+    def queue_data(
+        self,
+        payload: Any,
+        meta: dict[str, Any] | None = None,
+        track: bool = False,
+        key: Any = None,
+    ) -> zmq.MessageTracker | None:
+        """Queue a data payload for transmission by the PushThread.
+
+        payload: any object supporting the buffer protocol (e.g. a NumPy array)
+        or a list of those for a multi-frame message. The buffers are not
+        copied, so they must not be modified before transmission is complete.
+
+        meta: optional dictionary sent with the message header.
+
+        track: whether to return a zmq.MessageTracker which is done once ZMQ has
+        released all payload buffers and they can be reused.
+
+        key: if multiple data lanes are configured, payloads with the same
+        (hashable) key are always sent via the same lane. Payloads without key
+        are distributed round-robin.
+
+        """
+        tracker = None
+        if track:
+            if isinstance(payload, list):
+                payload = [zmq.Frame(frame, copy=False, track=True) for frame in payload]
+                tracker = zmq.MessageTracker(*payload)
+            else:
+                payload = zmq.Frame(payload, copy=False, track=True)
+                tracker = zmq.MessageTracker(payload)
+        if key is not None:
+            lane = hash(key) % self.data_lanes
+        else:
+            lane = self._next_lane
+            self._next_lane = (lane + 1) % self.data_lanes
+        self._lane_queues[lane].put((payload, meta))
+        return tracker
+
     @property
     def EOR(self) -> Any:
         """Get optional playload for the end-of-run event (EOR)."""
@@ -118,6 +637,23 @@ class DataSender(Satellite):
         """Set optional playload for the end-of-run event (EOR)."""
         self._end_of_run["payload"] = payload
 
+    def declare_stream(self, dtype: Any, shape: Sequence[int] = (-1,)) -> ArraySchema:
+        """Declare that all payload frames are arrays of the given data type and shape.
+
+        The schema is sent once with the BOR, so data messages only carry the
+        raw bytes and no per-message meta describing them. Receivers create
+        NumPy views of the payloads from the schema. Needs to be called before
+        the run is started, e.g. in `do_initializing`.
+
+        dtype: any NumPy data type including structured records.
+
+        shape: shape of the array in each frame, one dimension may be -1.
+
+        """
+        schema = ArraySchema(dtype, shape)
+        self._beg_of_run["meta"][SCHEMA_META_KEY] = schema.to_meta()
+        return schema
+
     @property
     def BOR(self) -> Any:
         """Get optional playload for the beginning-of-run event (BOR)."""
@@ -131,34 +667,97 @@ class DataSender(Satellite):
     def _wrap_launch(self, payload: Any) -> str:
         """Wrapper for the 'launching' transitional state of the FSM.
 
-        This method starts the PushThread for the DataSender.
+        This method binds the sockets of additional data lanes and starts a
+        PushThread for each lane of the DataSender.
 
         """
+        # bind and offer sockets for additional lanes
+        for _ in range(1, self.data_lanes):
+            socket = self.context.socket(zmq.PUSH)
+            set_affinity(socket)
+            self._configure_socket(socket)
+            self._peer_monitors.append(PeerMonitor(socket))
+            port = socket.bind_to_random_port(f"tcp://{self.interface}")
+            self._lane_sockets.append(socket)
+            self._lane_ports.append(port)
+            self.register_offer(CHIRPServiceIdentifier.DATA, port)
+        if self._lane_ports:
+            self.broadcast_offers(CHIRPServiceIdentifier.DATA)
+        # receivers on the same host connect to an ipc socket next to each port
+        if self.shm_size > 0:
+            for port in [self.data_port] + self._lane_ports:
+                socket = self.context.socket(zmq.PUSH)
+                set_affinity(socket)
+                self._configure_socket(socket)
+                self._shm_peer_monitors.append(PeerMonitor(socket))
+                socket.bind(ipc_endpoint(port))
+                self._shm_sockets.append(socket)
+                self._rings.append(ShmRingBuffer(size=self.shm_size))
+        # receivers connect to the port announced in the BOR to grant credit
+        if self.flow_control:
+            for _ in range(self.data_lanes):
+                socket = self.context.socket(zmq.PULL)
+                self._credit_ports.append(socket.bind_to_random_port(f"tcp://{self.interface}"))
+                self._credit_sockets.append(socket)
         self._stop_pusher = threading.Event()
-        self._push_thread = PushThread(
-            name=self.name,
-            stopevt=self._stop_pusher,
-            socket=self.socket,
-            queue=self.data_queue,
-            daemon=True,  # terminate with the main thread
-        )
-        # self._push_thread.name = f"{self.name}_Pusher-thread"
-        self._push_thread.start()
-        self.log.info(f"Satellite {self.name} publishing data on port {self.data_port}")
+        self._push_threads = [
+            PushThread(
+                name=self.name,
+                stopevt=self._stop_pusher,
+                socket=socket,
+                queue=queue,
+                batch_size=self.batch_size,
+                batch_timeout=self.batch_timeout,
+                compressor=self.compressor,
+                compression_workers=self.compression_workers,
+                shm_socket=self._shm_sockets[lane] if self._shm_sockets else None,
+                ring=self._rings[lane] if self._rings else None,
+                peers=self._peer_monitors[lane],
+                shm_peers=self._shm_peer_monitors[lane] if self._shm_peer_monitors else None,
+                credit_socket=self._credit_sockets[lane] if self._credit_sockets else None,
+                credit_port=self._credit_ports[lane] if self._credit_ports else 0,
+                daemon=True,  # terminate with the main thread
+            )
+            for lane, (socket, queue) in enumerate(zip([self.socket] + self._lane_sockets, self._lane_queues))
+        ]
+        for thread in self._push_threads:
+            thread.start()
+        ports = ", ".join(str(port) for port in [self.data_port] + self._lane_ports)
+        self.log.info(f"Satellite {self.name} publishing data on port {ports}")
         res: str = super()._wrap_launch(payload)
         return res
 
     def _wrap_land(self, payload: Any) -> str:
         """Wrapper for the 'landing' transitional state of the FSM.
 
-        This method will stop the PushThread.
+        This method will stop the PushThreads and close additional data lanes.
 
         """
         self._stop_pusher.set()
-        try:
-            self._push_thread.join(timeout=10)
-        except TimeoutError:
-            self.log.warning("Unable to close push thread. Process timed out.")
+        for thread in self._push_threads:
+            thread.join(timeout=10)
+            if thread.is_alive():
+                self.log.warning("Unable to close push thread. Process timed out.")
+        # only the monitor of the first lane outlives the launch
+        for monitor in self._peer_monitors[1:] + self._shm_peer_monitors:
+            monitor.close()
+        self._peer_monitors = self._peer_monitors[:1]
+        self._shm_peer_monitors = []
+        for socket, port in zip(self._lane_sockets, self._lane_ports):
+            self.unregister_offer(port)
+            socket.close()
+        self._lane_sockets = []
+        self._lane_ports = []
+        for socket in self._shm_sockets:
+            socket.close()
+        for ring in self._rings:
+            ring.close()
+        self._shm_sockets = []
+        self._rings = []
+        for socket in self._credit_sockets:
+            socket.close()
+        self._credit_sockets = []
+        self._credit_ports = []
         res: str = super()._wrap_land(payload)
         return res
 
@@ -173,8 +772,14 @@ class DataSender(Satellite):
         # configuration dictionary as a payload
         if not self.BOR:
             self.BOR = self.config._config
+        # advertise the codec data payloads are compressed with
+        if self.compressor:
+            self._beg_of_run["meta"][CODEC_META_KEY] = self.compressor.codec
+        else:
+            self._beg_of_run["meta"].pop(CODEC_META_KEY, None)
         self.log.debug("Sending BOR")
-        self.data_queue.put((self._beg_of_run, CDTPMessageIdentifier.BOR))
+        self._next_lane = 0
+        self._put_lanes(self._beg_of_run, CDTPMessageIdentifier.BOR)
         res: str = super()._wrap_start(run_identifier)
         return res
 
@@ -187,9 +792,113 @@ class DataSender(Satellite):
         """
         res: str = super()._wrap_stop(payload)
         self.log.debug("Sending EOR")
-        self.data_queue.put((self._end_of_run, CDTPMessageIdentifier.EOR))
+        self._put_lanes(self._end_of_run, CDTPMessageIdentifier.EOR)
         return res
 
+    def _configure_socket(self, socket: zmq.Socket) -> None:  # type: ignore[type-arg]
+        """Apply the configured options to a data socket.
+
+        Options only affect connections established afterwards.
+
+        """
+        socket.setsockopt(zmq.SNDHWM, self.send_hwm)
+        socket.setsockopt(zmq.SNDBUF, self.send_buffer)
+        socket.setsockopt(zmq.SNDTIMEO, self.send_timeout)
+
+    def _put_lanes(self, event: dict[str, Any], msgtype: CDTPMessageIdentifier) -> None:
+        """Queue a BOR/EOR event on every data lane.
+
+        With multiple lanes, the meta identifies the lane to the receiver.
+
+        """
+        if self.data_lanes == 1:
+            self.data_queue.put((event, msgtype))
+            return
+        for lane, queue in enumerate(self._lane_queues):
+            meta = {**event["meta"], LANE_META_KEY: lane, LANES_META_KEY: self.data_lanes}
+            queue.put(({"payload": event["payload"], "meta": meta}, msgtype))
+
+    def _get_queue_stat(self, stat: str) -> Any:
+        """Get a specific metric summed over the data queues of all lanes."""
+        return sum(getattr(queue, stat) for queue in self._lane_queues)
+
+    def _get_queue_depth(self) -> int:
+        """Get the number of payloads in the data queues of all lanes."""
+        return sum(queue.qsize() for queue in self._lane_queues)
+
+    def _get_queue_spill_depth(self) -> int:
+        """Get the number of payloads spilled to disk in all lanes."""
+        return sum(queue.spill_depth() for queue in self._lane_queues)
+
+    def _configure_monitoring(self, interval: float) -> None:
+        """Schedule monitoring for the data queue."""
+        self.schedule_metric("queue_depth", "", MetricsType.LAST_VALUE, interval, self._get_queue_depth)
+        self.schedule_metric("queue_spill_depth", "", MetricsType.LAST_VALUE, interval, self._get_queue_spill_depth)
+        for stat, unit in [("nbytes", "B"), ("dropped", ""), ("spilled_bytes", "B")]:
+            self.schedule_metric(
+                f"queue_{stat}",
+                unit,
+                MetricsType.LAST_VALUE,
+                interval,
+                partial(self._get_queue_stat, stat=stat),
+            )
+        self.schedule_metric(
+            "tx_dropped", "", MetricsType.LAST_VALUE, interval, partial(self._get_tx_stat, stat="total_dropped")
+        )
+        # totals are published as rates, latencies averaged per interval
+        for stat, unit in [("messages", ""), ("bytes", "B")]:
+            self.schedule_metric(
+                f"tx_{stat}",
+                unit,
+                MetricsType.RATE,
+                interval,
+                partial(self._get_tx_stat, stat=f"total_{stat}"),
+            )
+        for stat, unit in [("stalls", ""), ("stall_time", "s")]:
+            self.schedule_metric(
+                f"credit_{stat}",
+                unit,
+                MetricsType.RATE,
+                interval,
+                partial(self._get_tx_stat, stat=f"total_{stat}"),
+            )
+        self._latency_seen = (0, 0.0)
+        self.schedule_metric("tx_latency", "ms", MetricsType.AVERAGE, interval, self._get_tx_latency)
+        self.schedule_metric("compression_ratio", "", MetricsType.LAST_VALUE, interval, self._get_compression_ratio)
+        self.schedule_metric("compression_cpu_time", "s", MetricsType.LAST_VALUE, interval, self._get_compression_cpu_time)
+
+    def _tx_stats(self) -> list[TransmissionStats]:
+        """Get the transmission statistics of all lanes."""
+        return [thread.stats for thread in self._push_threads]
+
+    def _get_tx_stat(self, stat: str) -> float | None:
+        """Get a transmission total summed over all lanes."""
+        stats = self._tx_stats()
+        if not stats:
+            return None
+        total: float = sum(getattr(lane_stats, stat) for lane_stats in stats)
+        return total
+
+    def _get_tx_latency(self) -> float | None:
+        """Get the mean time [ms] payloads spent queued since the last call."""
+        stats = self._tx_stats()
+        count = sum(lane_stats.total_latency_count for lane_stats in stats)
+        total = sum(lane_stats.total_latency for lane_stats in stats)
+        seen_count, seen_total = self._latency_seen
+        self._latency_seen = (count, total)
+        if count <= seen_count:
+            # nothing sent since the last call or new threads launched
+            return None
+        return (total - seen_total) / (count - seen_count) * 1e3
+
+    def _get_compression_ratio(self) -> float | None:
+        """Get the achieved compression ratio."""
+        return self.compressor.get_ratio() if self.compressor else None
+
+    def _get_compression_cpu_time(self) -> float | None:
+        """Get the CPU time spent compressing payloads."""
+        return self.compressor.get_cpu_time() if self.compressor else None
+
     def do_run(self, payload: Any) -> str:
         """Perform the data acquisition and enqueue the results.
 
@@ -211,30 +920,284 @@ class DataSender(Satellite):
         raise NotImplementedError
 
 
+class AsyncDataSender(DataSender):
+    """Constellation Satellite which pushes data via ZMQ from asyncio code.
+
+    Instead of queueing payloads for a PushThread, the acquisition coroutine
+    do_run_async() awaits send_data(), which only returns once ZMQ accepted the
+    payload. Backpressure therefore applies directly to the acquisition. The
+    coroutine runs in an event loop of the acquisition thread. BOR and EOR are
+    sent as by the DataSender.
+
+    Data is sent via a single lane, without batching, compression, shared
+    memory or flow control.
+
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        self.stats = TransmissionStats()
+        self._transmitter: DataTransmitter | None = None
+        self._async_socket: zmq.asyncio.Socket | None = None
+        super().__init__(*args, **kwargs)
+
+    def do_initializing(self, config: dict[str, Any]) -> str:
+        """Initialize and configure the satellite."""
+        res = super().do_initializing(config)
+        if self.data_lanes > 1 or self.batch_size > 1 or self.compressor or self.flow_control:
+            raise ValueError("AsyncDataSender does not support data lanes, batching, compression or flow control")
+        return res
+
+    def _wrap_launch(self, payload: Any) -> str:
+        """Wrapper for the 'launching' transitional state of the FSM.
+
+        Data is sent from the acquisition thread, so no PushThread is started.
+
+        """
+        self._transmitter = DataTransmitter(self.name, self.socket)
+        self.log.info(f"Satellite {self.name} publishing data on port {self.data_port}")
+        res: str = super(DataSender, self)._wrap_launch(payload)
+        return res
+
+    def _wrap_land(self, payload: Any) -> str:
+        """Wrapper for the 'landing' transitional state of the FSM."""
+        self._transmitter = None
+        res: str = super(DataSender, self)._wrap_land(payload)
+        return res
+
+    def _wrap_start(self, run_identifier: str) -> str:
+        """Wrapper for the 'run' state of the FSM.
+
+        The BOR is sent by the event loop of the acquisition before calling
+        do_run_async().
+
+        """
+        # Beginning of run event. If nothing was provided by the user, use the
+        # configuration dictionary as a payload
+        if not self.BOR:
+            self.BOR = self.config._config
+        self._beg_of_run["meta"].pop(CODEC_META_KEY, None)
+        self.stats.reset()
+        res: str = super(DataSender, self)._wrap_start(run_identifier)
+        return res
+
+    def _wrap_stop(self, payload: Any) -> str:
+        """Wrapper for the 'stopping' transitional state of the FSM.
+
+        Sends the EOR event after base class wrapper and `do_stopping` have
+        finished.
+
+        """
+        res: str = super(DataSender, self)._wrap_stop(payload)
+        assert self._transmitter  # for typing
+        eor = self.EOR
+        if isinstance(eor, dict):
+            # summarize the transmission of the run
+            eor = {**eor, **self.stats.summary()}
+        self.log.debug("Sending EOR")
+        send_run_event(self._transmitter.send_end, eor, self._end_of_run["meta"], self._com_thread_evt, self.log)
+        return res
+
+    def do_run(self, run_identifier: str) -> str:
+        """Run the acquisition coroutine in an event loop."""
+        return asyncio.run(self._run_async(run_identifier))
+
+    async def _run_async(self, run_identifier: str) -> str:
+        """Send the BOR and perform the acquisition."""
+        assert self._transmitter  # for typing
+        # shares the underlying socket, which is not used elsewhere during the run
+        self._async_socket = zmq.asyncio.Socket.from_socket(self.socket)
+        try:
+            meta = {**self._beg_of_run["meta"], SOCKET_META_KEY: socket_options(self.socket)}
+            self._transmitter.sequence_number = 0
+            self.log.debug("Sending BOR")
+            if not await self._send(self._transmitter.encode(CDTPMessageIdentifier.BOR, self.BOR, meta)):
+                return "Stopped before a receiver accepted the BOR"
+            return await self.do_run_async(run_identifier)
+        finally:
+            self._async_socket = None
+
+    async def do_run_async(self, run_identifier: str) -> str:
+        """Perform the data acquisition and send the results via send_data().
+
+        This is only an abstract method. Inheriting classes must implement their
+        own acquisition coroutine. It needs to monitor the self._state_thread_evt
+        Event and return once the Event is set.
+
+        This method should return a string that will be used for setting the
+        Status once the data acquisition is finished.
+
+        """
+        raise NotImplementedError
+
+    async def send_data(self, payload: Any, meta: dict[str, Any] | None = None) -> bool:
+        """Send a data payload, waiting until ZMQ accepted it.
+
+        payload: any object supporting the buffer protocol or a list of those
+        for a multi-frame message. The buffers are not copied, so they must not
+        be modified before the call returns.
+
+        meta: optional dictionary sent with the message header.
+
+        Returns False if the payload was dropped as the run is being stopped.
+
+        """
+        assert self._transmitter  # for typing
+        start = time.monotonic()
+        self._transmitter.sequence_number += 1
+        frames = self._transmitter.encode(CDTPMessageIdentifier.DAT, payload, meta)
+        if not await self._send(frames):
+            self.stats.record_drop(1)
+            return False
+        # time spent waiting for ZMQ is accounted as latency
+        self.stats.record(payload_nbytes(payload), start, time.monotonic())
+        return True
+
+    async def _send(self, frames: list[Any]) -> bool:
+        """Send a message, waiting for ZMQ to accept it unless the run is stopped."""
+        assert self._async_socket  # for typing
+        future = asyncio.ensure_future(self._async_socket.send_multipart(frames, copy=False))
+        while True:
+            done, _ = await asyncio.wait([future], timeout=0.25)
+            if done:
+                future.result()
+                return True
+            if self._state_thread_evt and self._state_thread_evt.is_set():
+                future.cancel()
+                return False
+
+    def _tx_stats(self) -> list[TransmissionStats]:
+        """Get the transmission statistics."""
+        return [self.stats]
+
+
 class RandomDataSender(DataSender):
-    """Constellation Satellite which pushes RANDOM data via ZMQ."""
+    """Constellation Satellite which pushes RANDOM data via ZMQ.
 
-    def do_run(self, payload: Any) -> str:
-        """Example implementation that generates random values."""
-        samples = np.linspace(0, 2 * np.pi, 1024, endpoint=False)
-        fs = random.uniform(0, 3)
-        data_load = np.sin(2 * np.pi * fs * samples)
+    Acts as configurable load generator: payloads of a given size distribution
+    are sent at a target rate, optionally in bursts and spills.
 
-        t0 = time.time_ns()
+    """
 
+    def do_initializing(self, config: dict[str, Any]) -> str:
+        """Configure the generated load."""
+        super().do_initializing(config)
+        # mean payload size [B] per frame and its distribution
+        self.payload_size = self.config.setdefault("payload_size", 8192)
+        self.payload_distribution = self.config.setdefault("payload_distribution", "fixed")
+        self.payload_spread = self.config.setdefault("payload_spread", 0)
+        if self.payload_distribution not in ["fixed", "uniform", "normal", "exponential"]:
+            raise ValueError(f"Unknown payload distribution '{self.payload_distribution}'")
+        self.frames = self.config.setdefault("frames", 1)
+        # target message rate [Hz], or data rate [MB/s] if set
+        self.rate = self.config.setdefault("rate", 2.0)
+        data_rate = self.config.setdefault("data_rate", 0.0)
+        if data_rate > 0:
+            self.rate = data_rate * 1e6 / (self.payload_size * self.frames)
+        if self.rate <= 0:
+            raise ValueError("Message rate needs to be positive")
+        # messages sent back-to-back at once
+        self.burst_size = self.config.setdefault("burst_size", 1)
+        # duration [s] of spills with data and the pauses between them (0 for continuous data)
+        self.spill_duration = self.config.setdefault("spill_duration", 0.0)
+        self.spill_pause = self.config.setdefault("spill_pause", 0.0)
+        # generate new random data for every message rather than reusing buffers
+        self.regenerate = self.config.setdefault("regenerate", False)
+        # payloads are byte arrays of varying length
+        self.declare_stream(np.uint8)
+        return "Configured RandomDataSender"
+
+    def do_run(self, payload: Any) -> str:
+        """Generate random payloads following the configured rate and pattern."""
+        rng = np.random.default_rng()
+        max_size = self._max_payload_size()
+        # preallocated buffers are cycled through; regenerating a buffer waits
+        # until ZMQ released it
+        buffers = [rng.random((max_size + 7) // 8) for _ in range(max(4 * self.burst_size * self.frames, 16))]
+        trackers: list[zmq.MessageTracker | None] = [None] * len(buffers)
+
+        interval = self.burst_size / self.rate
         num = 0
+        nbytes = 0
+        late = 0
         # assert for mypy static type analysis
         assert isinstance(self._state_thread_evt, threading.Event)
 
+        t0 = time.monotonic()
+        spill_start = t0
+        next_burst = t0
         while not self._state_thread_evt.is_set():
-            self.data_queue.put((data_load.tobytes(), {"dtype": f"{data_load.dtype}"}))
-            self.log.debug(f"Queueing data packet {num}")
-            num += 1
-            time.sleep(0.5)
-
-        t1 = time.time_ns()
-        self.log.info(f"total time for {num} evt / {num * len(data_load) / 1024 / 1024}MB: {(t1 - t0) / 1000000000}s")
-        return "Finished acquisition"
+            if self.spill_duration > 0 and next_burst - spill_start >= self.spill_duration:
+                # pause between spills
+                spill_start += self.spill_duration + self.spill_pause
+                next_burst = spill_start
+            self._wait_until(next_burst)
+            if self._state_thread_evt.is_set():
+                break
+            sizes = self._draw_sizes(rng, self.burst_size * self.frames, max_size)
+            for msg in range(self.burst_size):
+                frames = []
+                for frame in range(self.frames):
+                    idx = (num * self.frames + frame) % len(buffers)
+                    if self.regenerate:
+                        tracker = trackers[idx]
+                        if tracker is not None:
+                            tracker.wait()
+                        rng.random(out=buffers[idx])
+                    frames.append(buffers[idx].view(np.uint8)[: sizes[msg * self.frames + frame]])
+                tracker = self.queue_data(frames if self.frames > 1 else frames[0], track=self.regenerate)
+                if self.regenerate:
+                    for frame in range(self.frames):
+                        trackers[(num * self.frames + frame) % len(buffers)] = tracker
+                nbytes += int(sum(sizes[msg * self.frames : (msg + 1) * self.frames]))
+                num += 1
+            next_burst += interval
+            if time.monotonic() - next_burst > 1.0:
+                # cannot keep up, do not try to catch up
+                late += 1
+                next_burst = time.monotonic()
+
+        duration = time.monotonic() - t0
+        if late:
+            self.log.warning(f"Could not keep up with the target rate of {self.rate:.1f} Hz")
+        self.log.info(
+            f"Queued {num} messages / {nbytes / 1e6:.2f} MB in {duration:.2f}s: "
+            f"{num / duration:.1f} Hz / {nbytes / 1e6 / duration:.2f} MB/s"
+        )
+        return f"Finished acquisition of {num} messages at {num / duration:.1f} Hz"
+
+    def _max_payload_size(self) -> int:
+        """Return the largest frame size drawn from the distribution."""
+        if self.payload_distribution == "uniform":
+            return int(self.payload_size + self.payload_spread)
+        if self.payload_distribution == "normal":
+            return int(self.payload_size + 5 * self.payload_spread)
+        if self.payload_distribution == "exponential":
+            return int(10 * self.payload_size)
+        return int(self.payload_size)
+
+    def _draw_sizes(self, rng: np.random.Generator, num: int, max_size: int) -> Any:
+        """Draw frame sizes from the configured distribution."""
+        sizes: Any
+        if self.payload_distribution == "uniform":
+            sizes = rng.integers(self.payload_size - self.payload_spread, self.payload_size + self.payload_spread + 1, num)
+        elif self.payload_distribution == "normal":
+            sizes = rng.normal(self.payload_size, self.payload_spread, num)
+        elif self.payload_distribution == "exponential":
+            sizes = rng.exponential(self.payload_size, num)
+        else:
+            return np.full(num, self.payload_size)
+        return np.clip(sizes, 1, max_size).astype(np.int64)
+
+    def _wait_until(self, deadline: float) -> None:
+        """Wait until the deadline of the monotonic clock, or the run stops."""
+        assert isinstance(self._state_thread_evt, threading.Event)
+        remaining = deadline - time.monotonic()
+        if remaining > 0.002:
+            # sleep coarsely, then spin for the remainder to be precise
+            self._state_thread_evt.wait(remaining - 0.001)
+        while time.monotonic() < deadline and not self._state_thread_evt.is_set():
+            # yield the GIL to the push thread while spinning
+            time.sleep(0)
 
 
 # -------------------------------------------------------------------------
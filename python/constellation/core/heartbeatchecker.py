@@ -83,7 +83,7 @@ class HeartbeatChecker(BaseSatelliteFrame):
                 self.log.warning(f"Heartbeating for {host} already registered!")
                 return hb.failed
 
-        ctx = context or zmq.Context()
+        ctx = context or self.context
         try:
             socket = ctx.socket(zmq.SUB)
         except zmq.ZMQError as e:
@@ -248,3 +248,14 @@ class HeartbeatChecker(BaseSatelliteFrame):
         for socket in self._states.keys():
             socket.close()
         self._states = dict[zmq.Socket, HeartbeatState]()  # type: ignore[type-arg]
+
+    def reentry(self) -> None:
+        """Stop heartbeat checks and close their connections."""
+        # the heartbeat thread needs to be stopped before closing its sockets
+        self._stop_com_threads()
+        with self._socket_lock:
+            for socket in self._states.keys():
+                self._poller.unregister(socket)
+                socket.close()
+            self._states = dict[zmq.Socket, HeartbeatState]()  # type: ignore[type-arg]
+        super().reentry()
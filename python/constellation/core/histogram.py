@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+SPDX-FileCopyrightText: 2024 DESY and the Constellation authors
+SPDX-License-Identifier: CC-BY-4.0
+
+Module providing fixed-bucket histograms for transmission statistics.
+"""
+
+import math
+from bisect import bisect_right
+from typing import Any
+
+
+def log_buckets(low: float, high: float, per_decade: int = 4) -> list[float]:
+    """Return logarithmically spaced bucket edges from low to high."""
+    steps = round(math.log10(high / low) * per_decade)
+    return [low * 10 ** (step / per_decade) for step in range(steps + 1)]
+
+
+# bucket edges for latencies [s] between 1us and 100s
+LATENCY_BUCKETS = log_buckets(1e-6, 1e2, per_decade=10)
+# bucket edges for sizes [B] between 16B and 1GiB
+SIZE_BUCKETS = [float(2**exp) for exp in range(4, 31)]
+
+
+class Histogram:
+    """Histogram with fixed bucket edges, cheap enough to fill per message.
+
+    Bucket i counts values v with edges[i-1] <= v < edges[i]; the first and
+    last bucket count under- and overflows. Quantiles are estimated by the
+    upper edge of the bucket they fall into.
+
+    """
+
+    def __init__(self, edges: list[float]):
+        self.edges = edges
+        self.reset()
+
+    def reset(self) -> None:
+        """Clear all entries."""
+        self.counts = [0] * (len(self.edges) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def fill(self, value: float) -> None:
+        """Add a value to the histogram."""
+        self.counts[bisect_right(self.edges, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def mean(self) -> float | None:
+        """Return the mean of all entries."""
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q: float) -> float | None:
+        """Return an estimate of the q-quantile (0 <= q <= 1) of all entries."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                # upper bucket edge, limited by the largest entry
+                edge = self.edges[idx] if idx < len(self.edges) else self.max
+                return min(edge, self.max)
+        return self.max
+
+    def summary(self, prefix: str, scale: float = 1.0) -> dict[str, Any]:
+        """Return count, mean, quantiles and maximum as flat dictionary with prefixed keys."""
+        if not self.count:
+            return {f"{prefix}_count": 0}
+        res: dict[str, Any] = {f"{prefix}_count": self.count, f"{prefix}_mean": self.sum / self.count * scale}
+        for q in (50, 90, 99):
+            res[f"{prefix}_p{q}"] = self.quantile(q / 100) * scale  # type: ignore[operator]
+        res[f"{prefix}_max"] = self.max * scale
+        return res
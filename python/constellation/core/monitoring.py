@@ -154,7 +154,8 @@ class MonitoringSender(BaseSatelliteFrame):
         """Metrics sender loop."""
         last_update: dict[str, datetime] = {}
         while self._com_thread_evt and not self._com_thread_evt.is_set():
-            for metric_name, param in self._metrics_callbacks.items():
+            # metrics may be scheduled while sending
+            for metric_name, param in list(self._metrics_callbacks.items()):
                 update = False
                 try:
                     last = last_update[metric_name]
@@ -405,7 +406,7 @@ class MonitoringListener(StatListener):
 
 
 class FileMonitoringListener(MonitoringListener):
-    def __init__(self, name: str, group: str, interface: str, output_path: str):
+    def __init__(self, name: str, group: str, interface: str, output_path: str, io_threads: int = 1):
         self.output_path = pathlib.Path(output_path)
         try:
             os.makedirs(self.output_path)
@@ -417,7 +418,7 @@ class FileMonitoringListener(MonitoringListener):
         except FileExistsError:
             pass
 
-        super().__init__(name, group, interface)
+        super().__init__(name, group, interface, io_threads=io_threads)
 
         handler = logging.handlers.RotatingFileHandler(
             self.output_path / "logs" / (group + ".log"),
@@ -123,3 +123,13 @@ def get_interfaces() -> list[str]:
         if if_addr:
             interfaces.append(if_addr)
     return interfaces
+
+
+def is_local_address(address: str) -> bool:
+    """Check whether an IPv4 address belongs to this host."""
+    try:
+        if ipaddress.ip_address(address).is_loopback:
+            return True
+    except ValueError:
+        return False
+    return any(get_addr(intf[1]) == address for intf in socket.if_nameindex())
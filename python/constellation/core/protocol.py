@@ -9,7 +9,6 @@ Module implementing the Constellation communication protocols.
 import msgpack  # type: ignore[import-untyped]
 import zmq
 
-import io
 import time
 from enum import StrEnum
 from typing import Any, Tuple
@@ -22,12 +21,18 @@ class Protocol(StrEnum):
     CHP = "CHP\x01"
 
 
+# packed representation of an empty meta map
+EMPTY_META: bytes = msgpack.packb({})
+
+
 class MessageHeader:
     """Class implementing a Constellation message header."""
 
     def __init__(self, name: str, protocol: Protocol):
         self.name: str = name
         self.protocol: Protocol = protocol
+        # protocol identifier and sender name are constant: pack them only once
+        self._prefix: bytes = msgpack.packb(protocol.value) + msgpack.packb(name)
 
     def send(
         self,
@@ -69,23 +74,24 @@ class MessageHeader:
         meta = unpacker.unpack()
         return host, timestamp, meta
 
-    def encode(self, meta: dict[str, Any] | None = None, **kwargs: Any) -> memoryview:
+    def encode_prefix(self, *fields: Any) -> bytes:
+        """Return the packed constant beginning of a header.
+
+        Contains the protocol identifier and the sender name, followed by any
+        additional fields given.
+
+        """
+        return self._prefix + b"".join(msgpack.packb(field) for field in fields)
+
+    def encode(self, meta: dict[str, Any] | None = None, **kwargs: Any) -> bytes:
         """Generate and return a header as list.
 
         Additional keyword arguments are required for protocols specifying
         additional fields.
 
         """
-        if not meta:
-            meta = {}
-        stream = io.BytesIO()
-        packer = msgpack.Packer()
-        stream.write(packer.pack(self.protocol.value))
-        stream.write(packer.pack(self.name))
         if self.protocol != Protocol.CDTP:
-            stream.write(packer.pack(msgpack.Timestamp.from_unix_nano(time.time_ns())))
+            fields = msgpack.packb(msgpack.Timestamp.from_unix_nano(time.time_ns()))
         else:
-            stream.write(packer.pack(kwargs["msgtype"]))
-            stream.write(packer.pack(kwargs["seqno"]))
-        stream.write(packer.pack(meta))
-        return stream.getbuffer()
+            fields = msgpack.packb(kwargs["msgtype"]) + msgpack.packb(kwargs["seqno"])
+        return b"".join((self._prefix, fields, msgpack.packb(meta) if meta else EMPTY_META))
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+SPDX-FileCopyrightText: 2024 DESY and the Constellation authors
+SPDX-License-Identifier: CC-BY-4.0
+
+Module providing an append-only file format for raw CDTP records with a binary
+index, and a reader giving random access to the records without copying.
+
+A data file starts with a file header followed by records. Each record starts
+with its length, the number of frames and the length of the record header,
+followed by the length of each frame, the record header and the frames. The
+record header is the MsgPack-encoded list of sender name, message type,
+sequence number, data lane and meta. BOR and EOR payloads are stored as a
+single MsgPack-encoded frame. All parts are padded to multiples of 8 bytes so
+that frames can be viewed as arrays of any data type.
+
+The index file holds one entry per record with its offset in the data file,
+the sender, the data lane, the message type, the sequence number and the time
+of writing. Senders are numbered in the order they appear in the file.
+"""
+
+import mmap
+import os
+import pathlib
+import struct
+import threading
+import time
+from typing import Any, Iterator
+
+import msgpack  # type: ignore[import-untyped]
+import numpy as np
+
+from .arrayschema import ArraySchema
+from .cdtp import SCHEMA_META_KEY, CDTPMessage, CDTPMessageIdentifier
+
+# file header of data and index files: magic and format version
+DATA_MAGIC = b"CDTPRAW\x00"
+INDEX_MAGIC = b"CDTPIDX\x00"
+FORMAT_VERSION = 1
+_FILE_HEADER = struct.Struct("<8sQ")
+# record length, number of frames and record header length
+_RECORD_PREFIX = struct.Struct("<QII")
+INDEX_DTYPE = np.dtype(
+    [
+        ("offset", "<u8"),
+        ("sender", "<u4"),
+        ("lane", "<u2"),
+        ("msgtype", "u1"),
+        ("reserved", "u1"),
+        ("sequence", "<u8"),
+        ("timestamp", "<i8"),
+    ]
+)
+INDEX_SUFFIX = ".idx"
+# maximum number of buffers written with a single system call
+_MAX_IOVEC = 512
+_PADDING = bytes(8)
+
+
+def index_path(path: pathlib.Path | str) -> pathlib.Path:
+    """Return the path of the index belonging to a data file."""
+    path = pathlib.Path(path)
+    return path.with_name(path.name + INDEX_SUFFIX)
+
+
+def _padding(nbytes: int) -> int:
+    return -nbytes % 8
+
+
+class RawFileWriter:
+    """Append CDTP messages to a data file and its index.
+
+    Records are collected until `write_size` bytes are pending and written
+    with a single gathering system call; payload frames are not copied. The
+    data file is preallocated in steps of `preallocate` bytes and truncated to
+    its content when closed. Appending is thread-safe.
+
+    """
+
+    def __init__(self, path: pathlib.Path | str, write_size: int = 4 * 1024 * 1024, preallocate: int = 1024**3):
+        self.path = pathlib.Path(path)
+        self.write_size = write_size
+        self.preallocate = preallocate
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            self._index_fd = os.open(index_path(self.path), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except OSError:
+            os.close(self._fd)
+            os.unlink(self.path)
+            raise
+        self._lock = threading.Lock()
+        self._pending: list[Any] = []
+        self._pending_bytes = 0
+        self._index: list[tuple[int, int, int, int, int, int, int]] = []
+        self._senders: dict[str, int] = {}
+        self._allocated = 0
+        header = _FILE_HEADER.pack(DATA_MAGIC, FORMAT_VERSION)
+        self._offset = len(header)
+        self._written = 0
+        self._pending.append(header)
+        self._pending_bytes = len(header)
+        os.write(self._index_fd, _FILE_HEADER.pack(INDEX_MAGIC, FORMAT_VERSION))
+
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes appended to the data file."""
+        return self._offset
+
+    def append(self, item: CDTPMessage) -> None:
+        """Append a received message."""
+        if item.msgtype == CDTPMessageIdentifier.DAT:
+            payload = item.payload
+            if payload is None:
+                frames = []
+            elif isinstance(payload, list):
+                frames = payload
+            else:
+                frames = [payload]
+        else:
+            frames = [msgpack.packb(item.payload)]
+        assert item.msgtype is not None  # for typing
+        header = msgpack.packb([item.name, item.msgtype.value, item.sequence_number, item.lane, item.meta])
+        lengths = [memoryview(frame).nbytes for frame in frames]
+        prefix = _RECORD_PREFIX.size + 8 * len(lengths)
+        size = prefix + len(header) + _padding(len(header)) + sum(length + _padding(length) for length in lengths)
+        parts = [
+            _RECORD_PREFIX.pack(size, len(frames), len(header)) + struct.pack(f"<{len(lengths)}Q", *lengths) + header,
+        ]
+        if _padding(len(header)):
+            parts.append(_PADDING[: _padding(len(header))])
+        for frame, length in zip(frames, lengths):
+            parts.append(frame)
+            if _padding(length):
+                parts.append(_PADDING[: _padding(length)])
+        with self._lock:
+            sender = self._senders.setdefault(item.name, len(self._senders))
+            self._index.append(
+                (self._offset, sender, item.lane, item.msgtype.value, 0, item.sequence_number, time.time_ns())
+            )
+            self._offset += size
+            self._pending.extend(parts)
+            self._pending_bytes += size
+            if self._pending_bytes >= self.write_size:
+                self._flush()
+
+    def flush(self) -> None:
+        """Write all pending records to the files."""
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        """Write all pending records, release the preallocated space and close the files."""
+        with self._lock:
+            self._flush()
+            os.ftruncate(self._fd, self._written)
+            os.close(self._fd)
+            os.close(self._index_fd)
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        if self.preallocate > 0 and self._offset > self._allocated and hasattr(os, "posix_fallocate"):
+            # allocate ahead so that the file system can keep the file contiguous
+            self._allocated = self._offset + self.preallocate
+            os.posix_fallocate(self._fd, self._written, self._allocated - self._written)
+        for start in range(0, len(self._pending), _MAX_IOVEC):
+            buffers = self._pending[start : start + _MAX_IOVEC]
+            nbytes = sum(memoryview(buffer).nbytes for buffer in buffers)
+            written = os.pwritev(self._fd, buffers, self._written)
+            if written < nbytes:
+                # short writes are rare; write the remainder buffer by buffer
+                _write_remainder(self._fd, buffers, written, self._written)
+            self._written += nbytes
+        # the index is written after the data it points to
+        os.write(self._index_fd, np.array(self._index, dtype=INDEX_DTYPE).tobytes())
+        self._pending = []
+        self._pending_bytes = 0
+        self._index = []
+
+
+def _write_remainder(fd: int, buffers: list[Any], skip: int, offset: int) -> None:
+    """Write what a short gathering write left out."""
+    position = offset
+    for buffer in buffers:
+        view = memoryview(buffer).cast("B")
+        if skip >= view.nbytes:
+            skip -= view.nbytes
+            position += view.nbytes
+            continue
+        view = view[skip:]
+        position += skip
+        skip = 0
+        while view:
+            written = os.pwrite(fd, view, position)
+            view = view[written:]
+            position += written
+
+
+class RawRecord:
+    """A record of a raw data file; frames are views into the memory-mapped file."""
+
+    def __init__(self, name: str, msgtype: int, seqno: int, lane: int, meta: dict[str, Any], frames: list[memoryview]):
+        self.name = name
+        self.msgtype = CDTPMessageIdentifier(msgtype)
+        self.sequence_number = seqno
+        self.lane = lane
+        self.meta = meta
+        self.frames = frames
+
+    @property
+    def payload(self) -> Any:
+        """Payload as passed to the writer: decoded for BOR/EOR, frames for data messages."""
+        if self.msgtype != CDTPMessageIdentifier.DAT:
+            return msgpack.unpackb(self.frames[0])
+        if not self.frames:
+            return None
+        if len(self.frames) == 1:
+            return self.frames[0]
+        return self.frames
+
+    def __repr__(self) -> str:
+        return f"RawRecord({self.name!r}, {self.msgtype.name}, {self.sequence_number}, lane={self.lane})"
+
+
+class RawFileReader:
+    """Read a raw data file and its index via memory mapping.
+
+    Records are accessed by their position in the file or by sender,
+    sequence number and data lane. Payload frames are returned as views into
+    the mapped file without copying.
+
+    """
+
+    def __init__(self, path: pathlib.Path | str):
+        self.path = pathlib.Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data = memoryview(self._mmap)
+        if bytes(self._data[: len(DATA_MAGIC)]) != DATA_MAGIC:
+            self.close()
+            raise ValueError(f"{self.path} is not a raw CDTP data file")
+        idx = index_path(self.path)
+        with open(idx, "rb") as f:
+            magic, _version = _FILE_HEADER.unpack(f.read(_FILE_HEADER.size))
+        if magic != INDEX_MAGIC:
+            self.close()
+            raise ValueError(f"{idx} is not a raw CDTP index file")
+        nentries = (idx.stat().st_size - _FILE_HEADER.size) // INDEX_DTYPE.itemsize
+        if nentries:
+            self.index: np.ndarray = np.memmap(idx, dtype=INDEX_DTYPE, mode="r", offset=_FILE_HEADER.size, shape=(nentries,))
+        else:
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        # sender names from the first record of each sender
+        _, first = np.unique(self.index["sender"], return_index=True)
+        self.senders = [self._header(int(self.index["offset"][pos]))[0] for pos in first]
+        self._sender_ids = {name: idx for idx, name in enumerate(self.senders)}
+        # positions of the data records of each sender and lane, ordered by sequence number
+        self._positions: dict[tuple[int, int], np.ndarray] = {}
+        self._schemas: dict[str, ArraySchema | None] = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, pos: int) -> RawRecord:
+        return self.record(pos)
+
+    def __iter__(self) -> Iterator[RawRecord]:
+        for pos in range(len(self)):
+            yield self.record(pos)
+
+    def __enter__(self) -> "RawFileReader":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def record(self, pos: int) -> RawRecord:
+        """Return the record at a position in the file."""
+        offset = int(self.index["offset"][pos])
+        (name, msgtype, seqno, lane, meta), frames = self._read(offset)
+        return RawRecord(name, msgtype, seqno, lane, meta, frames)
+
+    def find(self, name: str, seqno: int, lane: int = 0) -> int:
+        """Return the position of the data record of a sender with a sequence number.
+
+        Sequence numbers without gaps are looked up directly, otherwise by
+        bisection. Raises KeyError if the file holds no such record.
+
+        """
+        positions = self._lane_positions(name, lane)
+        sequence = self.index["sequence"]
+        if len(positions):
+            guess = seqno - int(sequence[positions[0]])
+            if 0 <= guess < len(positions) and sequence[positions[guess]] == seqno:
+                return int(positions[guess])
+            pos = int(np.searchsorted(sequence[positions], seqno))
+            if pos < len(positions) and sequence[positions[pos]] == seqno:
+                return int(positions[pos])
+        raise KeyError(f"No data message {seqno} of {name} on lane {lane}")
+
+    def get(self, name: str, seqno: int, lane: int = 0) -> RawRecord:
+        """Return the data record of a sender with a sequence number."""
+        return self.record(self.find(name, seqno, lane))
+
+    def payload_array(self, record: RawRecord) -> Any:
+        """Return NumPy views of the payload frames of a data record.
+
+        Views are created from the schema the sender declared in its BOR. For
+        multi-frame payloads a list of arrays is returned. Returns None if the
+        sender did not declare a typed stream.
+
+        """
+        schema = self._schema(record.name)
+        if schema is None:
+            return None
+        return schema.view(record.payload)
+
+    def close(self) -> None:
+        """Release the memory maps."""
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self._data.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # frames still referenced keep the mapping alive until released
+            pass
+
+    def _lane_positions(self, name: str, lane: int) -> np.ndarray:
+        sender = self._sender_ids[name]
+        try:
+            return self._positions[(sender, lane)]
+        except KeyError:
+            pass
+        mask = (
+            (self.index["sender"] == sender)
+            & (self.index["lane"] == lane)
+            & (self.index["msgtype"] == CDTPMessageIdentifier.DAT.value)
+        )
+        positions = np.flatnonzero(mask)
+        # records of a lane are written in the order received; sort if reordered
+        order = np.argsort(self.index["sequence"][positions], kind="stable")
+        positions = positions[order]
+        self._positions[(sender, lane)] = positions
+        return positions
+
+    def _schema(self, name: str) -> ArraySchema | None:
+        try:
+            return self._schemas[name]
+        except KeyError:
+            pass
+        schema = None
+        sender = self._sender_ids.get(name)
+        bors = np.flatnonzero((self.index["sender"] == sender) & (self.index["msgtype"] == CDTPMessageIdentifier.BOR.value))
+        if len(bors):
+            meta = self.record(int(bors[0])).meta
+            if SCHEMA_META_KEY in meta:
+                schema = ArraySchema.from_meta(meta[SCHEMA_META_KEY])
+        self._schemas[name] = schema
+        return schema
+
+    def _header(self, offset: int) -> Any:
+        return self._read(offset)[0]
+
+    def _read(self, offset: int) -> tuple[Any, list[memoryview]]:
+        _size, nframes, header_len = _RECORD_PREFIX.unpack_from(self._data, offset)
+        lengths = struct.unpack_from(f"<{nframes}Q", self._data, offset + _RECORD_PREFIX.size)
+        position = offset + _RECORD_PREFIX.size + 8 * nframes
+        header = msgpack.unpackb(self._data[position : position + header_len])
+        position += header_len + _padding(header_len)
+        frames = []
+        for length in lengths:
+            frames.append(self._data[position : position + length])
+            position += length + _padding(length)
+        return header, frames
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+SPDX-FileCopyrightText: 2024 DESY and the Constellation authors
+SPDX-License-Identifier: CC-BY-4.0
+
+Module providing worker processes which receive and write the data of a shard
+of the senders connected to a DataReceiver.
+"""
+
+import logging
+import multiprocessing
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from multiprocessing.connection import Connection
+from typing import Any, cast
+
+from .base import ConstellationLogger
+
+# interval [s] at which workers report their statistics during a run
+STATS_INTERVAL = 0.5
+# time [s] to wait for a worker to acknowledge a command
+COMMAND_TIMEOUT = 60.0
+
+
+class ReceiverShard:
+    """Handle of a worker process receiving and writing data of some senders.
+
+    The worker runs an instance of the receiver class without the Satellite
+    infrastructure. It is controlled by commands sent via a pipe, each of
+    which the worker acknowledges or reports as failed. Statistics and the
+    result of a run are reported through a separate pipe, so that they do not
+    mix with the replies to commands. Log records of the worker are forwarded
+    to the logger of the receiver.
+
+    """
+
+    def __init__(self, cls: type, name: str, index: int, log: logging.Logger):
+        self.index = index
+        self.log = log
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.events, child_events = ctx.Pipe(duplex=False)
+        self._log_queue = ctx.Queue()
+        self._listener = QueueListener(self._log_queue, _ForwardHandler(log))
+        self._listener.start()
+        # several threads of the receiver send commands
+        self._lock = threading.Lock()
+        self.process = ctx.Process(
+            target=_shard_main,
+            args=(cls, name, index, log.getEffectiveLevel(), child_conn, child_events, self._log_queue),
+            name=f"receiver_shard_{index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        child_events.close()
+
+    def request(self, command: str, *args: Any, timeout: float = COMMAND_TIMEOUT) -> None:
+        """Send a command to the worker and wait for it to be executed.
+
+        Raises a RuntimeError if the worker failed to execute the command, did
+        not respond in time or exited.
+
+        """
+        with self._lock:
+            try:
+                self.conn.send((command, args))
+                if not self.conn.poll(timeout):
+                    raise RuntimeError(f"Receiver shard {self.index} did not respond to '{command}' within {timeout}s")
+                status, *msg = self.conn.recv()
+            except (EOFError, OSError) as e:
+                raise RuntimeError(f"Receiver shard {self.index} exited") from e
+        if status == "failed":
+            raise RuntimeError(f"Receiver shard {self.index} failed to {command}: {msg[0]}")
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stop the worker process."""
+        try:
+            with self._lock:
+                self.conn.send(("exit", ()))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.log.warning("Receiver shard %s did not exit, terminating it", self.index)
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+        self.events.close()
+        self._listener.stop()
+        self._log_queue.close()
+
+
+class _ForwardHandler(logging.Handler):
+    """Handler passing log records of a worker to a logger of the main process."""
+
+    def __init__(self, log: logging.Logger):
+        super().__init__()
+        self.log = log
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.log.handle(record)
+
+
+def _shard_main(cls: type, name: str, index: int, level: int, conn: Connection, events: Connection, log_queue: Any) -> None:
+    """Entry point of the worker process."""
+    logging.setLoggerClass(ConstellationLogger)
+    log = cast(ConstellationLogger, logging.getLogger(f"{name}.shard{index}"))
+    log.setLevel(level)
+    log.addHandler(QueueHandler(log_queue))
+    log.propagate = False
+    receiver = cls._create_shard(name, index, log)  # type: ignore[attr-defined]
+    worker = _ShardWorker(receiver, conn, events)
+    try:
+        worker.serve()
+    finally:
+        receiver._close_shard()
+
+
+class _ShardWorker:
+    """Executes the commands sent to a worker process."""
+
+    def __init__(self, receiver: Any, conn: Connection, events: Connection):
+        self.receiver = receiver
+        self.conn = conn
+        self.events = events
+        # the run and the reporter thread both send events
+        self._lock = threading.Lock()
+        self._run_thread: threading.Thread | None = None
+
+    def serve(self) -> None:
+        """Execute commands until told to exit or the receiver went away."""
+        while True:
+            try:
+                command, args = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if command == "exit":
+                break
+            try:
+                getattr(self, f"_{command}")(*args)
+            except Exception as e:
+                self.receiver.log.critical("Receiver shard failed to %s: %s", command, repr(e))
+                self.conn.send(("failed", repr(e)))
+            else:
+                self.conn.send(("ok",))
+        self._stop_run()
+
+    def _report_event(self, *msg: Any) -> None:
+        with self._lock:
+            self.events.send(msg)
+
+    def _initialize(self, config: dict[str, Any]) -> None:
+        self.receiver._initialize_shard(config)
+
+    def _launch(self) -> None:
+        self.receiver.do_launching()
+
+    def _land(self) -> None:
+        self._stop_run()
+        self.receiver.do_landing()
+
+    def _add(self, key: Any, address: str, port: int) -> None:
+        self.receiver._add_shard_sender(key, address, port)
+
+    def _remove(self, key: Any) -> None:
+        self.receiver._remove_shard_sender(key)
+
+    def _start(self, run_identifier: str) -> None:
+        self.receiver._state_thread_evt = threading.Event()
+        self.receiver.do_starting(run_identifier)
+        self._run_thread = threading.Thread(target=self._run, args=(run_identifier,), daemon=True)
+        self._run_thread.start()
+
+    def _stop(self) -> None:
+        if self.receiver._state_thread_evt:
+            self.receiver._state_thread_evt.set()
+
+    def _stop_run(self) -> None:
+        """Stop a run still in progress and wait for it to finish."""
+        self._stop()
+        if self._run_thread:
+            self._run_thread.join()
+            self._run_thread = None
+
+    def _run(self, run_identifier: str) -> None:
+        """Perform a run while reporting the statistics regularly."""
+        done = threading.Event()
+        reporter = threading.Thread(target=self._report, args=(done,), daemon=True)
+        reporter.start()
+        try:
+            res = self.receiver.do_run(run_identifier)
+        except Exception as e:
+            self.receiver.log.critical("Receiver shard failed: %s", repr(e))
+            done.set()
+            reporter.join()
+            self._report_event("failed", repr(e), self.receiver._shard_stats())
+            return
+        done.set()
+        reporter.join()
+        self._report_event("finished", res, self.receiver._shard_stats())
+
+    def _report(self, done: threading.Event) -> None:
+        while not done.wait(STATS_INTERVAL):
+            self._report_event("stats", self.receiver._shard_stats())
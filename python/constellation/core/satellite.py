@@ -23,9 +23,11 @@ from .chirp import CHIRPServiceIdentifier
 from .broadcastmanager import CHIRPBroadcaster, chirp_callback, DiscoveredService
 from .commandmanager import CommandReceiver, cscp_requestable
 from .configuration import ConfigError, Configuration, make_lowercase
-from .monitoring import MonitoringSender
+from .monitoring import MonitoringSender, schedule_metric
+from .cmdp import MetricsType
 from .error import debug_log, handle_error
 from .base import EPILOG, ConstellationArgumentParser, setup_cli_logging
+from .zmqcontext import context_stats
 
 
 class Satellite(
@@ -45,6 +47,7 @@ class Satellite(
         hb_port: int,
         mon_port: int,
         interface: str,
+        io_threads: int = 1,
     ):
         """Set up class attributes."""
         super().__init__(
@@ -54,6 +57,7 @@ class Satellite(
             hb_port=hb_port,
             mon_port=mon_port,
             interface=interface,
+            io_threads=io_threads,
         )
 
         self.run_identifier: str = ""
@@ -147,6 +151,21 @@ class Satellite(
             self._wrap_failure()
         super().reentry()
 
+    @schedule_metric("", MetricsType.LAST_VALUE, 10)
+    def zmq_contexts(self) -> int:
+        """Number of ZMQ contexts of the process."""
+        return context_stats()["contexts"]
+
+    @schedule_metric("", MetricsType.LAST_VALUE, 10)
+    def zmq_io_threads(self) -> int:
+        """Number of I/O threads of the ZMQ contexts of the process."""
+        return context_stats()["io_threads"]
+
+    @schedule_metric("", MetricsType.LAST_VALUE, 10)
+    def threads(self) -> int:
+        """Number of Python threads of the process."""
+        return threading.active_count()
+
     # --------------------------- #
     # ----- satellite commands ----- #
     # --------------------------- #
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+SPDX-FileCopyrightText: 2024 DESY and the Constellation authors
+SPDX-License-Identifier: CC-BY-4.0
+
+Module providing a shared-memory ring buffer for data payloads exchanged
+between a sender and a receiver on the same host.
+"""
+
+import os
+import tempfile
+import threading
+import weakref
+from collections import deque
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any
+
+import numpy as np
+
+# bytes reserved at the start of the segment for the read position
+_HEADER_SIZE = 64
+# names of the segments created by this process
+_created: set[str] = set()
+
+
+def ipc_endpoint(port: int) -> str:
+    """Return the ipc:// endpoint accompanying the TCP data port of a sender."""
+    return f"ipc://{ipc_path(port)}"
+
+
+def ipc_path(port: int) -> str:
+    """Return the path of the ipc socket accompanying the TCP data port of a sender."""
+    return os.path.join(tempfile.gettempdir(), f"constellation_data_{port}.ipc")
+
+
+class ShmRingBuffer:
+    """Single-producer, single-consumer ring buffer in shared memory.
+
+    The producer copies payload frames into the buffer and only sends their
+    descriptors, i.e. (position, length) pairs, to the consumer. Positions
+    count bytes written since creation, the offset in the buffer is the
+    position modulo the capacity. Frames never wrap around the end of the
+    buffer. The consumer reads frames without copying them and stores the
+    position up to which all frames have been released in the segment header.
+
+    Only a single consumer may read from the buffer, as the frames released by
+    one consumer would be overwritten while another one still uses them.
+
+    """
+
+    def __init__(self, name: str | None = None, size: int = 0):
+        """Create (if no name is given) or attach to a ring buffer.
+
+        name: name of an existing shared memory segment to attach to.
+
+        size: capacity in bytes of a newly created ring buffer.
+
+        """
+        self.owner = name is None
+        if self.owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=_HEADER_SIZE + size)
+            _created.add(self._shm.name)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            if name not in _created:
+                # the creator is responsible for removing the segment; prevent
+                # the resource tracker from unlinking it when this process exits
+                resource_tracker.unregister(self._shm._name, "shared_memory")  # type: ignore[attr-defined]
+        self.name: str = self._shm.name
+        self.capacity: int = self._shm.size - _HEADER_SIZE
+        buf = self._shm.buf
+        assert buf is not None  # for typing
+        self._tail = np.ndarray((1,), dtype=np.uint64, buffer=buf)
+        self._data = buf[_HEADER_SIZE:]
+        if self.owner:
+            self._tail[0] = 0
+        self._head = 0
+        # frames handed out to the consumer in order of position, as (id, end
+        # position), and the ids of those released since
+        self._lock = threading.Lock()
+        self._reading: deque[tuple[int, int]] = deque()
+        self._released: set[int] = set()
+        self._next_id = 0
+        self._closed = False
+
+    def free(self) -> int:
+        """Return the number of bytes available for writing."""
+        return self.capacity - (self._head - int(self._tail[0]))
+
+    def write(self, frames: list[Any]) -> list[tuple[int, int]] | None:
+        """Copy frames into the buffer and return their descriptors.
+
+        Returns None without writing anything if not all frames fit or a frame
+        does not support the buffer protocol.
+
+        """
+        try:
+            views = [memoryview(frame).cast("B") for frame in frames]
+        except TypeError:
+            return None
+        # determine positions first to write all frames or none
+        head = self._head
+        positions = []
+        for view in views:
+            if view.nbytes > self.capacity:
+                return None
+            if head % self.capacity + view.nbytes > self.capacity:
+                # skip remainder to not wrap frame around the end
+                head += self.capacity - head % self.capacity
+            positions.append(head)
+            head += view.nbytes
+        if head - int(self._tail[0]) > self.capacity:
+            return None
+        descriptors = []
+        for pos, view in zip(positions, views):
+            offset = pos % self.capacity
+            self._data[offset : offset + view.nbytes] = view
+            descriptors.append((pos, view.nbytes))
+        self._head = head
+        return descriptors
+
+    def read(self, descriptors: list[tuple[int, int]]) -> list[memoryview]:
+        """Return views of the frames described by the descriptors without copying them.
+
+        A frame is released to the producer once the view and all objects
+        derived from it are gone. Frames may be released in any order, the
+        space is reused once all frames written before have been released too.
+
+        """
+        frames = []
+        for pos, length in descriptors:
+            frame = np.frombuffer(self._data, dtype=np.uint8, count=length, offset=pos % self.capacity)
+            with self._lock:
+                frame_id = self._next_id
+                self._next_id += 1
+                self._reading.append((frame_id, pos + length))
+            weakref.finalize(frame, self._release, frame_id)
+            frames.append(frame.data)
+        return frames
+
+    def _release(self, frame_id: int) -> None:
+        """Release a frame and advance the read position over all frames released in order."""
+        with self._lock:
+            if self._closed:
+                return
+            self._released.add(frame_id)
+            while self._reading and self._reading[0][0] in self._released:
+                frame_id, end = self._reading.popleft()
+                self._released.discard(frame_id)
+                self._tail[0] = end
+
+    def close(self) -> None:
+        """Detach from the segment and remove it if created by this instance.
+
+        Frames still in use keep the segment mapped until they are gone.
+
+        """
+        with self._lock:
+            self._closed = True
+        # release exported views before closing the shared memory
+        del self._tail
+        try:
+            self._data.release()
+            self._shm.close()
+        except BufferError:
+            pass
+        if self.owner:
+            self._shm.unlink()
+            _created.discard(self.name)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+SPDX-FileCopyrightText: 2024 DESY and the Constellation authors
+SPDX-License-Identifier: CC-BY-4.0
+
+Module providing the ZMQ context shared by all Constellation components of a
+process.
+"""
+
+import logging
+import threading
+
+import zmq
+
+# the shared context, the number of components using it and the number of I/O
+# threads it is created with
+_lock = threading.Lock()
+_context: zmq.Context | None = None  # type: ignore[type-arg]
+_users = 0
+_io_threads = 1
+
+
+def acquire_context(io_threads: int | None = None) -> zmq.Context:  # type: ignore[type-arg]
+    """Return the shared ZMQ context, creating it if necessary.
+
+    io_threads: number of I/O threads of the context. Only takes effect if the
+    context is created by this call.
+
+    Every call needs to be matched by a call to release_context().
+
+    """
+    global _context, _users, _io_threads
+    with _lock:
+        if _context is None or _context.closed:
+            _io_threads = io_threads or 1
+            _context = zmq.Context(io_threads=_io_threads)
+        elif io_threads and io_threads != _io_threads:
+            logging.getLogger(__name__).warning(
+                "Shared ZMQ context already running with %s I/O threads, ignoring request for %s",
+                _io_threads,
+                io_threads,
+            )
+        _users += 1
+        return _context
+
+
+def release_context() -> None:
+    """Release the shared ZMQ context, terminating it once no component uses it anymore."""
+    global _context, _users
+    with _lock:
+        if _context is None:
+            return
+        _users -= 1
+        if _users > 0:
+            return
+        context = _context
+        _context = None
+        _users = 0
+    # blocks until all sockets are closed, so do not hold the lock
+    context.term()
+
+
+def set_affinity(socket: zmq.Socket, bulk: bool = True) -> None:  # type: ignore[type-arg]
+    """Assign the connections of a socket to I/O threads of the shared context.
+
+    With more than one I/O thread, the first one is left to control traffic
+    (commands, heartbeats and monitoring) while sockets carrying bulk data are
+    served by the remaining ones. Needs to be called before binding or
+    connecting the socket.
+
+    """
+    if socket.context is not _context or _io_threads < 2:
+        return
+    mask = ((1 << _io_threads) - 2) if bulk else 1
+    socket.setsockopt(zmq.AFFINITY, mask)
+
+
+def context_stats() -> dict[str, int]:
+    """Return the number of shared contexts alive, their I/O threads and users."""
+    with _lock:
+        alive = _context is not None
+        return {
+            "contexts": int(alive),
+            "io_threads": _io_threads if alive else 0,
+            "users": _users,
+        }
@@ -8,34 +8,281 @@ Provides the class for the H5DataWriter satellite
 import datetime
 import os
 import pathlib
-from typing import Any
+import threading
+import time
+from functools import partial
+from typing import Any, Callable
 
 import h5py  # type: ignore[import-untyped]
 import numpy as np
 
 from constellation.core import __version__
-from constellation.core.cdtp import CDTPMessage
+from constellation.core.cdtp import CDTPMessage, payload_nbytes
+from constellation.core.cmdp import MetricsType
 from constellation.core.datareceiver import DataReceiver
 
+try:
+    import hdf5plugin  # type: ignore[import-not-found, unused-ignore]
+except ImportError:
+    hdf5plugin = None
+
+# compression filters selectable by name; blosc and zstd require hdf5plugin
+COMPRESSIONS = ["none", "gzip", "lzf", "blosc", "zstd"]
+
+# position of each message in the data of an extendible dataset, in rows of the data
+STREAM_INDEX_DTYPE = np.dtype([("sequence", "<u8"), ("lane", "<u2"), ("offset", "<u8"), ("length", "<u8")])
+# minimum number of rows extendible datasets grow by
+_MIN_GROWTH = 1024
+# maximum number of messages staged before writing
+_MAX_STAGED_MESSAGES = 4096
+
+
+class ExtendibleDataset:
+    """Data of a sender appended to a resizable dataset with an index of the messages.
+
+    The `data` dataset grows along its first axis. Its rows either have the
+    fixed shape declared by the sender, one row per payload frame, or are
+    single elements of concatenated payloads. The `index` dataset holds
+    sequence number, data lane, first row and number of rows of each message.
+    Datasets grow geometrically and are trimmed to their content when done.
+
+    Messages are collected in preallocated staging arrays of `staging_bytes`
+    and written to the file in one operation once full or drained. Messages
+    larger than the staging array are written directly.
+
+    """
+
+    def __init__(
+        self,
+        grp: h5py.Group,
+        dtype: Any,
+        row_shape: tuple[int, ...],
+        staging_bytes: int = 0,
+        on_drain: Callable[[float], None] | None = None,
+        options: dict[str, Any] | None = None,
+    ):
+        options = options or {"chunks": True}
+        self.data = grp.create_dataset("data", shape=(0, *row_shape), maxshape=(None, *row_shape), dtype=dtype, **options)
+        self.data.attrs["CLASS"] = "DETECTOR_DATA"
+        self.index = grp.create_dataset("index", shape=(0,), maxshape=(None,), dtype=STREAM_INDEX_DTYPE, chunks=True)
+        self.row_shape = row_shape
+        # rows and messages appended, including those staged
+        self.rows = 0
+        self.messages = 0
+        self._row_nbytes: int = max(self.data.dtype.itemsize * int(np.prod(row_shape)), 1)
+        capacity = staging_bytes // self._row_nbytes
+        self._staged_rows = np.empty((capacity, *row_shape), dtype=self.data.dtype)
+        self._staged_index = np.empty(min(capacity, _MAX_STAGED_MESSAGES) if capacity else 0, dtype=STREAM_INDEX_DTYPE)
+        self._nstaged_rows = 0
+        self._nstaged_messages = 0
+        self._on_drain = on_drain
+        # the writer threads of the sender and of a flush may drain concurrently
+        self._lock = threading.Lock()
+
+    @property
+    def staged_nbytes(self) -> int:
+        """Number of bytes of data waiting in the staging array."""
+        return self._nstaged_rows * self._row_nbytes
+
+    def append(self, seqno: int, lane: int, rows: np.ndarray) -> None:
+        """Append the rows of a message."""
+        nrows = len(rows)
+        with self._lock:
+            if not len(self._staged_index):
+                # staging disabled
+                if nrows:
+                    _reserve(self.data, self.rows + nrows)
+                    self.data[self.rows : self.rows + nrows] = rows
+                _reserve(self.index, self.messages + 1)
+                self.index[self.messages] = (seqno, lane, self.rows, nrows)
+            else:
+                if self._nstaged_rows + nrows > len(self._staged_rows) or self._nstaged_messages == len(self._staged_index):
+                    self._drain()
+                if nrows > len(self._staged_rows):
+                    # all rows before were drained; only the index entry is staged
+                    _reserve(self.data, self.rows + nrows)
+                    self.data[self.rows : self.rows + nrows] = rows
+                    self._staged_index[self._nstaged_messages] = (seqno, lane, self.rows, nrows)
+                    self._nstaged_messages += 1
+                else:
+                    self._staged_rows[self._nstaged_rows : self._nstaged_rows + nrows] = rows
+                    self._staged_index[self._nstaged_messages] = (seqno, lane, self.rows, nrows)
+                    self._nstaged_rows += nrows
+                    self._nstaged_messages += 1
+            self.rows += nrows
+            self.messages += 1
+
+    def drain(self) -> None:
+        """Write all staged messages to the file."""
+        with self._lock:
+            self._drain()
+
+    def trim(self) -> None:
+        """Write all staged messages and shrink the datasets to their content."""
+        with self._lock:
+            self._drain()
+            self.data.resize(self.rows, axis=0)
+            self.index.resize(self.messages, axis=0)
+
+    def _drain(self) -> None:
+        if not self._nstaged_messages:
+            return
+        start = time.monotonic()
+        if self._nstaged_rows:
+            first = self.rows - self._nstaged_rows
+            _reserve(self.data, self.rows)
+            self.data[first : self.rows] = self._staged_rows[: self._nstaged_rows]
+        first = self.messages - self._nstaged_messages
+        _reserve(self.index, self.messages)
+        self.index[first : self.messages] = self._staged_index[: self._nstaged_messages]
+        self._nstaged_rows = 0
+        self._nstaged_messages = 0
+        if self._on_drain:
+            self._on_drain(time.monotonic() - start)
+
+
+def _reserve(dset: h5py.Dataset, size: int) -> None:
+    """Grow a dataset along its first axis to hold at least size rows."""
+    if size > len(dset):
+        dset.resize(max(size, 2 * len(dset), _MIN_GROWTH), axis=0)
+
+
+def read_stream_message(grp: h5py.Group, seqno: int, lane: int = 0) -> np.ndarray:
+    """Return the data of a message from the extendible dataset of a sender's group."""
+    index = grp["index"][()]
+    (pos,) = np.flatnonzero((index["sequence"] == seqno) & (index["lane"] == lane))[:1]
+    offset, length = int(index["offset"][pos]), int(index["length"][pos])
+    data: np.ndarray = grp["data"][offset : offset + length]
+    return data
+
 
 class H5DataWriter(DataReceiver):
     """Satellite which receives data via ZMQ and writes to HDF5."""
 
+    def _init_receiver(self) -> None:
+        """Define the attributes used for receiving and writing data."""
+        super()._init_receiver()
+        # extendible datasets by file and satellite name
+        self._extendible: dict[tuple[int, str], ExtendibleDataset] = {}
+        # guards the datasets and statistics shared by the writer threads and
+        # the thread closing the previous file segment
+        self._writer_lock = threading.Lock()
+
     def do_initializing(self, config: dict[str, Any]) -> str:
         """Initialize and configure the satellite."""
         super().do_initializing(config)
         # how often will the file be flushed? Negative values for 'at the end of
         # the run'
         self.flush_interval = self.config.setdefault("flush_interval", 10.0)
+        # one dataset per data message or data appended to a dataset per sender?
+        self.layout = self.config.setdefault("layout", "message")
+        if self.layout not in ["message", "extendible"]:
+            raise ValueError(f"Unknown dataset layout '{self.layout}'")
+        # size of the array collecting the data of a sender before writing [B]
+        self.staging_bytes = self.config.setdefault("staging_bytes", 4 * 1024 * 1024)
+        # compression filter of the data, its level (negative for the default
+        # of the filter) and whether to shuffle bytes before compressing
+        self.compression = self.config.setdefault("compression", "none")
+        self.compression_level = self.config.setdefault("compression_level", -1)
+        self.shuffle = self.config.setdefault("shuffle", False)
+        self._filters = self._filter_options()
+        # rows along the first axis per chunk (0 for automatic chunking)
+        self.chunk_rows = self.config.setdefault("chunk_rows", 0)
+        # size [B] and number of slots of the chunk cache of the files
+        self.cache_size = self.config.setdefault("cache_size", 1024 * 1024)
+        self.cache_slots = self.config.setdefault("cache_slots", 521)
         return "Configured all values"
 
+    def _filter_options(self) -> dict[str, Any]:
+        """Return the dataset creation options of the configured compression."""
+        if self.compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{self.compression}', choose from {COMPRESSIONS}")
+        level = self.compression_level if self.compression_level >= 0 else None
+        options: dict[str, Any] = {}
+        if self.compression in ["blosc", "zstd"]:
+            if hdf5plugin is None:
+                raise ValueError(f"Compression '{self.compression}' requires the hdf5plugin package")
+            if self.compression == "blosc":
+                shuffle = hdf5plugin.Blosc.SHUFFLE if self.shuffle else hdf5plugin.Blosc.NOSHUFFLE
+                # blosc shuffles within the filter
+                return dict(hdf5plugin.Blosc(cname="lz4", clevel=5 if level is None else level, shuffle=shuffle))
+            options.update(hdf5plugin.Zstd(clevel=3 if level is None else level))
+        elif self.compression == "gzip":
+            options.update(compression="gzip", compression_opts=level)
+        elif self.compression == "lzf":
+            options.update(compression="lzf")
+        if self.shuffle:
+            options["shuffle"] = True
+        return options
+
+    def _dataset_options(self, shape: tuple[int, ...], extendible: bool = False) -> dict[str, Any]:
+        """Return the options creating a dataset of the given shape with the configured chunks and filters."""
+        if not extendible and not np.prod(shape):
+            # empty datasets cannot be filtered
+            return {"chunks": True}
+        chunks: Any = True
+        if self.chunk_rows > 0:
+            chunks = (self.chunk_rows if extendible else min(self.chunk_rows, shape[0]), *shape[1:])
+        return {"chunks": chunks, **self._filters}
+
+    def _configure_monitoring(self, interval: float) -> None:
+        """Schedule monitoring for internal parameters."""
+        super()._configure_monitoring(interval)
+        # data waiting in the staging arrays and writes of staged data
+        self.staging_stats = {"staging_writes": 0, "staging_write_time": 0.0, "max_staging_write_time": 0.0}
+        self.schedule_metric("staging_nbytes", "B", MetricsType.LAST_VALUE, interval, self._get_staging_nbytes)
+        for stat, unit in [("staging_writes", ""), ("staging_write_time", "s")]:
+            self.schedule_metric(stat, unit, MetricsType.RATE, interval, partial(self._get_staging_stat, stat=stat))
+        self.schedule_metric(
+            "max_staging_write_time", "s", MetricsType.LAST_VALUE, interval, self._get_max_staging_write_time
+        )
+        # data written and storage used in the last run
+        self.run_report = {"data_bytes": 0, "file_bytes": 0, "write_time": 0.0, "compression_ratio": 0.0, "write_rate": 0.0}
+        self.schedule_metric(
+            "compression_ratio",
+            "",
+            MetricsType.LAST_VALUE,
+            interval,
+            partial(self._get_run_report, stat="compression_ratio"),
+        )
+        self.schedule_metric(
+            "write_rate", "MB/s", MetricsType.LAST_VALUE, interval, partial(self._get_run_report, stat="write_rate")
+        )
+
     def do_run(self, run_identifier: str) -> str:
         """Handle the data enqueued by the ZMQ Poller."""
         self.last_flush = datetime.datetime.now()
-        return super().do_run(run_identifier)
+        with self._writer_lock:
+            self._extendible = {}
+            self.run_report.update(data_bytes=0, file_bytes=0, write_time=0.0)
+        res = super().do_run(run_identifier)
+        self._report_run()
+        return res
+
+    def _report_run(self) -> None:
+        """Compute and log compression ratio and write rate of the run."""
+        report = self.run_report
+        if not report["file_bytes"]:
+            # the files were written by worker processes
+            return
+        with self._writer_lock:
+            report["compression_ratio"] = report["data_bytes"] / report["file_bytes"]
+            report["write_rate"] = report["data_bytes"] / 1e6 / report["write_time"] if report["write_time"] else 0.0
+        self.log.info(
+            "Wrote %.1f MB of data to %.1f MB of files (compression ratio %.2f) at %.1f MB/s",
+            report["data_bytes"] / 1e6,
+            report["file_bytes"] / 1e6,
+            report["compression_ratio"],
+            report["write_rate"],
+        )
 
     def _write_EOR(self, outfile: h5py.File, item: CDTPMessage) -> None:
         """Write data to file"""
+        with self._writer_lock:
+            dataset = self._extendible.get((id(outfile), item.name))
+        if dataset:
+            # no more data expected from the sender
+            dataset.drain()
         grp = outfile[item.name].create_group("EOR")
         # add meta information as attributes
         grp.update(item.payload)
@@ -71,23 +318,36 @@ class H5DataWriter(DataReceiver):
             grp = outfile[item.name]
         except KeyError:
             # late joiners
-            self.log.warning("%s sent data without BOR.", item.name)
-            self.active_satellites.append(item.name)
             grp = outfile.create_group(item.name)
 
-        if item.name not in self.active_satellites:
-            self.log.warning(
-                "%s sent data but is no longer assumed active (EOR received)",
-                item.name,
-            )
+        start = time.monotonic()
+        if self.layout == "extendible":
+            self._append_data(outfile, grp, item)
+            self._account_write(item, start)
+            self._flush_if_due(outfile)
+            return
 
-        title = f"data_{self.run_identifier}_{item.sequence_number:09}"
+        # sequence numbers are counted per data lane of the sender
+        if item.lane:
+            title = f"data_{self.run_identifier}_lane{item.lane}_{item.sequence_number:09}"
+        else:
+            title = f"data_{self.run_identifier}_{item.sequence_number:09}"
 
-        if isinstance(item.payload, bytes):
+        array = self.payload_array(item)
+        if array is not None:
+            # typed stream declared in the BOR
+            if not isinstance(array, list):
+                payload = array
+            elif self.stream_schemas[item.name].fixed:
+                payload = np.stack(array)
+            else:
+                payload = np.concatenate(array)
+        elif isinstance(item.payload, (bytes, memoryview)):
             # interpret bytes as array of uint8 if nothing else was specified in the meta
             payload = np.frombuffer(item.payload, dtype=item.meta.get("dtype", np.uint8))
         elif isinstance(item.payload, list):
-            payload = np.array(item.payload)
+            # frames are received as memoryviews
+            payload = np.array([bytes(frame) if isinstance(frame, memoryview) else frame for frame in item.payload])
         elif item.payload is None:
             # empty payload -> empty array of bytes
             payload = np.array([], dtype=np.uint8)
@@ -97,17 +357,76 @@ class H5DataWriter(DataReceiver):
         dset = grp.create_dataset(
             title,
             data=payload,
-            chunks=True,
+            **self._dataset_options(payload.shape),
         )
 
         dset.attrs["CLASS"] = "DETECTOR_DATA"
+        dset.attrs["lane"] = item.lane
         dset.attrs.update(item.meta)
+        self._account_write(item, start)
+        self._flush_if_due(outfile)
+
+    def _account_write(self, item: CDTPMessage, start: float) -> None:
+        """Account for the payload of a data message written since start."""
+        nbytes = payload_nbytes(item.payload)
+        duration = time.monotonic() - start
+        with self._writer_lock:
+            self.run_report["data_bytes"] += nbytes
+            self.run_report["write_time"] += duration
 
-        # time to flush data to file?
+    def _flush_if_due(self, outfile: h5py.File) -> None:
+        """Write staged data and flush the file if the flush interval passed."""
         if self.flush_interval > 0 and (datetime.datetime.now() - self.last_flush).total_seconds() > self.flush_interval:
+            for dataset in self._file_datasets(outfile):
+                dataset.drain()
             outfile.flush()
             self.last_flush = datetime.datetime.now()
 
+    def _append_data(self, outfile: h5py.File, grp: h5py.Group, item: CDTPMessage) -> None:
+        """Append the payload of a data message to the extendible dataset of the sender.
+
+        Senders which declared a fixed shape in their BOR get a row per payload
+        frame, the payloads of all others are concatenated along the first axis.
+
+        """
+        schema = self.stream_schemas.get(item.name)
+        key = (id(outfile), item.name)
+        with self._writer_lock:
+            dataset = self._extendible.get(key)
+        if dataset is None:
+            row_shape: tuple[int, ...]
+            if schema is None:
+                dtype, row_shape = np.dtype(item.meta.get("dtype", np.uint8)), ()
+            elif schema.fixed:
+                dtype, row_shape = schema.dtype, schema.shape
+            elif schema.shape[0] < 0:
+                dtype, row_shape = schema.dtype, schema.shape[1:]
+            else:
+                dtype, row_shape = schema.dtype, ()
+            # only the writer thread of the satellite creates its dataset
+            dataset = ExtendibleDataset(
+                grp,
+                dtype,
+                row_shape,
+                self.staging_bytes,
+                self._account_staging_write,
+                self._dataset_options((0, *row_shape), extendible=True),
+            )
+            with self._writer_lock:
+                self._extendible[key] = dataset
+        frames = item.payload if isinstance(item.payload, list) else [item.payload]
+        if schema is None:
+            arrays = [np.frombuffer(frame, dtype=item.meta.get("dtype", dataset.data.dtype)) for frame in frames if frame]
+        else:
+            arrays = [schema.view(frame).reshape(-1, *dataset.row_shape) for frame in frames]
+        if not arrays:
+            rows = np.empty((0, *dataset.row_shape), dtype=dataset.data.dtype)
+        elif len(arrays) == 1:
+            rows = arrays[0]
+        else:
+            rows = np.concatenate(arrays)
+        dataset.append(item.sequence_number, item.lane, rows)
+
     def _open_file(self, filename: pathlib.Path) -> h5py.File:
         """Open the hdf5 file and return the file object."""
         h5file = None
@@ -124,12 +443,10 @@ class H5DataWriter(DataReceiver):
             self.log.info("Directory %s already exists", directory)
             pass
         except Exception as exception:
-            raise RuntimeError(
-                f"unable to create directory {directory}: \
-                {type(exception)} {str(exception)}"
-            ) from exception
+            raise RuntimeError(f"unable to create directory {directory}: \
+                {type(exception)} {str(exception)}") from exception
         try:
-            h5file = h5py.File(directory / filename, "w")
+            h5file = h5py.File(directory / filename, "w", rdcc_nbytes=self.cache_size, rdcc_nslots=self.cache_slots)
         except Exception as exception:
             self.log.critical("Unable to open %s: %s", filename, str(exception))
             raise RuntimeError(
@@ -138,9 +455,55 @@ class H5DataWriter(DataReceiver):
         self._add_metadata(h5file)
         return h5file
 
+    def _account_staging_write(self, duration: float) -> None:
+        """Account for a write of staged data."""
+        with self._writer_lock:
+            self.staging_stats["staging_writes"] += 1
+            self.staging_stats["staging_write_time"] += duration
+            self.staging_stats["max_staging_write_time"] = max(self.staging_stats["max_staging_write_time"], duration)
+
+    def _get_staging_nbytes(self) -> int:
+        """Get the number of bytes waiting in the staging arrays."""
+        with self._writer_lock:
+            datasets = list(self._extendible.values())
+        return sum(dataset.staged_nbytes for dataset in datasets)
+
+    def _get_staging_stat(self, stat: str) -> Any:
+        """Get a statistic of the writes of staged data."""
+        return self.staging_stats[stat]
+
+    def _get_max_staging_write_time(self) -> float:
+        """Get the longest time a write of staged data took since the last call."""
+        with self._writer_lock:
+            res: float = self.staging_stats["max_staging_write_time"]
+            self.staging_stats["max_staging_write_time"] = 0.0
+        return res
+
+    def _get_run_report(self, stat: str) -> Any:
+        """Get a value of the report of the last run."""
+        with self._writer_lock:
+            return self.run_report[stat]
+
+    def _file_datasets(self, outfile: h5py.File, remove: bool = False) -> list[ExtendibleDataset]:
+        """Return the extendible datasets of a file, optionally forgetting them."""
+        with self._writer_lock:
+            keys = [key for key in self._extendible if key[0] == id(outfile)]
+            if remove:
+                return [self._extendible.pop(key) for key in keys]
+            return [self._extendible[key] for key in keys]
+
     def _close_file(self, outfile: h5py.File) -> None:
         """Close the filehandler"""
+        start = time.monotonic()
+        filename = outfile.filename
+        # may run in the background while the writers fill the next segment
+        for dataset in self._file_datasets(outfile, remove=True):
+            dataset.trim()
         outfile.close()
+        file_bytes = os.path.getsize(filename)
+        with self._writer_lock:
+            self.run_report["write_time"] += time.monotonic() - start
+            self.run_report["file_bytes"] += file_bytes
 
     def _add_metadata(self, outfile: h5py.File) -> None:
         """Add metadata such as version information to file."""
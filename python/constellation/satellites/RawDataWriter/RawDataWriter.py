@@ -0,0 +1,75 @@
+"""
+SPDX-FileCopyrightText: 2024 DESY and the Constellation authors
+SPDX-License-Identifier: CC-BY-4.0
+
+Provides the class for the RawDataWriter satellite
+"""
+
+import os
+import pathlib
+import time
+from typing import Any
+
+from constellation.core.cdtp import CDTPMessage
+from constellation.core.datareceiver import DataReceiver
+from constellation.core.rawfile import RawFileWriter
+
+
+class RawDataWriter(DataReceiver):
+    """Satellite which receives data via ZMQ and appends the raw CDTP records to a file."""
+
+    def do_initializing(self, config: dict[str, Any]) -> str:
+        """Initialize and configure the satellite."""
+        self.config.setdefault("_file_name_pattern", "run_{run_identifier}_{date}.cdtp")
+        super().do_initializing(config)
+        # how often will the file be flushed? Negative values for 'at the end of
+        # the run'
+        self.flush_interval = self.config.setdefault("flush_interval", 10.0)
+        # amount of data collected for a single write [B]
+        self.write_size = self.config.setdefault("write_size", 4 * 1024 * 1024)
+        # amount of disk space allocated ahead of the data written [B]
+        self.preallocate = self.config.setdefault("preallocate", 1024**3)
+        return "Configured all values"
+
+    def do_run(self, run_identifier: str) -> str:
+        """Handle the data enqueued by the ZMQ Poller."""
+        self.last_flush = time.monotonic()
+        return super().do_run(run_identifier)
+
+    def _write_BOR(self, outfile: RawFileWriter, item: CDTPMessage) -> None:
+        """Write BOR to file"""
+        outfile.append(item)
+        self.log.info("Wrote BOR packet from %s on run %s", item.name, self.run_identifier)
+
+    def _write_EOR(self, outfile: RawFileWriter, item: CDTPMessage) -> None:
+        """Write EOR to file"""
+        outfile.append(item)
+        self.log.info("Wrote EOR packet from %s on run %s", item.name, self.run_identifier)
+
+    def _write_data(self, outfile: RawFileWriter, item: CDTPMessage) -> None:
+        """Append data message to file"""
+        outfile.append(item)
+        # time to flush data to file?
+        if self.flush_interval > 0 and time.monotonic() - self.last_flush > self.flush_interval:
+            outfile.flush()
+            self.last_flush = time.monotonic()
+
+    def _open_file(self, filename: pathlib.Path) -> RawFileWriter:
+        """Create the data file and its index and return the writer."""
+        directory = pathlib.Path(self.output_path)
+        os.makedirs(directory, exist_ok=True)
+        path = directory / filename
+        self.log.info("Creating file %s", path)
+        try:
+            return RawFileWriter(path, self.write_size, self.preallocate)
+        except FileExistsError as exception:
+            self.log.critical("file already exists: %s", path)
+            raise RuntimeError(f"file already exists: {path}") from exception
+        except OSError as exception:
+            self.log.critical("Unable to open %s: %s", path, str(exception))
+            raise RuntimeError(f"Unable to open {path}: {str(exception)}") from exception
+
+    def _close_file(self, outfile: RawFileWriter) -> None:
+        """Write the remaining records and close the file"""
+        outfile.close()
+        self.log.info("Closed file %s with %s bytes", outfile.path, outfile.nbytes)
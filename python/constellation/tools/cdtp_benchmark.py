@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+SPDX-FileCopyrightText: 2024 DESY and the Constellation authors
+SPDX-License-Identifier: CC-BY-4.0
+
+This module provides a tool to benchmark the throughput of the Python data
+path, i.e. the transmission of data via CDTP from DataSender satellites to a
+DataReceiver satellite on localhost.
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from tempfile import TemporaryDirectory
+from typing import Any
+
+import numpy as np
+import psutil
+import zmq
+
+from constellation.core import __version__
+from constellation.core.base import EPILOG
+from constellation.core.cdtp import CDTPMessage, payload_nbytes
+from constellation.core.broadcastmanager import DiscoveredService
+from constellation.core.chirp import CHIRPServiceIdentifier, get_uuid
+from constellation.core.cscp import CommandTransmitter
+from constellation.core.datareceiver import DataReceiver
+from constellation.core.datasender import DataSender
+from constellation.core.histogram import LATENCY_BUCKETS, Histogram
+
+# header meta key holding the time [ns] a payload was queued
+TIME_META_KEY = "t"
+
+
+class BenchmarkSender(DataSender):
+    """DataSender queueing a fixed number of random payloads as fast as possible."""
+
+    def do_initializing(self, config: dict[str, Any]) -> str:
+        super().do_initializing(config)
+        self.payload_size = self.config.setdefault("payload_size", 1024)
+        self.frames = self.config.setdefault("frames", 1)
+        self.messages = self.config.setdefault("messages", 1000)
+        return "Configured BenchmarkSender"
+
+    def do_run(self, run_identifier: str) -> str:
+        # the buffer is never modified, so it can be sent repeatedly
+        frame = np.random.bytes(self.payload_size)
+        assert isinstance(self._state_thread_evt, threading.Event)
+        for _ in range(self.messages):
+            if self._state_thread_evt.is_set():
+                break
+            self.queue_data([frame] * self.frames, {TIME_META_KEY: time.time_ns()})
+        return "Queued all payloads"
+
+
+class ReceptionStats:
+    """Mixin for DataReceivers recording the data messages written."""
+
+    def _reset_reception(self) -> None:
+        self.received_messages = 0
+        self.received_bytes = 0
+        self.last_received = 0.0
+        self.latency = Histogram(LATENCY_BUCKETS)
+
+    def _write_data(self, outfile: Any, item: CDTPMessage) -> None:
+        super()._write_data(outfile, item)  # type: ignore[misc]
+        now = time.time_ns()
+        self.received_messages += 1
+        self.received_bytes += payload_nbytes(item.payload)
+        self.last_received = time.monotonic()
+        if TIME_META_KEY in item.meta:
+            self.latency.fill((now - item.meta[TIME_META_KEY]) / 1e9)
+
+
+class NullReceiver(DataReceiver):
+    """DataReceiver discarding all data."""
+
+    def _open_file(self, filename: Any) -> None:
+        return None
+
+    def _close_file(self, outfile: Any) -> None:
+        pass
+
+    def _write_BOR(self, outfile: Any, item: CDTPMessage) -> None:
+        pass
+
+    def _write_EOR(self, outfile: Any, item: CDTPMessage) -> None:
+        pass
+
+    def _write_data(self, outfile: Any, item: CDTPMessage) -> None:
+        pass
+
+
+class NullBenchmarkReceiver(ReceptionStats, NullReceiver):
+    """Receiver of the 'null' writer benchmarks."""
+
+
+def _receiver_class(writer: str) -> type:
+    """Return the receiver class for a writer."""
+    if writer == "null":
+        return NullBenchmarkReceiver
+    if writer == "raw":
+        from constellation.satellites.RawDataWriter.RawDataWriter import RawDataWriter
+
+        class RawBenchmarkReceiver(ReceptionStats, RawDataWriter):
+            """Receiver of the 'raw' writer benchmarks."""
+
+        return RawBenchmarkReceiver
+    # requires the hdf5 component
+    from constellation.satellites.H5DataWriter.H5DataWriter import H5DataWriter
+
+    class H5BenchmarkReceiver(ReceptionStats, H5DataWriter):
+        """Receiver of the 'h5' writer benchmarks."""
+
+    return H5BenchmarkReceiver
+
+
+def _commander(ctx: zmq.Context, port: int) -> CommandTransmitter:  # type: ignore[type-arg]
+    """Return a CommandTransmitter connected to a satellite on localhost."""
+    socket = ctx.socket(zmq.REQ)
+    socket.connect(f"tcp://127.0.0.1:{port}")
+    return CommandTransmitter("cdtp_benchmark", socket)
+
+
+def _wait_for_state(commanders: list[CommandTransmitter], state: str, timeout: float) -> None:
+    """Wait until all satellites reached a state."""
+    deadline = time.monotonic() + timeout
+    for cmd in commanders:
+        while cmd.request_get_response("get_state").msg.upper() != state:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Satellite did not reach {state} within {timeout}s")
+            time.sleep(0.02)
+
+
+def _transition(commanders: list[CommandTransmitter], command: str, state: str, payload: Any = None) -> None:
+    """Send a transition command to all satellites and wait for the target state."""
+    for cmd in commanders:
+        cmd.request_get_response(command, payload)
+    _wait_for_state(commanders, state, 60)
+
+
+def _start_senders(count: int, group: str, subprocesses: bool) -> tuple[list[Any], list[dict[str, Any]]]:
+    """Start sender satellites and return their handles and addresses."""
+    handles: list[Any] = []
+    infos = []
+    for idx in range(count):
+        name = f"bench_sender_{idx}"
+        if subprocesses:
+            proc = subprocess.Popen(
+                [sys.executable, "-m", "constellation.tools.cdtp_benchmark", "--serve-sender", name, "--group", group],
+                stdout=subprocess.PIPE,
+                text=True,
+            )
+            assert proc.stdout  # for typing
+            infos.append(json.loads(proc.stdout.readline()))
+            handles.append(proc)
+        else:
+            sender = BenchmarkSender(
+                name=name,
+                group=group,
+                cmd_port=0,
+                hb_port=0,
+                mon_port=0,
+                data_port=0,
+                interface="127.0.0.1",
+            )
+            threading.Thread(target=sender.run_satellite, daemon=True).start()
+            infos.append({"name": sender.name, "cmd_port": sender.cmd_port, "data_port": sender.data_port})
+            handles.append(sender)
+    return handles, infos
+
+
+def _cpu_time(handles: list[Any]) -> float:
+    """Return the CPU time [s] used by this process and sender subprocesses."""
+    cpu = time.process_time()
+    for handle in handles:
+        if isinstance(handle, subprocess.Popen):
+            times = psutil.Process(handle.pid).cpu_times()
+            cpu += times.user + times.system
+    return cpu
+
+
+def run_point(
+    writer: str,
+    senders: int,
+    payload_size: int,
+    frames: int,
+    messages: int,
+    subprocesses: bool = False,
+    sender_config: dict[str, Any] | None = None,
+    timeout: float = 300.0,
+    receiver_config: dict[str, Any] | None = None,
+) -> dict[str, Any]:
+    """Run a single benchmark point and return its results."""
+    group = f"cdtp_benchmark_{os.getpid()}"
+    ctx = zmq.Context()
+    receiver = _receiver_class(writer)(
+        name="bench_receiver",
+        group=group,
+        cmd_port=0,
+        hb_port=0,
+        mon_port=0,
+        interface="127.0.0.1",
+    )
+    threading.Thread(target=receiver.run_satellite, daemon=True).start()
+    handles, infos = _start_senders(senders, group, subprocesses)
+    rx_cmd = _commander(ctx, receiver.cmd_port)
+    tx_cmds = [_commander(ctx, info["cmd_port"]) for info in infos]
+    try:
+        with TemporaryDirectory(prefix="constellation_benchmark_") as tmpdir:
+            _transition([rx_cmd], "initialize", "INIT", {"_output_path": tmpdir, **(receiver_config or {})})
+            config = {"payload_size": payload_size, "frames": frames, "messages": messages, **(sender_config or {})}
+            _transition(tx_cmds, "initialize", "INIT", config)
+            for info in infos:
+                # connect directly rather than waiting for CHIRP discovery
+                service = DiscoveredService(
+                    get_uuid(info["name"]), CHIRPServiceIdentifier.DATA, "127.0.0.1", info["data_port"]
+                )
+                receiver._add_sender(service)
+            _transition([rx_cmd] + tx_cmds, "launch", "ORBIT")
+            _transition([rx_cmd], "start", "RUN", "1")
+            receiver._reset_reception()
+            expected = senders * messages
+            cpu_start = _cpu_time(handles)
+            start = time.monotonic()
+            _transition(tx_cmds, "start", "RUN", "1")
+            while receiver.received_messages < expected and time.monotonic() - start < timeout:
+                time.sleep(0.005)
+            cpu = _cpu_time(handles) - cpu_start
+            duration = max((receiver.last_received or time.monotonic()) - start, 1e-9)
+            _transition(tx_cmds, "stop", "ORBIT")
+            _transition([rx_cmd], "stop", "ORBIT")
+            _transition([rx_cmd] + tx_cmds, "land", "INIT")
+    finally:
+        for handle, cmd in zip(handles, tx_cmds):
+            if isinstance(handle, subprocess.Popen):
+                try:
+                    cmd.request_get_response("shutdown")
+                    handle.wait(timeout=10)
+                except (RuntimeError, subprocess.TimeoutExpired):
+                    handle.kill()
+            else:
+                handle.reentry()
+        receiver.reentry()
+        ctx.destroy()
+
+    mbytes = receiver.received_bytes / 1e6
+    res = {
+        "writer": writer,
+        "mode": "subprocess" if subprocesses else "inprocess",
+        "senders": senders,
+        "payload_size": payload_size,
+        "frames": frames,
+        "messages": expected,
+        "received_messages": receiver.received_messages,
+        "received_bytes": receiver.received_bytes,
+        "duration_s": duration,
+        "msgs_per_s": receiver.received_messages / duration,
+        "mb_per_s": mbytes / duration,
+        "cpu_s": cpu,
+        "cpu_s_per_mb": cpu / mbytes if mbytes else None,
+    }
+    # latencies in ms
+    res.update(receiver.latency.summary("latency_ms", scale=1e3))
+    return res
+
+
+def run_sweep(args: argparse.Namespace) -> dict[str, Any]:
+    """Run the benchmark points of all parameter combinations."""
+    results = []
+    for writer, senders, size, frames in itertools.product(args.writers, args.senders, args.sizes, args.frames):
+        # limit the volume sent per point
+        messages = max(args.min_messages, min(args.max_messages, int(args.volume * 1e6 / (size * frames))))
+        print(f"Running {writer} writer, {senders} sender(s), {frames} x {size} B", file=sys.stderr)
+        try:
+            res = run_point(
+                writer,
+                senders,
+                size,
+                frames,
+                messages,
+                args.subprocess,
+                args.sender_config,
+                args.timeout,
+                args.receiver_config,
+            )
+        except RuntimeError as e:
+            # keep going with the remaining points
+            res = {"writer": writer, "senders": senders, "payload_size": size, "frames": frames, "error": str(e)}
+        results.append(res)
+    return {
+        "constellation_version": __version__,
+        "python_version": platform.python_version(),
+        "host": platform.node(),
+        "date_utc": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "results": results,
+    }
+
+
+def _serve_sender(name: str, group: str) -> None:
+    """Run a BenchmarkSender and report its ports on stdout."""
+    sender = BenchmarkSender(name=name, group=group, cmd_port=0, hb_port=0, mon_port=0, data_port=0, interface="127.0.0.1")
+    print(json.dumps({"name": sender.name, "cmd_port": sender.cmd_port, "data_port": sender.data_port}), flush=True)
+    sender.run_satellite()
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",")]
+
+
+def _config_item(value: str) -> tuple[str, Any]:
+    key, _, val = value.partition("=")
+    try:
+        return key, json.loads(val)
+    except json.JSONDecodeError:
+        return key, val
+
+
+def main(args: Any = None) -> None:
+    """Benchmark the CDTP data path from DataSender to DataReceiver satellites on localhost."""
+    parser = argparse.ArgumentParser(description=main.__doc__, epilog=EPILOG)
+    parser.add_argument("--sizes", type=_int_list, default=[1024, 65536, 1048576], help="Frame sizes [B].")
+    parser.add_argument("--frames", type=_int_list, default=[1, 8], help="Frames per message.")
+    parser.add_argument("--senders", type=_int_list, default=[1, 2], help="Number of concurrent senders.")
+    parser.add_argument(
+        "--writers", type=lambda v: v.split(","), default=["null", "h5"], help="Receivers to use: 'null', 'raw' and/or 'h5'."
+    )
+    parser.add_argument("--subprocess", action="store_true", help="Run senders as subprocesses.")
+    parser.add_argument("--volume", type=float, default=64, help="Data volume [MB] sent per sender and point.")
+    parser.add_argument("--min-messages", type=int, default=100, help="Minimum number of messages per sender.")
+    parser.add_argument("--max-messages", type=int, default=20000, help="Maximum number of messages per sender.")
+    parser.add_argument("--timeout", type=float, default=300, help="Maximum duration [s] of a point.")
+    parser.add_argument(
+        "--sender-config",
+        type=_config_item,
+        action="append",
+        default=[],
+        help="Additional DataSender configuration as key=value, e.g. _batch_size=8.",
+    )
+    parser.add_argument(
+        "--receiver-config",
+        type=_config_item,
+        action="append",
+        default=[],
+        help="Additional DataReceiver configuration as key=value, e.g. _credit_messages=100.",
+    )
+    parser.add_argument("-o", "--output", help="File to write the JSON results to (default: stdout).")
+    parser.add_argument("--serve-sender", help=argparse.SUPPRESS)
+    parser.add_argument("--group", help=argparse.SUPPRESS)
+    args = parser.parse_args(args)
+
+    if args.serve_sender:
+        _serve_sender(args.serve_sender, args.group)
+        return
+
+    args.sender_config = dict(args.sender_config)
+    args.receiver_config = dict(args.receiver_config)
+    report = json.dumps(run_sweep(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+SPDX-FileCopyrightText: 2024 DESY and the Constellation authors
+SPDX-License-Identifier: CC-BY-4.0
+
+This module provides a microbenchmark of the encoding of CDTP message headers,
+comparing the cached header prefix of the DataTransmitter to encoding every
+header from scratch.
+"""
+
+import argparse
+import datetime
+import io
+import json
+import platform
+import sys
+import time
+from typing import Any, Callable
+
+import msgpack  # type: ignore[import-untyped]
+
+from constellation.core import __version__
+from constellation.core.base import EPILOG
+from constellation.core.cdtp import CDTPMessageIdentifier, DataTransmitter
+from constellation.core.protocol import MessageHeader, Protocol
+
+# meta of the headers encoded per case
+CASES: dict[str, dict[str, Any] | None] = {
+    "without_meta": None,
+    "with_meta": {"dtype": "int16", "t": 1729152000000000000},
+}
+
+
+def encode_from_scratch(header: MessageHeader, meta: dict[str, Any] | None, msgtype: int, seqno: int) -> bytes:
+    """Encode a CDTP header as done before the header prefix was cached.
+
+    Packs every field into a stream with a new Packer per header. Serves as
+    the reference the cached encoding is compared to.
+
+    """
+    stream = io.BytesIO()
+    packer = msgpack.Packer()
+    stream.write(packer.pack(header.protocol.value))
+    stream.write(packer.pack(header.name))
+    stream.write(packer.pack(msgtype))
+    stream.write(packer.pack(seqno))
+    stream.write(packer.pack(meta or {}))
+    return stream.getvalue()
+
+
+def _encoders(tx: DataTransmitter) -> dict[str, Callable[[dict[str, Any] | None, int], bytes]]:
+    """Return the header encodings benchmarked, by name."""
+    msgtype = CDTPMessageIdentifier.DAT
+
+    def cached(meta: dict[str, Any] | None, seqno: int) -> bytes:
+        tx.sequence_number = seqno
+        return tx._encode_header(msgtype, meta)
+
+    return {
+        "from_scratch": lambda meta, seqno: encode_from_scratch(tx.msgheader, meta, msgtype.value, seqno),
+        "message_header": lambda meta, seqno: tx.msgheader.encode(meta, msgtype=msgtype.value, seqno=seqno),
+        "cached": cached,
+    }
+
+
+def run_header_benchmark(count: int = 200000, repeat: int = 5) -> dict[str, Any]:
+    """Encode count DAT headers per encoding and case; report the best rate of several repetitions."""
+    tx = DataTransmitter("bench_sender", None)
+    encoders = _encoders(tx)
+    results = []
+    for case, meta in CASES.items():
+        # all encodings need to produce the same header
+        reference = encoders["from_scratch"](meta, count)
+        for name, encode in encoders.items():
+            if bytes(encode(meta, count)) != reference:
+                raise RuntimeError(f"Encoding '{name}' differs from the reference for case '{case}'")
+        rates = {}
+        for name, encode in encoders.items():
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for seqno in range(count):
+                    encode(meta, seqno)
+                best = min(best, time.perf_counter() - start)
+            rates[name] = count / best
+        for name, rate in rates.items():
+            results.append(
+                {
+                    "case": case,
+                    "encoding": name,
+                    "headers_per_s": rate,
+                    "speedup": rate / rates["from_scratch"],
+                }
+            )
+    return {
+        "constellation_version": __version__,
+        "python_version": platform.python_version(),
+        "msgpack_version": ".".join(str(v) for v in msgpack.version),
+        "host": platform.node(),
+        "date_utc": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "protocol": Protocol.CDTP.value,
+        "count": count,
+        "results": results,
+    }
+
+
+def main(args: Any = None) -> None:
+    """Benchmark the encoding of CDTP message headers."""
+    parser = argparse.ArgumentParser(description=main.__doc__, epilog=EPILOG)
+    parser.add_argument("--count", type=int, default=200000, help="Headers encoded per measurement.")
+    parser.add_argument("--repeat", type=int, default=5, help="Measurements per encoding, the fastest is reported.")
+    parser.add_argument(
+        "--min-speedup",
+        type=float,
+        default=0.0,
+        help="Fail if the cached encoding is not at least this much faster than encoding from scratch.",
+    )
+    parser.add_argument("-o", "--output", help="File to write the JSON results to (default: stdout).")
+    args = parser.parse_args(args)
+
+    report = run_header_benchmark(args.count, args.repeat)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    slow = [r for r in report["results"] if r["encoding"] == "cached" and r["speedup"] < args.min_speedup]
+    if slow:
+        cases = ", ".join(f"{r['case']} ({r['speedup']:.2f}x)" for r in slow)
+        print(f"Cached header encoding below the minimum speedup of {args.min_speedup}x: {cases}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -131,7 +131,7 @@ class mocket(MagicMock):
         else:
             return mock_packet_queue_recv
 
-    def send(self, payload, flags=None):
+    def send(self, payload, flags=None, copy=True, track=False):
         """Append buf to queue."""
         try:
             if isinstance(flags, zmq.Flag) and zmq.SNDMORE in flags:
@@ -191,7 +191,11 @@ class mocket(MagicMock):
             return r
 
     def bind(self, host):
-        self.port = int(host.split(":")[2])
+        if host.startswith("ipc://"):
+            # ipc endpoints are keyed by path
+            self.port = host
+        else:
+            self.port = int(host.split(":")[2])
         print(f"Bound Mocket on {self.port}")
 
     def bind_to_random_port(self, host):
@@ -203,6 +207,12 @@ class mocket(MagicMock):
         self.port = int(host.split(":")[2])
         print(f"Bound Mocket on {self.port}")
 
+    def poll(self, timeout=None, flags=zmq.POLLIN):
+        """Readable if data is queued; never writable as no peers connect to a Mocket."""
+        if flags & zmq.POLLIN and not self.has_no_data():
+            return zmq.POLLIN
+        return 0
+
     def has_no_data(self):
         return self.port not in self._get_queue(False) or not self._get_queue(False)[self.port]
 
@@ -4,25 +4,48 @@ SPDX-FileCopyrightText: 2024 DESY and the Constellation authors
 SPDX-License-Identifier: CC-BY-4.0
 """
 
+import asyncio
 import os
 import pathlib
 import threading
 import time
+from queue import Full, Queue
 from tempfile import TemporaryDirectory
 from unittest.mock import MagicMock, patch
 
 import h5py
+import msgpack
 import zmq
 import numpy as np
 import pytest
 from conftest import mocket, wait_for_state
+from constellation.core.arrayschema import ArraySchema
 from constellation.core.broadcastmanager import DiscoveredService
-from constellation.core.cdtp import CDTPMessageIdentifier, DataTransmitter
+from constellation.core.cdtp import (
+    CREDIT_META_KEY,
+    SCHEMA_META_KEY,
+    SHM_META_KEY,
+    SOCKET_META_KEY,
+    CDTPMessage,
+    CDTPMessageIdentifier,
+    DataTransmitter,
+    encode_credit,
+    payload_nbytes,
+)
 from constellation.core.chirp import CHIRPServiceIdentifier, get_uuid
 from constellation.core.cscp import CommandTransmitter
-from constellation.core.datasender import DataSender
+from constellation.core.compression import CODECS, Compressor
+from constellation.core.dataqueue import DataQueue, QueuePolicy
+from constellation.core.datareceiver import SequenceTracker
+from constellation.core.datasender import AsyncDataSender, DataSender, PeerMonitor, PushThread, RandomDataSender
+from constellation.core.histogram import LATENCY_BUCKETS, Histogram
+from constellation.core.rawfile import RawFileReader, RawFileWriter
+from constellation.core.shmring import ShmRingBuffer
 from constellation.core import __version__
-from constellation.satellites.H5DataWriter.H5DataWriter import H5DataWriter
+from constellation.satellites.H5DataWriter.H5DataWriter import H5DataWriter, read_stream_message
+from constellation.satellites.RawDataWriter.RawDataWriter import RawDataWriter
+from constellation.tools.cdtp_benchmark import _commander, _transition, run_point
+from constellation.tools.header_benchmark import run_header_benchmark
 
 DATA_PORT = 50101
 MON_PORT = 22222
@@ -172,6 +195,526 @@ def test_datatransmitter(mock_data_transmitter: DataTransmitter, mock_data_recei
     assert msg.msgtype == CDTPMessageIdentifier.EOR
 
 
+@pytest.mark.forked
+def test_datatransmitter_zero_copy():
+    ctx = zmq.Context()
+    push = ctx.socket(zmq.PUSH)
+    push.bind("inproc://zero_copy")
+    pull = ctx.socket(zmq.PULL)
+    pull.connect("inproc://zero_copy")
+    sender = DataTransmitter("simple_sender", push)
+    rx = DataTransmitter("simple_receiver", pull)
+
+    # single NumPy array, sent without conversion to bytes
+    payload = np.arange(0, 100000, dtype=np.int32)
+    tracker = sender.send_data(payload, {"dtype": f"{payload.dtype}"}, track=True)
+    assert isinstance(tracker, zmq.MessageTracker)
+    msg = rx.recv()
+    assert msg.msgtype == CDTPMessageIdentifier.DAT
+    assert (np.frombuffer(msg.payload, dtype=msg.meta["dtype"]) == payload).all()
+    tracker.wait(1)
+    assert tracker.done
+
+    # list of NumPy arrays as multi-frame payload
+    payload = [np.arange(0, 1000, dtype=np.int16), np.ones(50000, dtype=np.float64)]
+    tracker = sender.send_data(payload, track=True)
+    msg = rx.recv()
+    assert len(msg.payload) == 2
+    assert msg.payload[0] == payload[0].tobytes()
+    assert msg.payload[1] == payload[1].tobytes()
+    tracker.wait(1)
+    assert tracker.done
+
+    # no tracker unless requested
+    assert sender.send_data(payload) is None
+    push.close()
+    pull.close()
+    ctx.term()
+
+
+@pytest.mark.forked
+def test_datatransmitter_batch(mock_data_transmitter: DataTransmitter, mock_data_receiver: DataTransmitter):
+    sender = mock_data_transmitter
+    rx = mock_data_receiver
+
+    sender.send_start("mock payload")
+    rx.recv()
+    batch = [
+        (b"first", {"idx": 0}),
+        ([b"second", b"multi-frame"], {"idx": 1}),
+        (None, None),
+        (b"last", {"idx": 3}),
+    ]
+    sender.send_data_batch(batch)
+    assert sender.sequence_number == 4
+    # receiving splits the batch transparently
+    for idx, (payload, meta) in enumerate(batch):
+        msg = rx.recv()
+        assert msg.msgtype == CDTPMessageIdentifier.DAT
+        assert msg.sequence_number == idx + 1
+        assert msg.payload == payload
+        assert msg.meta == (meta or {})
+    # regular messages continue the sequence
+    sender.send_data(b"single")
+    msg = rx.recv()
+    assert msg.payload == b"single"
+    assert msg.sequence_number == 5
+
+
+@pytest.mark.forked
+def test_pushthread_batching():
+    ctx = zmq.Context()
+    push = ctx.socket(zmq.PUSH)
+    push.bind("inproc://batching")
+    pull = ctx.socket(zmq.PULL)
+    pull.connect("inproc://batching")
+    rx = DataTransmitter("simple_receiver", pull)
+    queue = Queue()
+    stopevt = threading.Event()
+    pusher = PushThread("simple_sender", stopevt, push, queue, batch_size=4, batch_timeout=0.05, daemon=True)
+
+    queue.put(({"payload": {}, "meta": {}}, CDTPMessageIdentifier.BOR))
+    for idx in range(6):
+        queue.put((f"payload {idx}".encode(), {"idx": idx}))
+    pusher.start()
+    # BOR, a full batch and a batch flushed after the timeout
+    msg = rx.recv()
+    assert msg.msgtype == CDTPMessageIdentifier.BOR
+    assert len(rx.decode_messages(pull.recv_multipart())) == 4
+    assert len(rx.decode_messages(pull.recv_multipart())) == 2
+    queue.join()
+
+    # pending payloads are sent before the EOR
+    queue.put((b"late payload", {}))
+    queue.put(({"payload": {}, "meta": {}}, CDTPMessageIdentifier.EOR))
+    msgs = rx.decode_messages(pull.recv_multipart())
+    assert msgs[0].payload == b"late payload"
+    assert msgs[0].sequence_number == 7
+    assert rx.recv().msgtype == CDTPMessageIdentifier.EOR
+    stopevt.set()
+    pusher.join()
+    push.close()
+    pull.close()
+    ctx.term()
+
+
+def test_shmring():
+    ring = ShmRingBuffer(size=100)
+    reader = ShmRingBuffer(ring.name)
+    desc = ring.write([b"a" * 60])
+    assert desc == [(0, 60)]
+    # not enough space left until the reader released the frame
+    assert ring.write([b"b" * 50]) is None
+    frames = reader.read(desc)
+    assert frames == [b"a" * 60]
+    assert ring.free() == 40
+    del frames
+    assert ring.free() == 100
+    # frames do not wrap around the end of the buffer
+    payload = np.arange(5, dtype=np.int16)
+    desc = ring.write([b"b" * 50, payload])
+    assert desc == [(100, 50), (150, 10)]
+    first, second = reader.read(desc)
+    assert first == b"b" * 50
+    assert (np.frombuffer(second, dtype=np.int16) == payload).all()
+    # space is reused once all frames written before are released
+    del second
+    assert ring.free() == 0
+    del first
+    assert ring.free() == 100
+    # frames larger than the buffer or without buffer protocol are rejected
+    assert ring.write([bytes(101)]) is None
+    assert ring.write(["text"]) is None
+    reader.close()
+    ring.close()
+
+
+@pytest.mark.forked
+def test_pushthread_shared_memory():
+    ctx = zmq.Context()
+    tmpdir = TemporaryDirectory()
+    shm_endpoint = f"ipc://{tmpdir.name}/shm_lane"
+    push = ctx.socket(zmq.PUSH)
+    peers = PeerMonitor(push)
+    port = push.bind_to_random_port("tcp://127.0.0.1")
+    shm_push = ctx.socket(zmq.PUSH)
+    shm_peers = PeerMonitor(shm_push)
+    shm_push.bind(shm_endpoint)
+    pull = ctx.socket(zmq.PULL)
+    pull.connect(f"tcp://127.0.0.1:{port}")
+    rx = DataTransmitter("simple_receiver", pull)
+    ring = ShmRingBuffer(size=1024)
+    queue = Queue()
+    stopevt = threading.Event()
+    pusher = PushThread(
+        "simple_sender",
+        stopevt,
+        push,
+        queue,
+        shm_socket=shm_push,
+        ring=ring,
+        peers=peers,
+        shm_peers=shm_peers,
+        daemon=True,
+    )
+    pusher.start()
+    payload = np.arange(100, dtype=np.int16)
+    time.sleep(0.1)
+
+    for run in range(3):
+        queue.put(({"payload": {}, "meta": {}}, CDTPMessageIdentifier.BOR))
+        queue.put((payload, {"run": run}))
+        # too large for the ring buffer, sent via socket instead
+        queue.put((bytes(2048), {}))
+        queue.put(({"payload": {}, "meta": {}}, CDTPMessageIdentifier.EOR))
+        binmsgs = [pull.recv_multipart() for _ in range(4)]
+        # only the sole receiver on the same host reads from shared memory
+        assert (SHM_META_KEY in rx._decode_header(binmsgs[1])[3]) == (run == 1)
+        assert SHM_META_KEY not in rx._decode_header(binmsgs[2])[3]
+        msgs = [rx.decode(binmsg) for binmsg in binmsgs]
+        assert msgs[1].meta == {"run": run}
+        assert (np.frombuffer(msgs[1].payload, dtype=np.int16) == payload).all()
+        assert msgs[2].payload == bytes(2048)
+        assert msgs[3].msgtype == CDTPMessageIdentifier.EOR
+        del msgs
+        if run == 0:
+            # the receiver is on the same host and connects to the shm socket
+            pull.connect(shm_endpoint)
+        else:
+            # another local receiver, data is sent via TCP to the first one
+            other = ctx.socket(zmq.PULL)
+            other.connect(shm_endpoint)
+        time.sleep(0.1)
+
+    stopevt.set()
+    pusher.join()
+    rx.close()
+    ring.close()
+    peers.close()
+    shm_peers.close()
+    push.close()
+    shm_push.close()
+    pull.close()
+    other.close(linger=0)
+    ctx.term()
+    tmpdir.cleanup()
+
+
+def test_histogram():
+    hist = Histogram(LATENCY_BUCKETS)
+    assert hist.mean() is None and hist.quantile(0.5) is None
+    for value in [1e-4] * 90 + [1e-2] * 10:
+        hist.fill(value)
+    assert hist.count == 100
+    assert hist.mean() == pytest.approx(1.09e-3)
+    # quantiles are estimated by the upper bucket edge
+    assert 1e-4 <= hist.quantile(0.5) < 2e-4
+    assert hist.quantile(0.99) == 1e-2
+    summary = hist.summary("lat", scale=1e3)
+    assert summary["lat_count"] == 100
+    assert summary["lat_max"] == pytest.approx(10)
+    hist.reset()
+    assert hist.summary("lat") == {"lat_count": 0}
+
+
+@pytest.mark.forked
+def test_pushthread_stats():
+    ctx = zmq.Context()
+    push = ctx.socket(zmq.PUSH)
+    push.bind("inproc://stats")
+    pull = ctx.socket(zmq.PULL)
+    pull.connect("inproc://stats")
+    rx = DataTransmitter("simple_receiver", pull)
+    queue = DataQueue()
+    stopevt = threading.Event()
+    pusher = PushThread("simple_sender", stopevt, push, queue, batch_size=2, batch_timeout=0.05, daemon=True)
+
+    queue.put(({"payload": {}, "meta": {}}, CDTPMessageIdentifier.BOR))
+    for _ in range(5):
+        queue.put((bytes(100), {}))
+    queue.put(({"payload": {"user": 1}, "meta": {}}, CDTPMessageIdentifier.EOR))
+    time.sleep(0.1)
+    pusher.start()
+    msgs = []
+    while not msgs or msgs[-1].msgtype != CDTPMessageIdentifier.EOR:
+        msgs.append(rx.recv())
+    eor = msgs[-1].payload
+    assert eor["user"] == 1
+    assert eor["tx_messages"] == 5
+    assert eor["tx_bytes"] == 500
+    assert eor["tx_latency_count"] == 5
+    # payloads were queued well before the thread started
+    assert eor["tx_latency_p50"] >= 100
+    assert pusher.stats.total_messages == 5
+    stopevt.set()
+    pusher.join()
+    push.close()
+    pull.close()
+    ctx.term()
+
+
+@pytest.mark.forked
+def test_pushthread_flow_control():
+    """Test that data messages are only sent while holding credit."""
+    ctx = zmq.Context()
+    push = ctx.socket(zmq.PUSH)
+    push.bind("inproc://credit_data")
+    pull = ctx.socket(zmq.PULL)
+    pull.connect("inproc://credit_data")
+    rx = DataTransmitter("simple_receiver", pull)
+    credit_pull = ctx.socket(zmq.PULL)
+    credit_pull.bind("inproc://credit")
+    credit_push = ctx.socket(zmq.PUSH)
+    credit_push.connect("inproc://credit")
+    queue = DataQueue()
+    stopevt = threading.Event()
+    pusher = PushThread("simple_sender", stopevt, push, queue, credit_socket=credit_pull, credit_port=12345, daemon=True)
+    pusher.start()
+
+    queue.put(({"payload": {}, "meta": {}}, CDTPMessageIdentifier.BOR))
+    for _ in range(5):
+        queue.put((bytes(100), {}))
+    bor = rx.recv()
+    assert bor.meta[CREDIT_META_KEY] == 12345
+    # credit for two messages
+    credit_push.send(encode_credit(2, 200))
+    assert rx.recv().msgtype == CDTPMessageIdentifier.DAT
+    assert rx.recv().msgtype == CDTPMessageIdentifier.DAT
+    assert not pull.poll(200), "Sent data message without credit"
+    # byte credit exhausted by a single message
+    credit_push.send(encode_credit(10, 50))
+    assert rx.recv().msgtype == CDTPMessageIdentifier.DAT
+    assert not pull.poll(200), "Sent data message without credit"
+    credit_push.send(encode_credit(10, 1000))
+    assert rx.recv().msgtype == CDTPMessageIdentifier.DAT
+    assert rx.recv().msgtype == CDTPMessageIdentifier.DAT
+    queue.put(({"payload": {}, "meta": {}}, CDTPMessageIdentifier.EOR))
+    eor = rx.recv().payload
+    # may have waited for the initial credit as well
+    assert eor["tx_credit_stalls"] >= 2
+    assert eor["tx_credit_stall_time"] >= 0.3
+    stopevt.set()
+    pusher.join()
+    for socket in [push, pull, credit_pull, credit_push]:
+        socket.close()
+    ctx.term()
+
+
+@pytest.mark.forked
+def test_benchmark_flow_control():
+    """Run a small point of the CDTP benchmark with a credit window smaller than the run."""
+    res = run_point(
+        "h5",
+        senders=1,
+        payload_size=1024,
+        frames=1,
+        messages=100,
+        sender_config={"_flow_control": True},
+        receiver_config={"_credit_messages": 10},
+    )
+    assert res["received_messages"] == 100
+
+
+@pytest.mark.forked
+@pytest.mark.parametrize("batch_size", [1, 4])
+def test_pushthread_send_timeout(batch_size):
+    """Test that data messages not sent within the send timeout are dropped and accounted for."""
+    ctx = zmq.Context()
+    push = ctx.socket(zmq.PUSH)
+    push.setsockopt(zmq.SNDHWM, 2)
+    push.setsockopt(zmq.SNDTIMEO, 0)
+    push.bind("inproc://timeout")
+    pull = ctx.socket(zmq.PULL)
+    pull.setsockopt(zmq.RCVHWM, 2)
+    pull.connect("inproc://timeout")
+    rx = DataTransmitter("simple_receiver", pull)
+    queue = DataQueue()
+    stopevt = threading.Event()
+    pusher = PushThread("simple_sender", stopevt, push, queue, batch_size=batch_size, daemon=True)
+
+    queue.put(({"payload": {}, "meta": {}}, CDTPMessageIdentifier.BOR))
+    for _ in range(40):
+        queue.put((bytes(100), {}))
+    queue.put(({"payload": {}, "meta": {}}, CDTPMessageIdentifier.EOR))
+    pusher.start()
+    # do not read until everything was sent or dropped
+    while queue.unfinished_tasks > 1:
+        time.sleep(0.05)
+    msgs = []
+    while not msgs or msgs[-1].msgtype != CDTPMessageIdentifier.EOR:
+        msgs.append(rx.recv())
+    assert msgs[0].meta[SOCKET_META_KEY] == {"sndhwm": 2, "sndbuf": -1, "sndtimeo": 0}
+    eor = msgs[-1]
+    assert eor.payload["tx_dropped"] > 0
+    assert eor.payload["tx_messages"] + eor.payload["tx_dropped"] == 40
+    assert len(msgs) == eor.payload["tx_messages"] + 2
+    # dropped messages show up as gaps in the sequence numbers
+    tracker = SequenceTracker()
+    for msg in msgs[1:-1]:
+        tracker.check(msg.sequence_number)
+    tracker.finish(eor.sequence_number)
+    assert tracker.lost == eor.payload["tx_dropped"]
+    stopevt.set()
+    pusher.join()
+    push.close()
+    pull.close()
+    ctx.term()
+
+
+def test_cached_header():
+    tx = DataTransmitter("simple_sender", None)
+    for seqno, meta in [(1, None), (2**40, {"dtype": "int16"})]:
+        tx.sequence_number = seqno
+        header = tx._encode_header(CDTPMessageIdentifier.DAT, meta)
+        # identical to a header encoded from scratch
+        assert header == bytes(tx.msgheader.encode(meta, msgtype=CDTPMessageIdentifier.DAT.value, seqno=seqno))
+        assert tx.msgheader.decode(header) == ("simple_sender", CDTPMessageIdentifier.DAT.value, seqno, meta or {})
+
+
+def test_header_benchmark():
+    """Run a small header encoding benchmark."""
+    res = run_header_benchmark(count=1000, repeat=1)
+    assert {(r["case"], r["encoding"]) for r in res["results"]} == {
+        (case, encoding)
+        for case in ["without_meta", "with_meta"]
+        for encoding in ["from_scratch", "message_header", "cached"]
+    }
+    assert all(r["headers_per_s"] > 0 for r in res["results"])
+
+
+@pytest.mark.forked
+@pytest.mark.parametrize("codec", CODECS.keys())
+def test_pushthread_compression(codec):
+    ctx = zmq.Context()
+    push = ctx.socket(zmq.PUSH)
+    push.bind("inproc://compression")
+    pull = ctx.socket(zmq.PULL)
+    pull.connect("inproc://compression")
+    rx = DataTransmitter("simple_receiver", pull)
+    queue = Queue()
+    stopevt = threading.Event()
+    compressor = Compressor(codec)
+    pusher = PushThread("simple_sender", stopevt, push, queue, compressor=compressor, compression_workers=2, daemon=True)
+    pusher.start()
+
+    payloads = [(np.zeros(10000, dtype=np.int32), {"idx": idx}) for idx in range(10)]
+    payloads.append(([np.zeros(1000), np.ones(1000)], None))
+    for item in payloads:
+        queue.put(item)
+    queue.put(({"payload": {}, "meta": {}}, CDTPMessageIdentifier.EOR))
+    # payloads arrive in order, compressed on the wire and decompressed on decode
+    for idx, (payload, meta) in enumerate(payloads):
+        binmsg = pull.recv_multipart()
+        assert sum(len(frame) for frame in binmsg[1:]) < payload_nbytes(payload)
+        msg = rx.decode(binmsg)
+        assert msg.sequence_number == idx + 1
+        assert msg.meta == (meta or {})
+        if isinstance(payload, list):
+            assert msg.payload == [frame.tobytes() for frame in payload]
+        else:
+            assert msg.payload == payload.tobytes()
+    assert rx.recv().msgtype == CDTPMessageIdentifier.EOR
+    assert compressor.get_ratio() > 1
+    assert compressor.get_cpu_time() > 0
+    stopevt.set()
+    pusher.join()
+    push.close()
+    pull.close()
+    ctx.term()
+
+
+def test_dataqueue_policies():
+    bor = ({"payload": {}, "meta": {}}, CDTPMessageIdentifier.BOR)
+
+    # drop newest
+    q = DataQueue(max_items=2, policy=QueuePolicy.DROP_NEWEST)
+    q.put(bor)
+    for idx in range(4):
+        q.put((f"{idx}".encode(), {}))
+    assert q.qsize() == 3
+    assert q.dropped == 2
+    assert q.get() == bor
+    assert [q.get()[0] for _ in range(2)] == [b"0", b"1"]
+
+    # drop oldest, limited in bytes
+    q = DataQueue(max_bytes=20, policy=QueuePolicy.DROP_OLDEST)
+    for idx in range(4):
+        q.put((bytes(10) + f"{idx}".encode(), {}))
+    assert q.dropped == 3
+    assert q.unfinished_tasks == 1
+    assert q.get()[0] == bytes(10) + b"3"
+    assert q.nbytes == 0
+
+    # block
+    q = DataQueue(max_items=1, policy=QueuePolicy.BLOCK)
+    q.put((b"0", {}))
+    with pytest.raises(Full):
+        q.put((b"1", {}), timeout=0.05)
+    # control messages are always accepted
+    q.put(bor)
+    assert q.qsize() == 2
+
+
+def test_dataqueue_spill():
+    with TemporaryDirectory() as tmpdir:
+        q = DataQueue(max_items=2, policy=QueuePolicy.SPILL, spill_path=tmpdir)
+        payloads = [
+            (np.arange(10, dtype=np.int16), {"idx": 0}),
+            (b"1", {"idx": 1}),
+            ([b"2a", np.ones(3)], {"idx": 2}),
+            (b"3", None),
+        ]
+        for item in payloads:
+            q.put(item)
+        q.put(({"payload": {"run": 1}, "meta": {}}, CDTPMessageIdentifier.EOR))
+        assert q.spilled_items == 3
+        assert q.spill_depth() == 3
+        assert q.qsize() == 5
+        # order is preserved when reading back from disk
+        payload, meta = q.get()
+        assert (payload == payloads[0][0]).all()
+        assert q.get() == payloads[1]
+        payload, meta = q.get()
+        assert payload == [b"2a", np.ones(3).tobytes()]
+        assert meta == {"idx": 2}
+        assert q.get() == payloads[3]
+        assert q.get() == ({"payload": {"run": 1}, "meta": {}}, CDTPMessageIdentifier.EOR)
+        assert q.empty()
+        assert q.spill_depth() == 0
+        q.close()
+
+
+def test_dataqueue_spill_accounting():
+    with TemporaryDirectory() as tmpdir:
+        q = DataQueue(max_items=3, max_bytes=100, policy=QueuePolicy.SPILL, spill_path=tmpdir)
+        q.put(({"payload": {}, "meta": {}}, CDTPMessageIdentifier.BOR))
+        sizes = [40, 40, 10, 60, 30, 30, 30, 5]
+        for idx, size in enumerate(sizes):
+            q.put((bytes(size), {"idx": idx}))
+        q.put(({"payload": {}, "meta": {}}, CDTPMessageIdentifier.EOR))
+        assert q.spill_depth() == 6
+        assert q.qsize() == 10
+        assert (q.nitems, q.nbytes) == (3, 90)
+        # reloaded payloads are accounted and kept within the limits
+        assert q.get()[1] == CDTPMessageIdentifier.BOR
+        for idx, size in enumerate(sizes):
+            payload, meta = q.get()
+            assert meta == {"idx": idx} and len(payload) == size
+            assert q.qsize() == len(sizes) - idx
+            assert q.nitems <= 3 and q.nbytes <= 100
+            in_memory = [item for item in q.queue if not isinstance(item[1], CDTPMessageIdentifier)]
+            assert q.nitems == len(in_memory)
+            assert q.nbytes == sum(len(payload) for payload, _ in in_memory)
+        assert q.get()[1] == CDTPMessageIdentifier.EOR
+        assert q.qsize() == 0
+        assert (q.nitems, q.nbytes) == (0, 0)
+        # the full budget is available again
+        for _ in range(3):
+            q.put((bytes(30), {}))
+        assert q.spill_depth() == 0
+        q.close()
+
+
 @pytest.mark.forked
 def test_sending_package(
     mock_sender_satellite,
@@ -292,6 +835,170 @@ def test_receive_writing_package(
             h5file.close()
 
 
+@pytest.mark.forked
+def test_receive_writing_lanes(
+    receiver_satellite,
+    commander,
+):
+    """Test receiving and writing data sent over several lanes of one sender."""
+    ctx = zmq.Context()
+    lanes = []
+    for lane in range(2):
+        socket = ctx.socket(zmq.PUSH)
+        socket.bind(f"tcp://127.0.0.1:{DATA_PORT + lane}")
+        lanes.append(DataTransmitter("simple_sender", socket))
+
+    receiver = receiver_satellite
+    with TemporaryDirectory() as tmpdir:
+        commander.request_get_response("initialize", {"_file_name_pattern": FILE_NAME, "_output_path": tmpdir})
+        wait_for_state(receiver.fsm, "INIT", 1)
+        for lane in range(2):
+            service = DiscoveredService(
+                get_uuid("simple_sender"),
+                CHIRPServiceIdentifier.DATA,
+                "127.0.0.1",
+                port=DATA_PORT + lane,
+            )
+            receiver._add_sender(service)
+        assert len(receiver._pull_interfaces) == 2
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+
+        payload = np.array(np.arange(100), dtype=np.int16)
+        for lane, tx in enumerate(lanes):
+            tx.send_start({"mock_cfg": 1}, {"_lane": lane, "_lanes": 2})
+            tx.send_data(payload.tobytes(), {"dtype": f"{payload.dtype}"})
+        time.sleep(0.1)
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+        timeout = 0.5
+        while len(receiver.active_satellites) < 2 and timeout > 0:
+            time.sleep(0.05)
+            timeout -= 0.05
+        assert receiver.active_satellites == ["simple_sender", "simple_sender"], "BOR missing for a lane"
+        commander.request_get_response("stop")
+        lanes[0].send_end({"mock_end": "end"}, {"_lane": 0, "_lanes": 2})
+        time.sleep(0.5)
+        # EOR of the second lane still outstanding
+        assert receiver.fsm.current_state_value.name == "stopping", "Receiver stopped before last EOR"
+        lanes[1].send_end({"mock_end": "end"}, {"_lane": 1, "_lanes": 2})
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+
+        h5file = h5py.File(tmpdir / pathlib.Path(FILE_NAME.format(run_identifier=1)))
+        grp = h5file["simple_sender"]
+        assert {"BOR", "EOR", "data_1_000000001", "data_1_lane1_000000001"}.issubset(grp.keys())
+        assert grp["data_1_lane1_000000001"].attrs["lane"] == 1
+        assert (payload == grp["data_1_000000001"]).all()
+        assert (payload == grp["data_1_lane1_000000001"]).all()
+        h5file.close()
+
+
+@pytest.mark.forked
+def test_receive_late_joiner(
+    receiver_satellite,
+    data_transmitter,
+    commander,
+):
+    """Test a sender without BOR whose EOR arrives before its data was written."""
+    receiver = receiver_satellite
+    write_data = receiver._write_data
+
+    def slow_write_data(outfile, item):
+        time.sleep(0.3)
+        write_data(outfile, item)
+
+    receiver._write_data = slow_write_data
+    with TemporaryDirectory() as tmpdir:
+        commander.request_get_response("initialize", {"_file_name_pattern": FILE_NAME, "_output_path": tmpdir})
+        wait_for_state(receiver.fsm, "INIT", 1)
+        receiver._add_sender(
+            DiscoveredService(get_uuid("simple_sender"), CHIRPServiceIdentifier.DATA, "127.0.0.1", port=DATA_PORT)
+        )
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+
+        payload = np.arange(100, dtype=np.int16)
+        data_transmitter.send_data(payload.tobytes())
+        data_transmitter.send_end({"mock_end": "end"})
+        time.sleep(0.1)
+        assert receiver.active_satellites == []
+        commander.request_get_response("stop")
+        wait_for_state(receiver.fsm, "ORBIT", 2)
+
+        with h5py.File(os.path.join(tmpdir, FILE_NAME.format(run_identifier=1))) as h5file:
+            grp = h5file["simple_sender"]
+            assert {"EOR", "data_1_000000001"}.issubset(grp.keys())
+
+
+def test_sequence_tracker():
+    """Test detection of gaps, duplicates and reordering."""
+    tracker = SequenceTracker()
+    for seqno in [1, 2, 5, 3, 6, 6, 9]:
+        tracker.check(seqno)
+    assert tracker.received == 6
+    assert tracker.gaps == 2
+    assert tracker.reordered == 1
+    assert tracker.duplicates == 1
+    # missing: 4, 7, 8
+    assert tracker.lost == 3
+    tracker.check(7)
+    tracker.check(4)
+    assert tracker.lost == 1
+    assert tracker.reordered == 3
+    # EOR announces two more messages than received
+    tracker.finish(11)
+    assert tracker.lost == 3
+    assert tracker.gaps == 3
+
+
+@pytest.mark.forked
+def test_receive_sequence_gaps(
+    receiver_satellite,
+    commander,
+):
+    """Test that messages lost on the way are accounted for in the EOR."""
+    ctx = zmq.Context()
+    socket = ctx.socket(zmq.PUSH)
+    socket.bind(f"tcp://127.0.0.1:{DATA_PORT}")
+    tx = DataTransmitter("simple_sender", socket)
+
+    receiver = receiver_satellite
+    with TemporaryDirectory() as tmpdir:
+        commander.request_get_response("initialize", {"_file_name_pattern": FILE_NAME, "_output_path": tmpdir})
+        wait_for_state(receiver.fsm, "INIT", 1)
+        service = DiscoveredService(get_uuid("simple_sender"), CHIRPServiceIdentifier.DATA, "127.0.0.1", port=DATA_PORT)
+        receiver._add_sender(service)
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+
+        tx.send_start({"mock_cfg": 1})
+        tx.send_data(b"data")
+        # skip two sequence numbers
+        tx.sequence_number += 2
+        tx.send_data(b"data")
+        tx.send_data(b"data")
+        # last message lost
+        tx.sequence_number += 1
+        time.sleep(0.2)
+        assert receiver.sequence_stats["lost_messages"] == 2
+        assert receiver.sequence_stats["sequence_gaps"] == 1
+        commander.request_get_response("stop")
+        tx.send_end({"mock_end": "end"})
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+
+        h5file = h5py.File(tmpdir / pathlib.Path(FILE_NAME.format(run_identifier=1)))
+        eor = h5file["simple_sender"]["EOR"]
+        assert eor["rx_messages"][()] == 3
+        assert eor["rx_lost"][()] == 3
+        assert eor["rx_gaps"][()] == 2
+        assert eor["rx_duplicates"][()] == 0
+        h5file.close()
+
+
 @pytest.mark.forked
 def test_receiver_stats(
     receiver_satellite,
@@ -354,3 +1061,869 @@ def test_receiver_stats(
     # close thread and connections to allow temp dir to be removed
     ml._log_listening_shutdown()
     ml._metrics_listening_shutdown()
+
+
+@pytest.mark.forked
+@pytest.mark.parametrize("writer", ["null", "h5"])
+def test_benchmark_point(writer):
+    """Run a small point of the CDTP benchmark."""
+    res = run_point(writer, senders=2, payload_size=1024, frames=2, messages=50)
+    assert res["received_messages"] == 100
+    assert res["received_bytes"] == 100 * 2 * 1024
+    assert res["mb_per_s"] > 0
+    assert res["latency_ms_count"] == 100
+
+
+@pytest.mark.forked
+def test_random_data_sender_load():
+    """Test rate and payload sizes generated by the RandomDataSender."""
+    sender = RandomDataSender(
+        name="load_generator",
+        group="mockstellation",
+        cmd_port=0,
+        hb_port=0,
+        mon_port=0,
+        data_port=0,
+        interface="127.0.0.1",
+    )
+    threading.Thread(target=sender.run_satellite, daemon=True).start()
+    ctx = zmq.Context()
+    cmd = _commander(ctx, sender.cmd_port)
+    pull = ctx.socket(zmq.PULL)
+    pull.connect(f"tcp://127.0.0.1:{sender.data_port}")
+    rx = DataTransmitter("simple_receiver", pull)
+
+    config = {"rate": 200, "frames": 2, "payload_distribution": "uniform", "payload_size": 1000, "payload_spread": 500}
+    _transition([cmd], "initialize", "INIT", config)
+    _transition([cmd], "launch", "ORBIT")
+    _transition([cmd], "start", "RUN", "1")
+    assert rx.recv().msgtype == CDTPMessageIdentifier.BOR
+    start = time.monotonic()
+    sizes = []
+    while time.monotonic() - start < 1.0:
+        msg = rx.recv()
+        assert msg.msgtype == CDTPMessageIdentifier.DAT
+        assert len(msg.payload) == 2
+        sizes += [len(frame) for frame in msg.payload]
+    _transition([cmd], "stop", "ORBIT")
+    # paced at the target rate
+    assert 150 <= len(sizes) / 2 <= 250
+    assert min(sizes) >= 500 and max(sizes) <= 1500
+    assert len(set(sizes)) > 1
+
+
+class CountingAsyncSender(AsyncDataSender):
+    """AsyncDataSender sending a fixed number of counting payloads."""
+
+    async def do_run_async(self, run_identifier):
+        for idx in range(self.config.setdefault("count", 10)):
+            payload = np.full(100, idx, dtype=np.uint32)
+            if not await self.send_data(payload, meta={"idx": idx}):
+                break
+        while not self._state_thread_evt.is_set():
+            await asyncio.sleep(0.05)
+        return "Finished acquisition"
+
+
+@pytest.mark.forked
+def test_async_data_sender():
+    """Test sending data from an asyncio acquisition coroutine."""
+    sender = CountingAsyncSender(
+        name="async_sender",
+        group="mockstellation",
+        cmd_port=0,
+        hb_port=0,
+        mon_port=0,
+        data_port=0,
+        interface="127.0.0.1",
+    )
+    threading.Thread(target=sender.run_satellite, daemon=True).start()
+    ctx = zmq.Context()
+    cmd = _commander(ctx, sender.cmd_port)
+    pull = ctx.socket(zmq.PULL)
+    pull.connect(f"tcp://127.0.0.1:{sender.data_port}")
+    rx = DataTransmitter("simple_receiver", pull)
+
+    _transition([cmd], "initialize", "INIT", {"count": 20, "_send_timeout": 100})
+    _transition([cmd], "launch", "ORBIT")
+    _transition([cmd], "start", "RUN", "1")
+    msg = rx.recv()
+    assert msg.msgtype == CDTPMessageIdentifier.BOR
+    assert msg.sequence_number == 0
+    assert msg.payload["count"] == 20
+    assert "sndhwm" in msg.meta[SOCKET_META_KEY]
+    for idx in range(20):
+        msg = rx.recv()
+        assert msg.msgtype == CDTPMessageIdentifier.DAT
+        assert msg.sequence_number == idx + 1
+        assert msg.meta["idx"] == idx
+        assert np.array_equal(np.frombuffer(msg.payload, dtype=np.uint32), np.full(100, idx))
+    _transition([cmd], "stop", "ORBIT")
+    msg = rx.recv()
+    assert msg.msgtype == CDTPMessageIdentifier.EOR
+    assert msg.sequence_number == 20
+    assert msg.payload["tx_messages"] == 20
+    assert msg.payload["tx_dropped"] == 0
+
+    # the EOR is retried while no receiver accepts it
+    _transition([cmd], "start", "RUN", "2")
+    for _ in range(21):
+        rx.recv()
+    pull.close()
+    time.sleep(0.2)
+
+    def reconnect():
+        time.sleep(0.5)
+        late_pull.connect(f"tcp://127.0.0.1:{sender.data_port}")
+
+    late_pull = ctx.socket(zmq.PULL)
+    late_pull.setsockopt(zmq.RCVTIMEO, 5000)
+    threading.Thread(target=reconnect, daemon=True).start()
+    _transition([cmd], "stop", "ORBIT")
+    msg = DataTransmitter("simple_receiver", late_pull).recv()
+    assert msg.msgtype == CDTPMessageIdentifier.EOR
+    assert msg.payload["tx_messages"] == 20
+
+    # unsupported transmission features are rejected
+    _transition([cmd], "land", "INIT")
+    _transition([cmd], "initialize", "ERROR", {"_batch_size": 4})
+
+
+RECORD_DTYPE = np.dtype([("timestamp", "<u8"), ("adc", "<i2", (4,)), ("hit", "u1")])
+
+
+def test_arrayschema():
+    """Test declaring array schemas in the BOR meta and viewing payloads."""
+    schema = ArraySchema(RECORD_DTYPE)
+    # survives the msgpack encoding of the header meta
+    meta = msgpack.unpackb(msgpack.packb({SCHEMA_META_KEY: schema.to_meta()}))
+    decoded = ArraySchema.from_meta(meta[SCHEMA_META_KEY])
+    assert decoded == schema
+    assert not decoded.fixed
+
+    records = np.zeros(5, dtype=RECORD_DTYPE)
+    records["timestamp"] = np.arange(5)
+    records["adc"][:, 2] = 7
+    binary = records.tobytes()
+    view = decoded.view(binary)
+    assert np.array_equal(view, records)
+    assert view["adc"][3, 2] == 7
+    # views share the memory of the received frame
+    assert not view.flags.owndata and view.base is not None
+    views = decoded.view([binary, binary[: RECORD_DTYPE.itemsize]])
+    assert [len(view) for view in views] == [5, 1]
+
+    image = ArraySchema(np.float32, (2, 3))
+    assert image.fixed
+    assert image.view(np.ones((2, 3), dtype=np.float32).tobytes()).shape == (2, 3)
+    with pytest.raises(ValueError):
+        ArraySchema(np.uint8, (-1, -1))
+
+
+@pytest.mark.forked
+def test_receive_typed_stream(
+    receiver_satellite,
+    data_transmitter,
+    commander,
+):
+    """Test writing data of a typed stream declared in the BOR."""
+    service = DiscoveredService(
+        get_uuid("simple_sender"),
+        CHIRPServiceIdentifier.DATA,
+        "127.0.0.1",
+        port=DATA_PORT,
+    )
+    receiver = receiver_satellite
+    tx = data_transmitter
+    with TemporaryDirectory() as tmpdir:
+        commander.request_get_response("initialize", {"_file_name_pattern": FILE_NAME, "_output_path": tmpdir})
+        wait_for_state(receiver.fsm, "INIT", 1)
+        receiver._add_sender(service)
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+
+        records = np.zeros(10, dtype=RECORD_DTYPE)
+        records["timestamp"] = np.arange(10)
+        records["hit"] = 1
+        tx.send_start({"mock_cfg": 1}, meta={SCHEMA_META_KEY: ArraySchema(RECORD_DTYPE).to_meta()})
+        tx.send_data(records)
+        tx.send_data([records[:4], records[4:]])
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+        time.sleep(0.2)
+        assert receiver.stream_schemas["simple_sender"] == ArraySchema(RECORD_DTYPE)
+        commander.request_get_response("stop")
+        tx.send_end({})
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+
+        with h5py.File(os.path.join(tmpdir, FILE_NAME.format(run_identifier=1))) as h5file:
+            for seqno in (1, 2):
+                dset = h5file["simple_sender"][f"data_1_{seqno:09}"]
+                assert dset.dtype == RECORD_DTYPE
+                assert np.array_equal(dset[()], records)
+                # no per-message description of the payload needed
+                assert "dtype" not in dset.attrs
+
+
+@pytest.mark.forked
+def test_receive_slow_writer(
+    receiver_satellite,
+    commander,
+):
+    """Test reception continuing into the buffers while writing stalls."""
+    ctx = zmq.Context()
+    senders = {}
+    receiver = receiver_satellite
+    for idx, name in enumerate(["sender_a", "sender_b"]):
+        socket = ctx.socket(zmq.PUSH)
+        socket.bind(f"tcp://127.0.0.1:{DATA_PORT + idx}")
+        senders[name] = DataTransmitter(name, socket)
+
+    # writing blocks until released
+    release = threading.Event()
+    written = []
+    write_data = receiver._write_data
+
+    def slow_write_data(outfile, item):
+        release.wait()
+        written.append((item.name, item.sequence_number))
+        write_data(outfile, item)
+
+    receiver._write_data = slow_write_data
+
+    with TemporaryDirectory() as tmpdir:
+        config = {
+            "_file_name_pattern": FILE_NAME,
+            "_output_path": tmpdir,
+            "_writer_threads": 2,
+            "_buffer_max_items": 5,
+        }
+        commander.request_get_response("initialize", config)
+        wait_for_state(receiver.fsm, "INIT", 1)
+        for idx, name in enumerate(senders):
+            receiver._add_sender(
+                DiscoveredService(get_uuid(name), CHIRPServiceIdentifier.DATA, "127.0.0.1", port=DATA_PORT + idx)
+            )
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+
+        payload = np.arange(100, dtype=np.int16)
+        for tx in senders.values():
+            tx.send_start({})
+            for _ in range(20):
+                tx.send_data(payload)
+        # the reception fills the buffers while no message gets written; both
+        # senders might be assigned to the same writer
+        timeout = 2.0
+        while receiver._get_buffer_depth() < 5 and timeout > 0:
+            time.sleep(0.05)
+            timeout -= 0.05
+        assert receiver._get_buffer_depth() >= 5
+        assert not written
+        release.set()
+
+        commander.request_get_response("stop")
+        for tx in senders.values():
+            tx.send_end({})
+        wait_for_state(receiver.fsm, "ORBIT", 2)
+
+        # the order of the messages of each sender is preserved
+        for name in senders:
+            assert [seqno for sender, seqno in written if sender == name] == list(range(1, 21))
+        assert receiver.pipeline_stats["receive_stalls"] > 0
+        assert receiver.pipeline_stats["receive_stall_time"] > 0
+        assert receiver._get_buffer_depth() == 0
+        with h5py.File(os.path.join(tmpdir, FILE_NAME.format(run_identifier=1))) as h5file:
+            for name in senders:
+                assert "EOR" in h5file[name]
+                assert len([key for key in h5file[name] if key.startswith("data_")]) == 20
+
+
+@pytest.mark.forked
+def test_receive_writer_failure(
+    receiver_satellite,
+    data_transmitter,
+    commander,
+):
+    """Test the receiver going into ERROR if a writer thread fails."""
+    receiver = receiver_satellite
+
+    def failing_write_data(outfile, item):
+        raise OSError("disk full")
+
+    receiver._write_data = failing_write_data
+    with TemporaryDirectory() as tmpdir:
+        commander.request_get_response("initialize", {"_file_name_pattern": FILE_NAME, "_output_path": tmpdir})
+        wait_for_state(receiver.fsm, "INIT", 1)
+        receiver._add_sender(
+            DiscoveredService(get_uuid("simple_sender"), CHIRPServiceIdentifier.DATA, "127.0.0.1", port=DATA_PORT)
+        )
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+        data_transmitter.send_start({})
+        data_transmitter.send_data(np.arange(10, dtype=np.int16))
+        wait_for_state(receiver.fsm, "ERROR", 2)
+
+
+@pytest.mark.forked
+def test_receive_sender_stats(
+    receiver_satellite,
+    data_transmitter,
+    commander,
+):
+    """Test accounting of the messages and bytes received per sender."""
+    receiver = receiver_satellite
+    with TemporaryDirectory() as tmpdir:
+        commander.request_get_response("initialize", {"_file_name_pattern": FILE_NAME, "_output_path": tmpdir})
+        wait_for_state(receiver.fsm, "INIT", 1)
+        receiver._add_sender(
+            DiscoveredService(get_uuid("simple_sender"), CHIRPServiceIdentifier.DATA, "127.0.0.1", port=DATA_PORT)
+        )
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+
+        payload = np.zeros(10000, dtype=np.uint8)
+        data_transmitter.send_start({})
+        for _ in range(10):
+            data_transmitter.send_data([payload, payload])
+        time.sleep(0.3)
+        stats = receiver.sender_stats["simple_sender"]
+        assert stats["messages"] == 11
+        # frame lengths including the headers, not the size of Python objects
+        assert 10 * 20000 < stats["bytes"] < 10 * 20000 + 11 * 200
+        assert stats["bytes"] == receiver.receiver_stats["nbytes"]
+        for metric in ["rx_messages_simple_sender", "rx_bytes_simple_sender", "rx_idle_simple_sender"]:
+            assert metric in receiver._metrics_callbacks
+        assert receiver._get_sender_idle("simple_sender") < 1.0
+
+        commander.request_get_response("stop")
+        data_transmitter.send_end({})
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+
+
+@pytest.mark.forked
+def test_receive_frames_without_copy(
+    receiver_satellite,
+    data_transmitter,
+    commander,
+):
+    """Test large frames being passed to the writer without copying."""
+    receiver = receiver_satellite
+    payloads = []
+    write_data = receiver._write_data
+
+    def recording_write_data(outfile, item):
+        payloads.append(item.payload)
+        write_data(outfile, item)
+
+    receiver._write_data = recording_write_data
+    with TemporaryDirectory() as tmpdir:
+        config = {"_file_name_pattern": FILE_NAME, "_output_path": tmpdir, "_receive_batch": 2}
+        commander.request_get_response("initialize", config)
+        wait_for_state(receiver.fsm, "INIT", 1)
+        receiver._add_sender(
+            DiscoveredService(get_uuid("simple_sender"), CHIRPServiceIdentifier.DATA, "127.0.0.1", port=DATA_PORT)
+        )
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+
+        large = np.arange(100000, dtype=np.int32)
+        small = np.arange(10, dtype=np.int32)
+        data_transmitter.send_start({})
+        for payload in [small, large, large, small, small]:
+            data_transmitter.send_data(payload)
+        commander.request_get_response("stop")
+        data_transmitter.send_end({})
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+
+    assert [len(payload) for payload in payloads] == [40, 400000, 400000, 40, 40]
+    # the copy mode follows the frame size of the previous message
+    assert isinstance(payloads[1], bytes)
+    assert isinstance(payloads[2], memoryview)
+    assert np.array_equal(np.frombuffer(payloads[2], dtype=np.int32), large)
+    assert isinstance(payloads[-1], bytes)
+
+
+@pytest.mark.forked
+def test_receive_worker_processes(commander):
+    """Test senders being sharded across worker processes writing their own files."""
+    receiver = H5DataWriter(
+        name="mock_receiver",
+        group="mockstellation",
+        cmd_port=CMD_PORT,
+        mon_port=MON_PORT,
+        hb_port=33333,
+        interface="127.0.0.1",
+    )
+    threading.Thread(target=receiver.run_satellite, daemon=True).start()
+    time.sleep(0.2)
+    ctx = zmq.Context()
+    # the names are chosen to be handled by different workers
+    transmitters = []
+    for offset, name in enumerate(["sender_a", "sender_c"]):
+        socket = ctx.socket(zmq.PUSH)
+        socket.bind(f"tcp://127.0.0.1:{DATA_PORT + offset}")
+        transmitters.append(DataTransmitter(name, socket))
+    with TemporaryDirectory() as tmpdir:
+        config = {"_file_name_pattern": FILE_NAME, "_output_path": tmpdir, "_worker_processes": 2}
+        commander.request_get_response("initialize", config)
+        wait_for_state(receiver.fsm, "INIT", 1)
+        assert len(receiver._shards) == 2
+        for offset, transmitter in enumerate(transmitters):
+            receiver._add_sender(
+                DiscoveredService(
+                    get_uuid(transmitter.name), CHIRPServiceIdentifier.DATA, "127.0.0.1", port=DATA_PORT + offset
+                )
+            )
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+
+        for transmitter in transmitters:
+            transmitter.send_start({})
+            for _ in range(10):
+                transmitter.send_data(np.arange(100, dtype=np.uint8))
+        # allow the workers to start up and receive the data
+        timeout = time.time() + 30
+        while receiver.receiver_stats["npackets"] < 22 and time.time() < timeout:
+            time.sleep(0.1)
+        assert receiver.sender_stats["sender_a"]["messages"] == 11
+        assert receiver.sender_stats["sender_c"]["messages"] == 11
+        assert "rx_messages_sender_c" in receiver._metrics_callbacks
+
+        commander.request_get_response("stop")
+        for transmitter in transmitters:
+            transmitter.send_end({})
+        wait_for_state(receiver.fsm, "ORBIT", 5)
+
+        for shard, name in enumerate(["sender_c", "sender_a"]):
+            with h5py.File(os.path.join(tmpdir, f"mock_file_1_shard{shard}.h5")) as h5file:
+                assert name in h5file
+                assert len(h5file.keys()) == 2
+                assert len([key for key in h5file[name].keys() if key.startswith("data_")]) == 10
+        assert not os.path.exists(os.path.join(tmpdir, "mock_file_1.h5"))
+    receiver.reentry()
+
+
+class FailingShardWriter(H5DataWriter):
+    """H5DataWriter whose worker processes fail to launch."""
+
+    def _init_receiver(self):
+        super()._init_receiver()
+        self.launch_error = "no disk attached"
+
+    def do_launching(self):
+        if self.shard is not None:
+            raise RuntimeError(self.launch_error)
+        return super().do_launching()
+
+
+@pytest.mark.forked
+def test_receive_worker_process_failure(commander):
+    """Test a worker process failing to launch taking the receiver into ERROR."""
+    receiver = FailingShardWriter(
+        name="mock_receiver",
+        group="mockstellation",
+        cmd_port=CMD_PORT,
+        mon_port=MON_PORT,
+        hb_port=33333,
+        interface="127.0.0.1",
+    )
+    threading.Thread(target=receiver.run_satellite, daemon=True).start()
+    time.sleep(0.2)
+    with TemporaryDirectory() as tmpdir:
+        config = {"_file_name_pattern": FILE_NAME, "_output_path": tmpdir, "_worker_processes": 1}
+        commander.request_get_response("initialize", config)
+        wait_for_state(receiver.fsm, "INIT", 30)
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ERROR", 30)
+        # the attributes defined by the subclass are available in the worker
+        assert "no disk attached" in receiver.fsm.status
+    receiver.reentry()
+
+
+@pytest.mark.forked
+def test_receive_file_rotation(
+    receiver_satellite,
+    data_transmitter,
+    commander,
+):
+    """Test runs being split into several files, each with the BOR."""
+    receiver = receiver_satellite
+    with TemporaryDirectory() as tmpdir:
+        config = {
+            "_file_name_pattern": "mock_file_{run_identifier}_{segment}.h5",
+            "_output_path": tmpdir,
+            "_rotate_messages": 5,
+            "_receive_batch": 1,
+            "_writer_threads": 2,
+        }
+        commander.request_get_response("initialize", config)
+        wait_for_state(receiver.fsm, "INIT", 1)
+        receiver._add_sender(
+            DiscoveredService(get_uuid("simple_sender"), CHIRPServiceIdentifier.DATA, "127.0.0.1", port=DATA_PORT)
+        )
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+
+        data_transmitter.send_start({"mock_cfg": 1})
+        for _ in range(12):
+            data_transmitter.send_data(np.arange(10, dtype=np.uint8))
+        commander.request_get_response("stop")
+        data_transmitter.send_end({})
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        assert receiver.segment == 2
+
+        # five messages per file, counting the BOR and EOR
+        for segment, seqnos in enumerate([range(1, 5), range(5, 10), range(10, 13)]):
+            with h5py.File(os.path.join(tmpdir, f"mock_file_1_{segment}.h5")) as h5file:
+                grp = h5file["simple_sender"]
+                assert grp["BOR"]["mock_cfg"][()] == 1
+                assert sorted(key for key in grp.keys() if key.startswith("data_")) == [
+                    f"data_1_{seqno:09}" for seqno in seqnos
+                ]
+                assert ("EOR" in grp) == (segment == 2)
+
+
+@pytest.mark.forked
+def test_receive_rotation_extendible(
+    receiver_satellite,
+    commander,
+):
+    """Test staged extendible datasets of several senders across rotated files."""
+    ctx = zmq.Context()
+    transmitters = []
+    for offset, name in enumerate(["sender_a", "sender_b", "sender_c"]):
+        socket = ctx.socket(zmq.PUSH)
+        socket.bind(f"tcp://127.0.0.1:{DATA_PORT + offset}")
+        transmitters.append(DataTransmitter(name, socket))
+
+    receiver = receiver_satellite
+    with TemporaryDirectory() as tmpdir:
+        config = {
+            "_file_name_pattern": "mock_file_{run_identifier}_{segment}.h5",
+            "_output_path": tmpdir,
+            "_rotate_messages": 7,
+            "_receive_batch": 1,
+            "_writer_threads": 2,
+            "layout": "extendible",
+        }
+        commander.request_get_response("initialize", config)
+        wait_for_state(receiver.fsm, "INIT", 1)
+        for offset, transmitter in enumerate(transmitters):
+            receiver._add_sender(
+                DiscoveredService(
+                    get_uuid(transmitter.name), CHIRPServiceIdentifier.DATA, "127.0.0.1", port=DATA_PORT + offset
+                )
+            )
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+
+        for transmitter in transmitters:
+            transmitter.send_start({})
+        for _ in range(40):
+            for transmitter in transmitters:
+                transmitter.send_data(np.arange(10, dtype=np.uint8))
+        commander.request_get_response("stop")
+        for transmitter in transmitters:
+            transmitter.send_end({})
+        wait_for_state(receiver.fsm, "ORBIT", 5)
+        assert receiver.segment > 2
+        assert receiver._extendible == {}
+        assert receiver.run_report["data_bytes"] == 3 * 40 * 10
+
+        # staged data of every segment was written and the datasets trimmed
+        rows = {transmitter.name: 0 for transmitter in transmitters}
+        for segment in range(receiver.segment + 1):
+            with h5py.File(os.path.join(tmpdir, f"mock_file_1_{segment}.h5")) as h5file:
+                for name in rows:
+                    if name in h5file and "data" in h5file[name]:
+                        grp = h5file[name]
+                        assert grp["data"].shape[0] == grp["index"]["offset"][-1] + grp["index"]["length"][-1]
+                        rows[name] += grp["data"].shape[0]
+        assert rows == {transmitter.name: 40 * 10 for transmitter in transmitters}
+
+
+def test_rawfile():
+    """Test writing raw CDTP records and reading them via memory mapping."""
+
+    def message(name, msgtype, seqno, payload, meta=None):
+        msg = CDTPMessage()
+        msg.set_header(name, msgtype.value, seqno, meta or {})
+        msg.payload = payload
+        return msg
+
+    schema = {SCHEMA_META_KEY: ArraySchema(RECORD_DTYPE).to_meta()}
+    records = np.zeros(7, dtype=RECORD_DTYPE)
+    with TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "run.cdtp")
+        # small writes to exercise several flushes
+        writer = RawFileWriter(path, write_size=1000, preallocate=1024 * 1024)
+        writer.append(message("typed", CDTPMessageIdentifier.BOR, 0, {"mock_cfg": 1}, schema))
+        writer.append(message("frames", CDTPMessageIdentifier.BOR, 0, {}))
+        for seqno in range(1, 51):
+            records["timestamp"] = seqno
+            writer.append(message("typed", CDTPMessageIdentifier.DAT, seqno, memoryview(records.tobytes())))
+            if seqno % 10:
+                # gaps in the sequence numbers
+                writer.append(message("frames", CDTPMessageIdentifier.DAT, seqno, [b"abc", b"de"], {"n": seqno}))
+        writer.close()
+        # preallocated space is released
+        assert os.path.getsize(path) == writer.nbytes
+
+        with RawFileReader(path) as reader:
+            assert len(reader) == 2 + 50 + 45
+            assert reader.senders == ["typed", "frames"]
+            assert reader[0].msgtype == CDTPMessageIdentifier.BOR
+            assert reader[0].payload == {"mock_cfg": 1}
+            assert np.all(np.diff(reader.index["timestamp"]) >= 0)
+
+            record = reader.get("typed", 42)
+            assert record.sequence_number == 42
+            array = reader.payload_array(record)
+            assert array.dtype == RECORD_DTYPE
+            assert np.all(array["timestamp"] == 42)
+            # views into the mapped file
+            assert not array.flags.writeable
+            del array, record
+
+            record = reader.get("frames", 23)
+            assert [bytes(frame) for frame in record.payload] == [b"abc", b"de"]
+            assert record.meta == {"n": 23}
+            assert reader.payload_array(record) is None
+            with pytest.raises(KeyError):
+                reader.find("frames", 30)
+            del record
+
+
+@pytest.mark.forked
+def test_raw_data_writer(commander, data_transmitter):
+    """Test the RawDataWriter satellite writing a run."""
+    receiver = RawDataWriter(
+        name="mock_receiver",
+        group="mockstellation",
+        cmd_port=CMD_PORT,
+        mon_port=MON_PORT,
+        hb_port=33333,
+        interface="127.0.0.1",
+    )
+    threading.Thread(target=receiver.run_satellite, daemon=True).start()
+    time.sleep(0.2)
+    with TemporaryDirectory() as tmpdir:
+        commander.request_get_response("initialize", {"_output_path": tmpdir, "write_size": 4096})
+        wait_for_state(receiver.fsm, "INIT", 1)
+        receiver._add_sender(
+            DiscoveredService(get_uuid("simple_sender"), CHIRPServiceIdentifier.DATA, "127.0.0.1", port=DATA_PORT)
+        )
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+
+        payload = np.arange(10000, dtype=np.int32)
+        data_transmitter.send_start({"mock_cfg": 1}, meta={SCHEMA_META_KEY: ArraySchema(np.int32).to_meta()})
+        for _ in range(20):
+            data_transmitter.send_data(payload)
+        commander.request_get_response("stop")
+        data_transmitter.send_end({})
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+
+        (path,) = pathlib.Path(tmpdir).glob("run_1_*.cdtp")
+        with RawFileReader(path) as reader:
+            assert len(reader) == 22
+            assert reader[0].payload == {"mock_cfg": 1}
+            assert reader[21].msgtype == CDTPMessageIdentifier.EOR
+            for seqno in (1, 20):
+                assert np.array_equal(reader.payload_array(reader.get("simple_sender", seqno)), payload)
+
+
+@pytest.mark.forked
+def test_receive_extendible_datasets(
+    receiver_satellite,
+    data_transmitter,
+    commander,
+):
+    """Test appending the data of each sender to resizable datasets."""
+    receiver = receiver_satellite
+    ctx = zmq.Context()
+    socket = ctx.socket(zmq.PUSH)
+    socket.bind(f"tcp://127.0.0.1:{DATA_PORT + 1}")
+    untyped = DataTransmitter("untyped_sender", socket)
+    with TemporaryDirectory() as tmpdir:
+        config = {"_file_name_pattern": FILE_NAME, "_output_path": tmpdir, "layout": "extendible"}
+        commander.request_get_response("initialize", config)
+        wait_for_state(receiver.fsm, "INIT", 1)
+        for port, name in [(DATA_PORT, "simple_sender"), (DATA_PORT + 1, "untyped_sender")]:
+            receiver._add_sender(DiscoveredService(get_uuid(name), CHIRPServiceIdentifier.DATA, "127.0.0.1", port=port))
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+
+        records = np.zeros(5, dtype=RECORD_DTYPE)
+        data_transmitter.send_start({}, meta={SCHEMA_META_KEY: ArraySchema(RECORD_DTYPE, (5,)).to_meta()})
+        untyped.send_start({})
+        for seqno in range(1, 11):
+            records["timestamp"] = seqno
+            data_transmitter.send_data(records)
+            untyped.send_data(np.arange(seqno, dtype=np.uint16), meta={"dtype": "<u2"})
+        # a message with a frame per row
+        data_transmitter.send_data([records, records])
+        commander.request_get_response("stop")
+        data_transmitter.send_end({})
+        untyped.send_end({})
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+
+        with h5py.File(os.path.join(tmpdir, FILE_NAME.format(run_identifier=1))) as h5file:
+            grp = h5file["simple_sender"]
+            assert grp["data"].dtype == RECORD_DTYPE
+            assert grp["data"].shape == (12, 5)
+            assert len(grp["index"]) == 11
+            assert np.all(read_stream_message(grp, 4)["timestamp"] == 4)
+            assert read_stream_message(grp, 11).shape == (2, 5)
+            assert not [key for key in grp.keys() if key.startswith("data_")]
+
+            grp = h5file["untyped_sender"]
+            assert grp["data"].dtype == np.uint16
+            assert grp["data"].shape == (55,)
+            assert np.array_equal(read_stream_message(grp, 7), np.arange(7))
+            assert list(grp["index"]["offset"][:4]) == [0, 1, 3, 6]
+
+
+@pytest.mark.forked
+def test_receive_staged_writes(
+    receiver_satellite,
+    data_transmitter,
+    commander,
+):
+    """Test collecting the data of extendible datasets in staging arrays."""
+    receiver = receiver_satellite
+    with TemporaryDirectory() as tmpdir:
+        # room for three messages
+        config = {
+            "_file_name_pattern": FILE_NAME,
+            "_output_path": tmpdir,
+            "layout": "extendible",
+            "staging_bytes": 3 * 5 * RECORD_DTYPE.itemsize,
+        }
+        commander.request_get_response("initialize", config)
+        wait_for_state(receiver.fsm, "INIT", 1)
+        receiver._add_sender(
+            DiscoveredService(get_uuid("simple_sender"), CHIRPServiceIdentifier.DATA, "127.0.0.1", port=DATA_PORT)
+        )
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+
+        records = np.zeros(5, dtype=RECORD_DTYPE)
+        data_transmitter.send_start({}, meta={SCHEMA_META_KEY: ArraySchema(RECORD_DTYPE, (5,)).to_meta()})
+        for seqno in range(1, 11):
+            records["timestamp"] = seqno
+            data_transmitter.send_data(records)
+        # larger than the staging array
+        data_transmitter.send_data([records] * 4)
+        time.sleep(0.3)
+        # three full staging arrays and the rest before the large message
+        assert receiver.staging_stats["staging_writes"] == 4
+        assert receiver._get_staging_nbytes() == 0
+        data_transmitter.send_data(records)
+        time.sleep(0.3)
+        assert receiver._get_staging_nbytes() == 5 * RECORD_DTYPE.itemsize
+        assert "staging_nbytes" in receiver._metrics_callbacks
+        # drained at the EOR
+        data_transmitter.send_end({})
+        time.sleep(0.3)
+        assert receiver._get_staging_nbytes() == 0
+        assert receiver.staging_stats["staging_write_time"] > 0
+        commander.request_get_response("stop")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+
+        with h5py.File(os.path.join(tmpdir, FILE_NAME.format(run_identifier=1))) as h5file:
+            grp = h5file["simple_sender"]
+            assert grp["data"].shape == (15, 5)
+            assert list(grp["data"]["timestamp"][:, 0]) == list(range(1, 11)) + [10] * 5
+            assert list(grp["index"]["sequence"]) == list(range(1, 13))
+            assert read_stream_message(grp, 11).shape == (4, 5)
+
+
+@pytest.mark.forked
+def test_receive_compressed_datasets(
+    receiver_satellite,
+    data_transmitter,
+    commander,
+):
+    """Test writing compressed and chunked datasets."""
+    receiver = receiver_satellite
+    with TemporaryDirectory() as tmpdir:
+        config = {
+            "_file_name_pattern": FILE_NAME,
+            "_output_path": tmpdir,
+            "layout": "extendible",
+            "compression": "gzip",
+            "compression_level": 4,
+            "shuffle": True,
+            "chunk_rows": 8,
+            "cache_size": 4 * 1024 * 1024,
+            "cache_slots": 1009,
+        }
+        commander.request_get_response("initialize", config)
+        wait_for_state(receiver.fsm, "INIT", 1)
+        receiver._add_sender(
+            DiscoveredService(get_uuid("simple_sender"), CHIRPServiceIdentifier.DATA, "127.0.0.1", port=DATA_PORT)
+        )
+        commander.request_get_response("launch")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        commander.request_get_response("start", "1")
+        wait_for_state(receiver.fsm, "RUN", 1)
+
+        records = np.zeros(64, dtype=RECORD_DTYPE)
+        data_transmitter.send_start({}, meta={SCHEMA_META_KEY: ArraySchema(RECORD_DTYPE, (64,)).to_meta()})
+        for _ in range(100):
+            data_transmitter.send_data(records)
+        data_transmitter.send_end({})
+        time.sleep(0.5)
+        commander.request_get_response("stop")
+        wait_for_state(receiver.fsm, "ORBIT", 1)
+        # highly compressible data
+        assert receiver.run_report["data_bytes"] == 100 * records.nbytes
+        assert receiver.run_report["compression_ratio"] > 1
+        assert receiver.run_report["write_rate"] > 0
+        assert "compression_ratio" in receiver._metrics_callbacks
+
+        with h5py.File(os.path.join(tmpdir, FILE_NAME.format(run_identifier=1))) as h5file:
+            dset = h5file["simple_sender"]["data"]
+            assert dset.shape == (100, 64)
+            assert dset.compression == "gzip"
+            assert dset.compression_opts == 4
+            assert dset.shuffle
+            assert dset.chunks == (8, 64)
+
+        # created in the output path, removed with the temporary directory
+        h5file = receiver._open_file(pathlib.Path("cache.h5"))
+        try:
+            assert h5file.filename == os.path.join(tmpdir, "cache.h5")
+            assert h5file.id.get_access_plist().get_cache()[1:3] == (1009, 4 * 1024 * 1024)
+        finally:
+            h5file.close()
+
+
+@pytest.mark.forked
+def test_receive_unknown_compression(receiver_satellite, commander):
+    """Test that an unknown compression fails the initialization."""
+    receiver = receiver_satellite
+    commander.request_get_response("initialize", {"compression": "bzip2"})
+    wait_for_state(receiver.fsm, "ERROR", 1)
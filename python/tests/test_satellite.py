@@ -9,10 +9,14 @@ import time
 import threading
 from unittest.mock import MagicMock, patch
 
+import zmq
+
 from constellation.core.cscp import CSCPMessageVerb, CommandTransmitter
 from constellation.core.fsm import SatelliteState
 
+from constellation.core.base import BaseSatelliteFrame
 from constellation.core.satellite import Satellite
+from constellation.core.zmqcontext import acquire_context, context_stats, release_context, set_affinity
 
 from constellation.core.broadcastmanager import (
     chirp_callback,
@@ -376,3 +380,38 @@ def test_satellite_run_fail(mock_cmd_transmitter, mock_fail_satellite):
         req = sender.get_message()
         assert state.lower() in req.msg.lower()
         assert req.msg_verb == CSCPMessageVerb.SUCCESS
+
+
+@pytest.mark.forked
+def test_shared_context():
+    """Test that components share a ZMQ context which lives until the last one released it."""
+    ctx = acquire_context(io_threads=3)
+    assert acquire_context() is ctx
+    assert context_stats() == {"contexts": 1, "io_threads": 3, "users": 2}
+    # bulk data is kept off the first I/O thread
+    socket = ctx.socket(zmq.PUSH)
+    set_affinity(socket)
+    assert socket.getsockopt(zmq.AFFINITY) == 0b110
+    socket.close()
+    release_context()
+    assert not ctx.closed
+    release_context()
+    assert ctx.closed
+    assert context_stats()["contexts"] == 0
+    assert acquire_context() is not ctx
+    release_context()
+
+
+@pytest.mark.forked
+def test_reentry_releases_context_once():
+    """Test that reentering a component twice does not release the context of the others."""
+    first = BaseSatelliteFrame("first", "127.0.0.1")
+    second = BaseSatelliteFrame("second", "127.0.0.1")
+    assert first.context is second.context
+    assert context_stats()["users"] == 2
+    first.reentry()
+    first.reentry()
+    assert context_stats() == {"contexts": 1, "io_threads": 1, "users": 1}
+    assert not second.context.closed
+    second.reentry()
+    assert second.context.closed